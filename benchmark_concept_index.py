@@ -0,0 +1,147 @@
+import time
+import logging
+import argparse
+import tracemalloc
+
+import numpy as np
+
+from logger_setup import logger
+from modules.concept_index import (ExactConceptIndex, IVFConceptIndex, QuantizedConceptIndex, DEFAULT_RERANK,
+                                  normalize_embeddings)
+
+# The dimension of the synthetic embeddings, the dimension of all-MiniLM-L6-v2
+EMBEDDING_DIMENSION = 384
+
+
+def generate_synthetic_embeddings(num_concepts: int, num_columns: int, dimension: int, seed: int = 0,
+                                  num_topics: int = 200, noise: float = 0.5) -> tuple:
+    """
+    Generates concept and column embeddings. Like real concept names, the concepts are
+    grouped around topics, and every column is a noisy copy of one of the concepts.
+
+    :param num_concepts: The number of concept embeddings.
+    :param num_columns: The number of column (query) embeddings.
+    :param dimension: The dimension of the embeddings.
+    :param seed: The seed of the generator, the same seed always gives the same embeddings.
+    :param num_topics: The number of topics the concepts are grouped around.
+    :param noise: The scale of the noise added to the concepts, relative to their length.
+    :return: (concept embeddings, column embeddings)
+    """
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(num_topics, dimension)).astype(np.float32)
+    concepts = topics[rng.integers(num_topics, size=num_concepts)] + \
+        rng.normal(size=(num_concepts, dimension)).astype(np.float32)
+    columns = concepts[rng.integers(num_concepts, size=num_columns)] + \
+        noise * rng.normal(size=(num_columns, dimension)).astype(np.float32) * np.sqrt(2)
+    return concepts, columns
+
+
+
+def index_megabytes(index) -> float:
+    """
+    Returns the memory the arrays of an index hold, the float embeddings a quantized
+    index re-ranks with are not included, they stay memory-mapped in the store.
+    """
+    return sum(np.asarray(array).nbytes for array in index.arrays().values()) / (1024 * 1024)
+
+
+
+def measure(index, queries, top_k: int, exact_indices, exact_scores) -> dict:
+    """
+    Measures the search latency and peak memory of an index, and its recall and score
+    error against the exact results.
+
+    :return: The measurements of this index
+    """
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    indices, scores = index.search(queries, top_k)
+    seconds = time.perf_counter() - start_time
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    recall_at_k = np.mean([len(set(found) & set(expected)) / len(expected)
+                           for found, expected in zip(indices, exact_indices)])
+    return {
+        "recall@1": float(np.mean(indices[:, 0] == exact_indices[:, 0])),
+        f"recall@{top_k}": float(recall_at_k),
+        "max_score_error": float(np.abs(scores[:, 0] - exact_scores[:, 0]).max()),
+        "seconds": seconds,
+        "ms_per_column": 1000 * seconds / len(queries),
+        "index_mb": index_megabytes(index),
+        "peak_mb": peak_bytes / (1024 * 1024),
+    }
+
+
+
+def print_row(name: str, settings: str, build_seconds, result: dict, exact_seconds: float, top_k: int):
+    """
+    Prints the measurements of one index.
+    """
+    build = f"{build_seconds:.1f}s" if build_seconds is not None else "-"
+    print(f"{name:<10} {settings:<18} {build:>8} {result['seconds']:>8.2f}s {result['ms_per_column']:>8.3f} "
+          f"{result['index_mb']:>9.1f} {result['peak_mb']:>8.1f} {result['recall@1']:>9.3f} "
+          f"{result[f'recall@{top_k}']:>9.3f} {result['max_score_error']:>10.2e} "
+          f"{exact_seconds / result['seconds']:>7.1f}x")
+
+
+
+def main():
+    """
+    Benchmarks the quantized and approximate (IVF) concept indexes against the exact
+    brute-force scan, on synthetic embeddings, for every precision and every combination
+    of n_lists and n_probe, so the index and its parameters can be picked for a catalog
+    size. An empty --precisions or --n-lists skips those indexes.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the recall and latency of the concept indexes.")
+    parser.add_argument('--concepts', type=int, default=100000, help='The number of concepts')
+    parser.add_argument('--columns', type=int, default=5000, help='The number of columns to match')
+    parser.add_argument('--dimension', type=int, default=EMBEDDING_DIMENSION, help='The embedding dimension')
+    parser.add_argument('--n-lists', type=str, default="0", help='Comma separated IVF list counts, 0 is the default')
+    parser.add_argument('--n-probes', type=str, default="4,8,16,32,64", help='Comma separated IVF probe counts')
+    parser.add_argument('--precisions', type=str, default="int8,float16", help='Comma separated quantized precisions')
+    parser.add_argument('--rerank', type=int, default=DEFAULT_RERANK, help='The candidates re-ranked by a quantized index')
+    parser.add_argument('--top-k', type=int, default=3, help='The number of candidates per column')
+    parser.add_argument('--noise', type=float, default=0.5, help='The noise of the columns around their concept')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the embeddings and the k-means')
+    args = parser.parse_args()
+
+    # The index build logging would interleave with the report
+    logger.setLevel(logging.WARNING)
+
+    concepts, columns = generate_synthetic_embeddings(args.concepts, args.columns, args.dimension,
+                                                      seed=args.seed, noise=args.noise)
+    queries = normalize_embeddings(columns)
+
+    exact = ExactConceptIndex.build(concepts)
+    start_time = time.perf_counter()
+    exact_indices, exact_scores = exact.search(queries, args.top_k)
+    exact_seconds = time.perf_counter() - start_time
+
+    print(f"{args.concepts} concepts, {args.columns} columns, dimension {args.dimension}, top {args.top_k}")
+    print(f"{'index':<10} {'settings':<18} {'build':>8} {'search':>9} {'ms/col':>8} {'index MB':>9} "
+          f"{'peak MB':>8} {'recall@1':>9} {f'recall@{args.top_k}':>9} {'max error':>10} {'speedup':>8}")
+    print_row("exact", "float32", None, measure(exact, queries, args.top_k, exact_indices, exact_scores),
+              exact_seconds, args.top_k)
+
+    for precision in filter(None, args.precisions.split(",")):
+        start_time = time.perf_counter()
+        quantized = QuantizedConceptIndex.build(concepts, precision=precision, rerank=args.rerank)
+        build_seconds = time.perf_counter() - start_time
+        print_row("quantized", f"{precision} rerank={args.rerank}", build_seconds,
+                  measure(quantized, queries, args.top_k, exact_indices, exact_scores), exact_seconds, args.top_k)
+
+    for n_lists in filter(None, args.n_lists.split(",")):
+        start_time = time.perf_counter()
+        ivf = IVFConceptIndex.build(concepts, n_lists=int(n_lists) or None, seed=args.seed)
+        build_seconds = time.perf_counter() - start_time
+
+        for n_probe in args.n_probes.split(","):
+            ivf.n_probe = int(n_probe)
+            print_row("ivf", f"lists={len(ivf.centroids)} probe={ivf.n_probe}", build_seconds,
+                      measure(ivf, queries, args.top_k, exact_indices, exact_scores), exact_seconds, args.top_k)
+
+
+# Execute the script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import sys
+import time
+import random
+import logging
+import argparse
+
+from logger_setup import logger
+from modules.concept_embeddings import (get_embedding_model, embedding_similarity, EMBEDDING_MODEL,
+                                        EMBEDDING_BACKENDS, DEFAULT_BACKEND, EMBEDDING_TOLERANCE)
+
+# The words the synthetic column names are made of
+COLUMN_WORDS = ("patient", "encounter", "provider", "organization", "payer", "claim", "procedure",
+                "observation", "condition", "medication", "immunization", "birth", "death", "start",
+                "stop", "date", "time", "code", "system", "display", "description", "status", "reason",
+                "amount", "cost", "unit", "value", "type", "address", "city", "state", "zip", "id")
+
+
+def generate_column_names(num_columns: int, seed: int = 0) -> list:
+    """
+    Generates column names like the ones of the synthea catalog, two to four words
+    joined with underscores.
+
+    :param num_columns: The number of column names.
+    :param seed: The seed of the generator, the same seed always gives the same names.
+    :return: The column names
+    """
+    rng = random.Random(seed)
+    return ["_".join(rng.choice(COLUMN_WORDS) for _ in range(rng.randint(2, 4))) for _ in range(num_columns)]
+
+
+
+def run_backend(backend: str, threads, batch_size: int, column_names: list, reference) -> dict:
+    """
+    Measures the load time and the encoding throughput of one backend, and compares its
+    embeddings with the reference embeddings.
+
+    :return: The measurements of this backend
+    """
+    start_time = time.perf_counter()
+    model = get_embedding_model(EMBEDDING_MODEL, backend, threads, batch_size)
+    load_seconds = time.perf_counter() - start_time
+
+    # Warm up the one-time costs (graph optimization, allocations) outside the measurements
+    model.encode(column_names[:batch_size])
+
+    start_time = time.perf_counter()
+    embeddings = model.encode(column_names)
+    seconds = time.perf_counter() - start_time
+
+    similarity = embedding_similarity(reference, embeddings) if reference is not None else None
+    return {
+        "backend": backend,
+        "threads": threads or "default",
+        "batch_size": batch_size,
+        "load_seconds": load_seconds,
+        "columns_per_second": len(column_names) / seconds if seconds else 0.0,
+        "min_similarity": float(similarity.min()) if similarity is not None else 1.0,
+        "mean_similarity": float(similarity.mean()) if similarity is not None else 1.0,
+        "embeddings": embeddings,
+    }
+
+
+
+def main():
+    """
+    Benchmarks the CPU inference backends of the embedding model, for every combination
+    of thread count and batch size, and checks their embeddings against the torch
+    reference model. Exits with status 1 when a backend is outside the tolerance.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the embedding backends of the concept matching.")
+    parser.add_argument('--backends', type=str, default=",".join(EMBEDDING_BACKENDS), help='Comma separated backends')
+    parser.add_argument('--threads', type=str, default="0", help='Comma separated thread counts, 0 is the default')
+    parser.add_argument('--batch-sizes', type=str, default="32,64,128", help='Comma separated batch sizes')
+    parser.add_argument('--columns', type=int, default=5000, help='The number of column names to encode')
+    parser.add_argument('--tolerance', type=float, default=EMBEDDING_TOLERANCE,
+                        help='The minimum cosine similarity with the reference embeddings')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the column names')
+    args = parser.parse_args()
+
+    # The model loading logging would interleave with the report
+    logger.setLevel(logging.WARNING)
+
+    column_names = generate_column_names(args.columns, seed=args.seed)
+    reference = run_backend(DEFAULT_BACKEND, None, 64, column_names, None)["embeddings"]
+
+    print(f"{args.columns} column names, model {EMBEDDING_MODEL}, reference {DEFAULT_BACKEND}, "
+          f"tolerance {args.tolerance}")
+    print(f"{'backend':<12} {'threads':>8} {'batch':>6} {'load':>8} {'columns/s':>10} "
+          f"{'min cos':>8} {'mean cos':>9} {'status':<7}")
+
+    failures = []
+    for backend in args.backends.split(","):
+        for threads in args.threads.split(","):
+            for batch_size in args.batch_sizes.split(","):
+                result = run_backend(backend, int(threads) or None, int(batch_size), column_names, reference)
+                status = "ok" if result["min_similarity"] >= args.tolerance else "FAILED"
+                if status != "ok":
+                    failures.append(f"{backend}: minimum cosine similarity {result['min_similarity']:.4f}")
+
+                print(f"{result['backend']:<12} {result['threads']:>8} {result['batch_size']:>6} "
+                      f"{result['load_seconds']:>7.1f}s {result['columns_per_second']:>10.1f} "
+                      f"{result['min_similarity']:>8.4f} {result['mean_similarity']:>9.4f} {status:<7}")
+
+    for failure in failures:
+        print(f"OUT OF TOLERANCE {failure}")
+    if failures:
+        sys.exit(1)
+
+
+
+# Execute the script
+if __name__ == "__main__":
+    main()
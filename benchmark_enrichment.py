@@ -0,0 +1,238 @@
+import sys
+import json
+import copy
+import time
+import random
+import logging
+import argparse
+import tracemalloc
+from pathlib import Path
+
+from logger_setup import logger
+from modules.fake_llm import FakeChatModel
+from modules.FHIResourceManager import FHIRResourceManager
+from modules.prompt_cache import ContextCache
+from modules.description_tiers import DescriptionTiers, DEFAULT_TIER
+from modules.schema_utils import count_fields
+from modules.schema_chunker import tokenizer_name
+
+# The default location of the stored baselines
+BASELINE_FILE = "benchmarks/enrichment_baselines.json"
+
+# The metrics that only depend on the schema, the seed and the tokenizer, so they are
+# the same on every machine. Only these are compared with the baselines, timings and
+# memory are reported but vary too much between runs and machines to gate on.
+DETERMINISTIC_METRICS = ("llm_calls", "prompt_tokens", "completion_tokens")
+
+# The BigQuery types used for the scalar fields of a synthetic schema
+SCALAR_TYPES = ("STRING", "INTEGER", "FLOAT", "BOOLEAN", "TIMESTAMP", "DATE", "NUMERIC")
+
+
+def generate_synthetic_schema(num_fields: int, max_depth: int, seed: int = 0, shape_reuse: float = 0.3) -> list:
+    """
+    Generates a BigQuery schema with (about) num_fields fields, nested up to max_depth levels.
+
+    Like a FHIR schema, a part of the RECORDs (shape_reuse) repeats a RECORD shape
+    that was generated before, the way identifier, coding and period repeat.
+
+    :param num_fields: The number of fields to generate, including nested subfields.
+    :param max_depth: The maximum nesting depth, 1 generates a flat schema.
+    :param seed: The seed of the generator, the same seed always gives the same schema.
+    :param shape_reuse: The fraction of RECORDs that repeat an earlier shape.
+    :return: The schema, a list of fields
+    """
+    rng = random.Random(seed)
+    shapes = []
+    remaining = [num_fields]
+
+    def make_fields(depth: int, prefix: str) -> list:
+        fields = []
+        width = rng.randint(3, 12) if depth > 1 else remaining[0]
+
+        for i in range(width):
+            if remaining[0] <= 0:
+                break
+
+            name = f"{prefix}f{i}"
+            remaining[0] -= 1
+            field = {"name": name, "mode": rng.choice(("", "NULLABLE", "REPEATED")), "description": ""}
+
+            if depth < max_depth and remaining[0] > 3 and rng.random() < 0.25:
+                field["type"] = "RECORD"
+                shape = rng.choice(shapes) if shapes and rng.random() < shape_reuse else None
+                if shape is not None and shape[1] <= remaining[0]:
+                    field["fields"] = copy.deepcopy(shape[0])
+                    remaining[0] -= shape[1]
+                else:
+                    field["fields"] = make_fields(depth + 1, f"{name}_")
+                    shapes.append((field["fields"], count_fields(field["fields"])))
+            else:
+                field["type"] = rng.choice(SCALAR_TYPES)
+                field["fields"] = []
+
+            fields.append(field)
+        return fields
+
+    return make_fields(1, "")
+
+
+
+def run_case(num_fields: int, max_depth: int, args) -> dict:
+    """
+    Benchmarks the enrichment, struct filtering and SQL generation of one synthetic schema.
+
+    :return: The measurements of this case
+    """
+    schema = generate_synthetic_schema(num_fields, max_depth, seed=args.seed)
+    field_count = count_fields(schema)
+
+    llm = FakeChatModel(latency_seconds=args.latency, tokens_per_second=args.tokens_per_second,
+                        failure_rate=args.failure_rate, malformed_rate=args.malformed_rate,
+                        drop_rate=args.drop_rate, description_length=args.description_length, seed=args.seed)
+    fhir_mgr = FHIRResourceManager(llm, "benchmark.synthetic.fhir_encounters",
+                                   max_concurrency=args.concurrency, retry_base_delay=0.0,
+                                   dedupe_shapes=args.dedupe_shapes,
+                                   wire_format=args.wire_format, context_cache=ContextCache(),
+                                   description_tiers=DescriptionTiers(default_tier=args.description_tier))
+
+    tracemalloc.start()
+    start_time = time.perf_counter()
+
+    enriched_schema = fhir_mgr.generate_enriched_schema(schema)
+    enrichment_seconds = time.perf_counter() - start_time
+
+    stage_start = time.perf_counter()
+    sql = None
+    if enriched_schema is not None:
+        fhir_mgr.filter_empty_structs(enriched_schema)
+        sql = fhir_mgr.generate_sql(enriched_schema, "A synthetic benchmark table.", "create")
+    sql_seconds = time.perf_counter() - stage_start
+
+    wall_seconds = time.perf_counter() - start_time
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "case": f"{num_fields}x{max_depth}",
+        "fields": field_count,
+        "depth": max_depth,
+        "status": "ok" if sql else "failed",
+        "llm_calls": llm.calls,
+        "prompt_tokens": fhir_mgr.input_tokens,
+        "completion_tokens": fhir_mgr.output_tokens,
+        "tokenizer": tokenizer_name(llm.model_name),
+        "wall_seconds": round(wall_seconds, 4),
+        "enrichment_seconds": round(enrichment_seconds, 4),
+        "sql_seconds": round(sql_seconds, 4),
+        "fields_per_second": round(field_count / wall_seconds, 1) if wall_seconds else 0.0,
+        "peak_memory_mb": round(peak_bytes / (1024 * 1024), 2),
+        "cached_prompt_pct": round(100 * fhir_mgr.cached_input_tokens / fhir_mgr.input_tokens, 1)
+                             if fhir_mgr.input_tokens else 0.0,
+    }
+
+
+
+def compare_with_baselines(results: list, baselines: dict, tolerance: float) -> list:
+    """
+    Compares the deterministic metrics of the results with the stored baselines.
+
+    Token counts (and the chunking that depends on them) differ between tokenizers,
+    so a case is only compared with a baseline that was measured with the same one.
+
+    :return: The descriptions of all regressions, cases that failed or metrics that
+             grew by more than the tolerance
+    """
+    regressions = []
+    for result in results:
+        baseline = baselines.get(result["case"])
+        if not baseline or baseline.get("tokenizer") != result["tokenizer"]:
+            continue
+
+        if result["status"] != "ok" and baseline["status"] == "ok":
+            regressions.append(f"{result['case']}: {result['status']}, baseline {baseline['status']}")
+
+        for metric in DETERMINISTIC_METRICS:
+            if result[metric] > baseline[metric] * (1 + tolerance):
+                regressions.append(f"{result['case']}: {result[metric]} {metric}, baseline {baseline[metric]}")
+    return regressions
+
+
+
+def print_report(results: list, baselines: dict):
+    """
+    Prints the measurements of every case, next to its baseline token usage.
+    """
+    print(f"{'case':<12} {'fields':>7} {'status':<7} {'calls':>6} {'tokens':>10} {'wall':>9} {'enrich':>9} "
+          f"{'sql':>8} {'fields/s':>10} {'peak MB':>8} {'cached':>7} {'baseline':>10} {'delta':>7}")
+
+    for result in results:
+        tokens = result["prompt_tokens"] + result["completion_tokens"]
+        baseline = baselines.get(result["case"], {})
+        baseline_tokens = (baseline.get("prompt_tokens", 0) + baseline.get("completion_tokens", 0)
+                           if baseline.get("tokenizer") == result["tokenizer"] else 0)
+        delta = f"{(tokens / baseline_tokens - 1):+.0%}" if baseline_tokens else "-"
+        print(f"{result['case']:<12} {result['fields']:>7} {result['status']:<7} {result['llm_calls']:>6} "
+              f"{tokens:>10} {result['wall_seconds']:>8.2f}s {result['enrichment_seconds']:>8.2f}s "
+              f"{result['sql_seconds']:>7.2f}s {result['fields_per_second']:>10.1f} {result['peak_memory_mb']:>8.1f} "
+              f"{result['cached_prompt_pct']:>6.1f}% {baseline_tokens if baseline_tokens else '-':>10} {delta:>7}")
+
+
+
+def main():
+    """
+    Runs the enrichment benchmark against the fake LLM, for every combination of
+    schema size and nesting depth, and compares the results with the stored baselines.
+    Exits with status 1 when a case failed, or needed more LLM calls or tokens than
+    its baseline allows.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the schema enrichment path with a fake LLM.")
+    parser.add_argument('--sizes', type=str, default="100,1000,10000,50000", help='Comma separated schema sizes')
+    parser.add_argument('--depths', type=str, default="1,3,6", help='Comma separated maximum nesting depths')
+    parser.add_argument('--concurrency', type=int, default=4, help='The max_concurrency of the manager')
+    parser.add_argument('--wire-format', type=str, default="compact", help='The wire format, compact or json')
+    parser.add_argument('--dedupe-shapes', action='store_true', help='Describe repeated RECORD shapes once')
+    parser.add_argument('--latency', type=float, default=0.0, help='The fixed latency of every fake request')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help='The output token rate of the fake LLM')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='The fraction of requests that fail')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='The fraction of malformed responses')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='The fraction of fields left out of responses')
+    parser.add_argument('--description-tier', type=str, default=DEFAULT_TIER, help='The description tier of all fields')
+    parser.add_argument('--description-length', type=int, default=200, help='The description length of the fake LLM')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the schemas and the fake LLM')
+    parser.add_argument('--baseline-file', type=str, default=BASELINE_FILE, help='The location of the baselines')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baselines')
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help='The allowed growth of the LLM calls and tokens, as a fraction')
+    args = parser.parse_args()
+
+    # The per-call logging would dominate the measurements
+    logger.setLevel(logging.WARNING)
+
+    baseline_path = Path(args.baseline_file)
+    baselines = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+
+    # Warm up the one-time costs (prompt templates, tokenizer) outside the measurements
+    run_case(10, 1, args)
+
+    results = [run_case(int(size), int(depth), args)
+               for size in args.sizes.split(",") for depth in args.depths.split(",")]
+    print_report(results, baselines)
+
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baselines.update({result["case"]: result for result in results})
+        baseline_path.write_text(json.dumps(baselines, indent=2))
+        print(f"Baselines saved to: {baseline_path}")
+        return
+
+    regressions = compare_with_baselines(results, baselines, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+
+# Execute the script
+if __name__ == "__main__":
+    main()
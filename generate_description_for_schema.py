@@ -1,14 +1,28 @@
 import yaml
 import json
+import time
+import glob
 import argparse
-import argparse
+import contextvars
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from logger_setup import logger, log_entry_exit
 
 from modules.create_table_sql import generate_create_table_sql 
 from modules.FHIResourceManager import FHIRResourceManager 
 from modules.llm_utils import get_llm
+from modules.llm_cache import LLMResponseCache, LLM_CACHE_DB
+from modules.schema_chunker import TokenBudget
+from modules.enrichment_journal import EnrichmentJournal, CHECKPOINT_DIR
+from modules.batch_jobs import BatchJobClient, BATCH_DIR, check_batch_model
+from modules.description_store import DescriptionStore, DESCRIPTION_STORE_DB
+from modules.model_cascade import CascadeTier, log_cascade_report
+from modules.llm_telemetry import get_telemetry, start_metrics_server, TELEMETRY_DIR
+from modules.prompt_cache import ContextCache
+from modules.description_tiers import DescriptionTiers, DEFAULT_TIER
+from modules.description_normalizer import (normalize_enriched_schema, normalize_description, 
+                                            log_normalization_changes)
 
 
 # This is the max length of the description that can be stored in BigQuery
@@ -134,15 +148,16 @@ def parse_yaml_data(config_data):
     app_name    = config_data['app']['app_name'].strip()
     app_version = config_data['app']['app_version'].strip()
 
-    # Access the file information
-    input_schema_location  = config_data['files']['input_schema'].strip()
-    output_schema_location = config_data['files']['output_schema'].strip()
-    sql_output_location    = config_data['files']['sql_output'].strip()
+    # Access the file information, these are absent in a batch YAML file
+    # that lists its tables in the 'batch' block
+    input_schema_location  = (config_data['files'].get('input_schema') or '').strip()
+    output_schema_location = (config_data['files'].get('output_schema') or '').strip()
+    sql_output_location    = (config_data['files'].get('sql_output') or '').strip()
 
     # Get the big query info
     project_id  = config_data['bigquery']['project_id'].strip()
     dataset_id  = config_data['bigquery']['dataset_id'].strip()
-    table_id    = config_data['bigquery']['table_id'].strip()
+    table_id    = (config_data['bigquery'].get('table_id') or '').strip()
     location    = config_data['bigquery']['location'].strip()
     mode        = config_data['bigquery']['mode'].strip()
 
@@ -158,22 +173,473 @@ def parse_yaml_data(config_data):
 
 
 
+#  ---------------------------------------------------------------------------
+# This function will parse the optional tuning settings from the 
+# 'llm' block of the YAML data
+#  ---------------------------------------------------------------------------
+@log_entry_exit
+def parse_llm_settings(config_data):
+    """
+    Parses the optional tuning settings from the 'llm' block of the YAML data.
+    Settings that are not present in the YAML file fall back to their defaults.
+
+    :param config_data: The YAML data to parse.
+    :return: The LLM tuning settings as a dictionary
+    """
+    llm_config = config_data.get('llm') or {}
+
+    return {
+        # The number of schema chunks that are sent to the LLM at the same time
+        'max_concurrency': int(llm_config.get('max_concurrency', 1)),
+
+        # Token budget overrides, by default the known limits of the model are used
+        'max_input_tokens': llm_config.get('max_input_tokens'),
+        'max_output_tokens': llm_config.get('max_output_tokens'),
+        'output_tokens_per_field': llm_config.get('output_tokens_per_field'),
+
+        # How often missing or unparseable fields are requested again, and the base
+        # delay (in seconds) of the exponential backoff between those retries
+        'max_retries': int(llm_config.get('max_retries', 3)),
+        'retry_base_delay': float(llm_config.get('retry_base_delay', 1.0)),
+
+        # Describe the subfields of repeated RECORD shapes (identifier, coding, ...) only once
+        'dedupe_record_shapes': bool(llm_config.get('dedupe_record_shapes', False)),
+
+        # 'compact' sends field paths and only gets the descriptions back, 'json' has the
+        # LLM echo the complete field JSON
+        'wire_format': llm_config.get('wire_format', "compact"),
+
+        # The optional model cascade, from the cheapest to the most capable model
+        'cascade': llm_config.get('cascade') or [],
+
+        # The description length tier (short, standard, long) per field pattern
+        'description_tiers': llm_config.get('description_tiers') or {},
+
+        # The provider quota for the model, requests are paced to stay just under it
+        'requests_per_minute': llm_config.get('requests_per_minute'),
+        'tokens_per_minute': llm_config.get('tokens_per_minute'),
+    }
+
+
+
+#  ---------------------------------------------------------------------------
+# This function will create the LLM response cache from the optional 
+# 'cache' block of the YAML data
+#  ---------------------------------------------------------------------------
+@log_entry_exit
+def build_response_cache(config_data):
+    """
+    Creates the LLM response cache described by the 'cache' block of the YAML data.
+
+    :param config_data: The YAML data to parse.
+    :return: An LLMResponseCache, or None if the cache is disabled
+    """
+    cache_config = config_data.get('cache') or {}
+
+    if not cache_config.get('enabled', False):
+        logger.info("LLM response cache is disabled.")
+        return None
+
+    return LLMResponseCache(
+        db_path=cache_config.get('path', LLM_CACHE_DB),
+        max_entries=cache_config.get('max_entries', 10000),
+        max_age_days=cache_config.get('max_age_days', 30))
+
+
+
+#  ---------------------------------------------------------------------------
+# This function will create the Batch API client from the optional 
+# 'batch_api' block of the YAML data
+#  ---------------------------------------------------------------------------
+@log_entry_exit
+def build_batch_client(config_data, model_names):
+    """
+    Creates the Batch API client described by the 'batch_api' block of the YAML data.
+    The client speaks the OpenAI Batch API, so every model of the run must be an
+    OpenAI model.
+
+    :param config_data: The YAML data to parse.
+    :param model_names: The model and the cascade models of the run.
+    :return: A BatchJobClient
+    :raises ValueError: If one of the models is not served by the OpenAI Batch API
+    """
+    for model_name in model_names:
+        check_batch_model(model_name)
+
+    batch_api_config = config_data.get('batch_api') or {}
+
+    return BatchJobClient(
+        base_url=batch_api_config.get('base_url', "https://api.openai.com/v1"),
+        batch_dir=batch_api_config.get('batch_dir', BATCH_DIR),
+        poll_interval_seconds=batch_api_config.get('poll_interval_seconds', 60),
+        timeout_seconds=float(batch_api_config.get('timeout_hours', 24)) * 60 * 60)
+
+
+
+#  ---------------------------------------------------------------------------
+# This function will create the cross-resource description store from the 
+# optional 'description_store' block of the YAML data
+#  ---------------------------------------------------------------------------
+@log_entry_exit
+def build_description_store(config_data):
+    """
+    Creates the description store described by the 'description_store' block of the YAML data.
+
+    :param config_data: The YAML data to parse.
+    :return: A DescriptionStore, or None if the store is disabled
+    """
+    store_config = config_data.get('description_store') or {}
+
+    if not store_config.get('enabled', False):
+        logger.info("Description store is disabled.")
+        return None
+
+    return DescriptionStore(
+        db_path=store_config.get('path', DESCRIPTION_STORE_DB),
+        reuse_policy=store_config.get('reuse_policy', "exact"))
+
+
+
+#  ---------------------------------------------------------------------------
+# This function will create the provider-side context cache from the 
+# optional 'prompt_cache' block of the YAML data
+#  ---------------------------------------------------------------------------
+@log_entry_exit
+def build_context_cache(config_data):
+    """
+    Creates the context cache described by the 'prompt_cache' block of the YAML data.
+
+    :param config_data: The YAML data to parse.
+    :return: A ContextCache, or None if prompt caching is disabled
+    """
+    prompt_cache_config = config_data.get('prompt_cache') or {}
+
+    if not prompt_cache_config.get('enabled', False):
+        logger.info("Provider-side prompt caching is disabled.")
+        return None
+
+    return ContextCache(
+        ttl_seconds=prompt_cache_config.get('ttl_seconds', 3600),
+        min_prefix_tokens=prompt_cache_config.get('min_prefix_tokens'))
+
+
+
+#  ---------------------------------------------------------------------------
+# This function will create the description length tiers from the 
+# 'llm.description_tiers' block of the YAML data
+#  ---------------------------------------------------------------------------
+@log_entry_exit
+def build_description_tiers(llm_settings):
+    """
+    Creates the description length tiers of the 'description_tiers' LLM settings.
+
+    The block has an optional 'default_tier', a list of 'patterns' (each with a 
+    'pattern' and a 'tier') and optional 'limits' that override the character 
+    limits of the tiers.
+
+    :param llm_settings: The LLM tuning settings, see parse_llm_settings.
+    :return: A DescriptionTiers
+    """
+    tiers_config = llm_settings['description_tiers']
+
+    return DescriptionTiers(
+        default_tier=tiers_config.get('default_tier', DEFAULT_TIER),
+        patterns=tiers_config.get('patterns'),
+        limits=tiers_config.get('limits'))
+
+
+
+#  ---------------------------------------------------------------------------
+# This function will create the tiers of the optional model cascade from 
+# the 'llm.cascade' list of the YAML data
+#  ---------------------------------------------------------------------------
+@log_entry_exit
+def build_cascade_tiers(llm_settings):
+    """
+    Creates a CascadeTier for every entry of the 'cascade' list of the LLM settings.
+
+    Every entry has a 'model', and optionally its 'input_cost_per_million' and 
+    'output_cost_per_million' prices and its own 'requests_per_minute' and 
+    'tokens_per_minute' quota.
+
+    :param llm_settings: The LLM tuning settings, see parse_llm_settings.
+    :return: A list of CascadeTier, empty if no cascade is configured
+    """
+    tiers = []
+    for tier_config in llm_settings['cascade']:
+        model_name = tier_config['model']
+        tier_llm = get_llm(model_name,
+                           requests_per_minute=tier_config.get('requests_per_minute', llm_settings['requests_per_minute']),
+                           tokens_per_minute=tier_config.get('tokens_per_minute', llm_settings['tokens_per_minute']))
+        token_budget = TokenBudget(model_name,
+                                   max_input_tokens=tier_config.get('max_input_tokens'),
+                                   max_output_tokens=tier_config.get('max_output_tokens'),
+                                   output_tokens_per_field=llm_settings['output_tokens_per_field'])
+
+        tiers.append(CascadeTier(model_name, tier_llm, token_budget,
+                                 input_cost_per_million=tier_config.get('input_cost_per_million', 0.0),
+                                 output_cost_per_million=tier_config.get('output_cost_per_million', 0.0)))
+    return tiers
+
+
+
+#  ---------------------------------------------------------------------------
+# This function will build the list of tables to process, either the single
+# table of a regular YAML file, or all tables of the 'batch' block
+#  ---------------------------------------------------------------------------
+@log_entry_exit
+def build_table_jobs(config_data):
+    """
+    Builds the list of tables to describe from the YAML data.
+
+    A regular YAML file describes a single table through 'bigquery.table_id' and the 
+    'files' block. A batch YAML file has a 'batch' block that either lists the tables
+    (each with a table_id, input_schema, output_schema and sql_output), or provides an
+    'input_glob' of schema files together with an 'output_dir'. For a glob, the table
+    id is the file name of the schema without its extension.
+
+    :param config_data: The YAML data to parse.
+    :return: A list of table jobs, each a dictionary
+    """
+    project_id = config_data['bigquery']['project_id'].strip()
+    dataset_id = config_data['bigquery']['dataset_id'].strip()
+    batch_config = config_data.get('batch') or {}
+    files_config = config_data.get('files') or {}
+
+    table_entries = []
+    for table in batch_config.get('tables') or []:
+        table_entries.append(table)
+
+    # Every schema file matching the glob becomes a table
+    if batch_config.get('input_glob'):
+        output_dir = batch_config.get('output_dir', '.').strip()
+        for input_schema in sorted(glob.glob(batch_config['input_glob'].strip())):
+            table_id = Path(input_schema).stem
+            table_entries.append({
+                'table_id': table_id,
+                'input_schema': input_schema,
+                'output_schema': str(Path(output_dir) / f"{table_id}_with_descriptions.json"),
+                'sql_output': str(Path(output_dir) / f"{table_id}_{config_data['bigquery']['mode'].strip()}_table.sql"),
+            })
+
+    # Without a batch block, we process the single table of the YAML file
+    if not batch_config:
+        table_entries.append({
+            'table_id': config_data['bigquery']['table_id'],
+            'input_schema': files_config['input_schema'],
+            'output_schema': files_config['output_schema'],
+            'sql_output': files_config['sql_output'],
+        })
+
+    jobs = []
+    for entry in table_entries:
+        table_id = entry['table_id'].strip()
+        jobs.append({
+            'table_id': table_id,
+            'full_table_name': f"{project_id}.{dataset_id}.{table_id}",
+            'input_schema': entry['input_schema'].strip(),
+            'output_schema': entry['output_schema'].strip(),
+            'sql_output': entry['sql_output'].strip(),
+        })
+
+    return jobs
+
+
+
+#  ---------------------------------------------------------------------------
+# This function will run a single, timed stage of the table pipeline
+#  ---------------------------------------------------------------------------
+def run_stage(stage_name, stage_function, timings):
+    """
+    Runs a single stage of the table pipeline, and records and logs its duration.
+
+    :param stage_name: The name of the stage, the duration is stored as '<stage_name>_seconds'.
+    :param stage_function: The function that runs the stage.
+    :param timings: The timings dictionary of the table.
+    :return: The result of the stage function
+    """
+    stage_start = time.perf_counter()
+    try:
+        return stage_function()
+    finally:
+        timings[f'{stage_name}_seconds'] = time.perf_counter() - stage_start
+        logger.info(f"Stage '{stage_name}' finished in {timings[f'{stage_name}_seconds']:.2f}s")
+
+
+
+#  ---------------------------------------------------------------------------
+# This function will describe a single table: table description, enriched 
+# schema and SQL statements
+#  ---------------------------------------------------------------------------
+@log_entry_exit
+def process_table(job, llm, llm_settings, response_cache, mode, checkpoint_dir, args, batch_client=None,
+                  description_store=None, cascade_tiers=None, context_cache=None, description_tiers=None):
+    """
+    Generates the table description, the enriched schema and the SQL statements for one table.
+
+    :param job: The table job, see build_table_jobs.
+    :param llm: The (shared) language model instance.
+    :param llm_settings: The LLM tuning settings, see parse_llm_settings.
+    :param response_cache: The (shared) LLM response cache, or None.
+    :param mode: The SQL mode, either "create" or "alter".
+    :param checkpoint_dir: The directory for the enrichment journals.
+    :param args: The parsed command line arguments.
+    :param batch_client: The Batch API client used in batch mode, or None.
+    :param description_store: The (shared) cross-resource description store, or None.
+    :param cascade_tiers: The (shared) tiers of the model cascade, or None.
+    :param context_cache: The (shared) provider-side context cache, or None.
+    :param description_tiers: The description length tiers, or None for the default tier.
+    :return: A dictionary with the status and the stage timings of this table
+    """
+    full_table_name = job['full_table_name']
+    output_schema_location = job['output_schema']
+    timings = {'table': job['table_id'], 'status': 'failed'}
+    start_time = time.perf_counter()
+
+    # Load the input schema, representing the complete schema for the table
+    schema = load_schema(job['input_schema'])
+
+    # Determine the corresponding FHIR resource name from the table name
+    token_budget = TokenBudget(llm_settings['model'],
+                               max_input_tokens=llm_settings['max_input_tokens'],
+                               max_output_tokens=llm_settings['max_output_tokens'],
+                               output_tokens_per_field=llm_settings['output_tokens_per_field'])
+    fhir_mgr = FHIRResourceManager(llm, full_table_name, 
+                                   max_concurrency=llm_settings['max_concurrency'],
+                                   cache=response_cache,
+                                   token_budget=token_budget,
+                                   max_retries=llm_settings['max_retries'],
+                                   retry_base_delay=llm_settings['retry_base_delay'],
+                                   batch_client=batch_client,
+                                   dedupe_shapes=llm_settings['dedupe_record_shapes'],
+                                   wire_format=llm_settings['wire_format'],
+                                   cascade_tiers=cascade_tiers,
+                                   description_store=description_store,
+                                   context_cache=context_cache,
+                                   description_tiers=description_tiers)
+    logger.info(f"FHIR Resource Name Identified: {fhir_mgr.fhir_resource_name}")
+
+    # Every completed chunk is journaled, so an interrupted run can be resumed
+    journal = EnrichmentJournal(full_table_name, schema, checkpoint_dir, resume=args.resume)
+
+    def enrich_schema():
+        # In incremental mode, the previous output schema provides the descriptions
+        # of all fields that did not change since the last run
+        if args.incremental and Path(output_schema_location).exists():
+            logger.info(f"Loading previous enriched schema from: '{output_schema_location}'")
+            previous_schema = load_schema(output_schema_location)
+            return fhir_mgr.generate_incremental_enriched_schema(schema, previous_schema, journal=journal)
+
+        if args.incremental:
+            logger.info("No previous enriched schema found, enriching the complete schema.")
+        return fhir_mgr.generate_enriched_schema(schema, journal=journal)
+
+    # The table description and the schema enrichment are independent, so the table
+    # description is generated in the background while the chunks are enriched. 
+    # Only the SQL generation needs both
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        description_future = executor.submit(contextvars.copy_context().run, run_stage, 
+                                             'description', fhir_mgr.generate_table_description, timings)
+
+        # Create an enriched schema with additional descriptions for each field
+        logger.info("Generating enriched schema with descriptions...")
+        enriched_schema = run_stage('enrichment', enrich_schema, timings)
+
+        if enriched_schema is None:
+            logger.error(f"Enriched schema generation failed, completed chunks are journaled in: '{journal.path}'. "
+                         f"Re-run with --resume to continue.")
+            timings['total_seconds'] = time.perf_counter() - start_time
+            return timings
+        logger.info("Enriched schema generation completed.")
+
+        # Fields the LLM never described stay in the schema (and the DDL), without a description
+        timings['unresolved_fields'] = len(fhir_mgr.unresolved_paths)
+        if fhir_mgr.unresolved_paths:
+            logger.warning(f"{len(fhir_mgr.unresolved_paths)} fields of '{full_table_name}' have no description: "
+                           f"{', '.join(sorted(fhir_mgr.unresolved_paths))}")
+
+        # Enforce the character limit and clean up the generated attributes locally,
+        # so BigQuery does not reject the DDL and we do not need another LLM round trip
+        enriched_schema, changes = normalize_enriched_schema(enriched_schema, CHARACTER_LIMIT)
+
+        # Save the enriched schema to the output location, after which the journal is no longer needed
+        save_enriched_schema(enriched_schema, output_schema_location)
+        journal.clear()
+        logger.info(f"Enriched schema successfully saved to: '{output_schema_location}'")
+
+        # Wait for the table description, which usually finished long before the enrichment
+        wait_start = time.perf_counter()
+        table_description = description_future.result()
+        timings['description_wait_seconds'] = time.perf_counter() - wait_start
+        logger.info(f"Table Description Generated...")
+
+    table_description, table_changes = normalize_description(table_description, CHARACTER_LIMIT)
+    log_normalization_changes(full_table_name, changes + [("<table>", change) for change in table_changes])
+    
+    # Generate SQL statements (ALTER 
+    # TABLE / CREATE TABLE) based on the mode
+    logger.info("Starting the SQL generation process...")
+    generated_sql = run_stage('sql', lambda: fhir_mgr.generate_sql(enriched_schema, table_description, mode), timings)
+    logger.info("SQL generation completed.")
+
+    # Save the generated SQL file
+    save_final_sql(generated_sql, job['sql_output'])
+    logger.info(f"Generated SQL saved to: '{job['sql_output']}'")
+
+    timings['status'] = 'ok'
+    timings['total_seconds'] = time.perf_counter() - start_time
+    return timings
+
+
+
+@log_entry_exit
+def log_run_summary(table_timings, wall_seconds):
+    """
+    Logs a summary with the status and stage timings of every table in the run.
+    """
+    logger.info(f"Run summary: {len(table_timings)} tables in {wall_seconds:.1f}s")
+    logger.info(f"{'table':<40} {'status':<8} {'description':>12} {'enrichment':>12} {'desc wait':>10} "
+                f"{'sql':>8} {'total':>8}")
+
+    for timings in table_timings:
+        logger.info(f"{timings['table']:<40} {timings['status']:<8} "
+                    f"{timings.get('description_seconds', 0.0):>11.1f}s "
+                    f"{timings.get('enrichment_seconds', 0.0):>11.1f}s "
+                    f"{timings.get('description_wait_seconds', 0.0):>9.1f}s "
+                    f"{timings.get('sql_seconds', 0.0):>7.1f}s "
+                    f"{timings.get('total_seconds', 0.0):>7.1f}s")
+
+
+
 # Main function to orchestrate the process
 def main():
     """
     Parses arguments, reads YAML configuration, and orchestrates the process of
     generating enriched descriptions for FHIR schema fields and generating SQL statements
     to either create a new table, or update an existing table with ALTER statements.
+
+    A batch YAML file describes several tables in one process. The tables share the
+    LLM client, the rate limiter and the response cache, and up to 
+    batch.max_table_concurrency tables are processed at the same time.
     """
 
     # Argument parser for YAML file location
     parser = argparse.ArgumentParser(description="Generate rich descriptions for FHIR schema fields.")
     parser.add_argument('--yaml', type=str, required=True, help='The location of the YAML file')
+    parser.add_argument('--resume', action='store_true', 
+                        help='Resume an interrupted run, skipping the chunks that were already journaled')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only describe fields that were added or changed since the previous output schema')
+    parser.add_argument('--batch', action='store_true',
+                        help='Submit the schema chunks as an offline Batch API job instead of interactive requests')
 
     # Parse arguments and extract the YAML source path
     args = parser.parse_args()
     yaml_source_path = Path(args.yaml)
     logger.info(f"YAML Source Path: {yaml_source_path}")
+    logger.info(f"Resume Mode: {args.resume}")
+    logger.info(f"Incremental Mode: {args.incremental}")
+    logger.info(f"Batch Mode: {args.batch}")
 
     # Read YAML configuration file
     config_data = read_yaml_file(yaml_source_path)
@@ -188,55 +654,86 @@ def main():
         sql_output_location, project_id, dataset_id, table_id,
         full_table_name, location, mode, llm_model
     ) = parse_yaml_data(config_data)
+    llm_settings = parse_llm_settings(config_data)
+    llm_settings['model'] = llm_model
+    table_jobs = build_table_jobs(config_data)
+    max_table_concurrency = max(1, int((config_data.get('batch') or {}).get('max_table_concurrency', 1)))
+
+    # Batch mode only works for OpenAI models, reject it before any client is created
+    try:
+        batch_client = build_batch_client(
+            config_data, [llm_model] + [tier['model'] for tier in llm_settings['cascade']]) if args.batch else None
+    except ValueError as e:
+        parser.error(str(e))
 
     # Log the parsed arguments for debugging
     indentation = ' ' * 25
     logger.info(f"Parsed YAML Arguments: \n"
-            f"{indentation}input_schema_location..................: '{input_schema_location}',\n"
-            f"{indentation}output_schema_location.................: '{output_schema_location}',\n"
-            f"{indentation}sql_output_location....................: '{sql_output_location}',\n"
             f"{indentation}project_id.............................: '{project_id}',\n"
             f"{indentation}dateset_id.............................: '{dataset_id}',\n"
-            f"{indentation}table_id...............................: '{table_id}',\n"
-            f"{indentation}full_table_name........................: '{full_table_name}',\n"
+            f"{indentation}tables.................................: '{', '.join(job['table_id'] for job in table_jobs)}',\n"
+            f"{indentation}table_concurrency......................: '{max_table_concurrency}',\n"
             f"{indentation}location...............................: '{location}',\n"
             f"{indentation}mode...................................: '{mode}',\n"
-            f"{indentation}LLM Model..............................: '{llm_model}'")
-
-
-    # Initialize the Language Model (LLM)
-    llm = get_llm(llm_model)
-
-    # Load the input schema, representing the complete schema for the table
-    schema = load_schema(input_schema_location)
-
-    # Determine the corresponding FHIR resource name from the table name
-    fhir_mgr = FHIRResourceManager(llm, full_table_name)
-    logger.info(f"FHIR Resource Name Identified: {fhir_mgr.fhir_resource_name}")
-
-    # Generate a table-level description for the FHIR table
-    table_description = fhir_mgr.generate_table_description()
-    logger.info(f"Table Description Generated...")
-
-
-    # Create an enriched schema with additional descriptions for each field
-    logger.info("Generating enriched schema with descriptions...")
-    enriched_schema = fhir_mgr.generate_enriched_schema(schema)
-    logger.info("Enriched schema generation completed.")
-
-    # Save the enriched schema to the output location
-    save_enriched_schema(enriched_schema, output_schema_location)
-    logger.info(f"Enriched schema successfully saved to: '{output_schema_location}'")
-    
-    # Generate SQL statements (ALTER 
-    # TABLE / CREATE TABLE) based on the mode
-    logger.info("Starting the SQL generation process...")
-    generated_sql = fhir_mgr.generate_sql(enriched_schema, table_description, mode)
-    logger.info("SQL generation completed.")
-
-    # Save the generated SQL file
-    save_final_sql(generated_sql, sql_output_location)
-    logger.info(f"Generated SQL saved to: '{sql_output_location}'")
+            f"{indentation}LLM Model..............................: '{llm_model}',\n"
+            f"{indentation}LLM Max Concurrency....................: '{llm_settings['max_concurrency']}',\n"
+            f"{indentation}LLM Cascade............................: '{' -> '.join(tier['model'] for tier in llm_settings['cascade']) or 'none'}'")
+
+
+    # Initialize the Language Model (LLM) and the response cache once, 
+    # they are shared by all tables in this run
+    llm = get_llm(llm_model, 
+                  requests_per_minute=llm_settings['requests_per_minute'],
+                  tokens_per_minute=llm_settings['tokens_per_minute'])
+    response_cache = build_response_cache(config_data)
+    description_store = build_description_store(config_data)
+    cascade_tiers = build_cascade_tiers(llm_settings)
+    context_cache = build_context_cache(config_data)
+    description_tiers = build_description_tiers(llm_settings)
+
+    # Expose the per-request LLM metrics to Prometheus while the run is in progress
+    telemetry_config = config_data.get('telemetry') or {}
+    if telemetry_config.get('prometheus_port'):
+        start_metrics_server(telemetry_config['prometheus_port'])
+    checkpoint_dir = ((config_data.get('files') or {}).get('checkpoint_dir') or CHECKPOINT_DIR).strip()
+
+    # Process the tables, several at a time in batch mode
+    run_start = time.perf_counter()
+
+    def run_table(job):
+        try:
+            return process_table(job, llm, llm_settings, response_cache, mode, checkpoint_dir, args,
+                                 batch_client=batch_client, description_store=description_store,
+                                 cascade_tiers=cascade_tiers, context_cache=context_cache,
+                                 description_tiers=description_tiers)
+        except Exception as e:
+            logger.error(f"Processing table '{job['table_id']}' failed: {e}")
+            return {'table': job['table_id'], 'status': 'failed'}
+
+    if max_table_concurrency == 1 or len(table_jobs) <= 1:
+        table_timings = [run_table(job) for job in table_jobs]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_table_concurrency, len(table_jobs))) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, run_table, job) for job in table_jobs]
+            table_timings = [future.result() for future in futures]
+
+    log_run_summary(table_timings, time.perf_counter() - run_start)
+
+    if cascade_tiers:
+        log_cascade_report(cascade_tiers)
+
+    if response_cache is not None:
+        response_cache.log_stats()
+
+    if description_store is not None:
+        description_store.log_stats()
+
+    # Report how much of the prompts the provider served from its prompt cache
+    get_telemetry().log_prompt_cache_report()
+
+    # Write the per-run LLM telemetry summary
+    telemetry_dir = telemetry_config.get('summary_dir', TELEMETRY_DIR)
+    get_telemetry().write_summary(str(Path(telemetry_dir) / f"run_{time.strftime('%Y%m%d_%H%M%S')}.json"))
 
     logger.info("Process completed successfully.")
 
@@ -2,6 +2,10 @@
 import json
 
 from modules.process_metadata import process_metadata
+from modules.llm_cache import LLMResponseCache
+from modules.llm_telemetry import get_telemetry
+from modules.concept_embeddings import ConceptEmbeddingStore
+from modules.embedding_config import EMBEDDING_CONFIG
 from modules.synthea_config import DB_CONFIG as SYNTHEA_DB_CONFIG
 from modules.Information_schema_retrieval import fetch_metadata_from_information_schema
 
@@ -9,7 +13,12 @@ metadata = fetch_metadata_from_information_schema(SYNTHEA_DB_CONFIG)
 
 # Step 2: Process the fetched metadata
 if metadata:
-    descriptions = process_metadata(metadata)
+    response_cache = LLMResponseCache()
+    embedding_store = ConceptEmbeddingStore(backend=EMBEDDING_CONFIG['backend'])
+    descriptions = process_metadata(metadata, cache=response_cache, embedding_store=embedding_store,
+                                    embedding_config=EMBEDDING_CONFIG)
+    response_cache.log_stats()
+    get_telemetry().write_summary("telemetry/main_run.json")
 
     # Step 3: Save the descriptions to a file
     with open("database_descriptions.json", "w") as f:
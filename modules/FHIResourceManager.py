@@ -1,25 +1,56 @@
+import copy
 import json
-from langchain.schema import HumanMessage
+import math
+import time
+import uuid
+import random
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import HumanMessage
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.exceptions import OutputParserException
 
 from prompts.read_prompt_template import read_prompt_template
 from prompts import prompt_names
 from logger_setup import logger, log_entry_exit
-from db.get_prompt_by_name import get_prompt_by_name
+from modules.llm_cache import describe_llm
+from modules.batch_jobs import build_chat_request, check_batch_model
+from modules.enrichment_journal import fingerprint
+from modules.model_cascade import validate_enriched_field
+from modules.llm_telemetry import get_telemetry
+from modules.prompt_cache import static_prompt_prefix, cached_prompt_tokens
+from modules.description_tiers import DescriptionTiers, output_tokens_per_field, MAX_TOKENS_HEADROOM
+from modules.llm_utils import max_tokens_kwargs
+from modules.schema_chunker import TokenBudget, count_tokens, plan_schema_chunks
+from modules.schema_utils import (merge_split_records, count_fields, index_by_path, 
+                                  diff_schemas, prune_schema, merge_descriptions,
+                                  reconcile_fields, find_missing_fields,
+                                  dedupe_record_shapes, project_record_shapes,
+                                  compact_field_lines, expand_compact_response)
 
 # This is the max length of the description that can be stored in BigQuery
 # for either a column or a table, we did not make this a YAML parameter
 # since it is a constant value
 CHARACTER_LIMIT = 1024
 
+# The wire formats of the enrichment requests:
+# - compact: the fields are sent as 'path TYPE MODE' lines, and the LLM only returns
+#   the generated attributes per path. The structure is rebuilt from the input schema
+# - json: the full field JSON is sent, and the LLM echoes it back with the attributes added
+WIRE_FORMATS = ("compact", "json")
+
 class FHIRResourceManager:
     """
     This class encapsulates the functionality to manage FHIR resources in the context of BigQuery tables.
     """
 
     @log_entry_exit
-    def __init__(self, llm, full_table_name):
+    def __init__(self, llm, full_table_name, max_concurrency=1, cache=None, token_budget=None,
+                 max_retries=3, retry_base_delay=1.0, batch_client=None, dedupe_shapes=False,
+                 description_store=None, wire_format="compact", cascade_tiers=None, context_cache=None,
+                 description_tiers=None):
         """
         Initializes the FHIRResourceManager instance.
 
@@ -27,12 +58,51 @@ class FHIRResourceManager:
         - llm: The language model instance. Used for LLM processing in the class.
         - full_table_name (str): The fully qualified BigQuery table name in the format 
           "project.dataset.table_name".
+        - max_concurrency (int): The maximum number of schema chunks that are sent to the
+          LLM at the same time. A value of 1 (the default) processes the chunks serially.
+        - cache (LLMResponseCache): An optional response cache. When provided, prompts
+          that were answered before are served from the cache instead of the LLM.
+        - token_budget (TokenBudget): The token budget for a single enrichment request.
+          Defaults to the known input/output limits of the model.
+        - max_retries (int): How often missing or unparseable fields of a chunk are requested again.
+        - retry_base_delay (float): The base delay in seconds for the exponential backoff between retries.
+        - batch_client (BatchJobClient): When provided, the chunks are enriched through a single
+          (offline) batch job instead of interactive LLM calls. Only OpenAI models can be
+          used with a batch client, see check_batch_model.
+        - dedupe_shapes (bool): If True, the subfields of repeated RECORD shapes (identifier,
+          coding, period, ...) are only described once per resource, and the descriptions
+          of the first occurrence are copied to the others. Off by default, since those
+          descriptions can keep wording that only fits the first occurrence.
+        - description_store (DescriptionStore): When provided, fields that were described
+          before are taken from the store, and newly described fields are added to it.
+        - wire_format (str): The format of the enrichment requests, one of WIRE_FORMATS.
+        - cascade_tiers (list): An optional list of CascadeTier, from the cheapest to the most
+          capable model. When provided, the tiers are used for the enrichment instead of llm,
+          and only the fields that fail validation are sent to the next tier.
+        - context_cache (ContextCache): When provided, the static prefix of the enrichment
+          prompt is registered as a provider-side context cache, see modules/prompt_cache.py.
+        - description_tiers (DescriptionTiers): The description length tier of every field.
+          Defaults to the long tier (CHARACTER_LIMIT characters) for all fields.
 
         Attributes:
         - self.llm_model: Stores the provided language model instance.
         - self._fhir_resource_name: Extracts and stores the FHIR resource name derived 
                                     from the provided BigQuery table name.
         - self._full_table_name: Stores the provided full table name.
+        - self._max_concurrency: Stores the maximum number of chunk requests kept in flight.
+        - self._cache: Stores the optional LLM response cache.
+        - self._token_budget: Stores the token budget used to chunk the schema.
+        - self._max_retries / self._retry_base_delay: Store the retry settings for chunk repair.
+        - self._batch_client: Stores the optional batch job client.
+        - self._dedupe_shapes: Stores whether repeated RECORD shapes are described once.
+        - self._description_store: Stores the optional cross-resource description store.
+        - self._wire_format: Stores the wire format of the enrichment requests.
+        - self._cascade_tiers: Stores the optional model cascade.
+        - self._context_cache: Stores the optional provider-side context cache.
+        - self._description_tiers: Stores the description length tiers.
+        - self.input_tokens / self.output_tokens: Count the tokens sent to and received from the LLM.
+        - self.cached_input_tokens: Counts the input tokens served from the provider's prompt cache.
+        - self.unresolved_paths: The paths of the fields that are left without a description.
         """
 
         # Store the provided language model instance
@@ -44,6 +114,53 @@ class FHIRResourceManager:
         # Extract and store the FHIR resource name
         self._fhir_resource_name = self._extract_fhir_resource_name(full_table_name) 
 
+        # Store the maximum number of chunk requests we keep in flight,
+        # anything below 1 falls back to serial processing
+        self._max_concurrency = max(1, int(max_concurrency or 1))
+
+        # Store the optional LLM response cache
+        self._cache = cache
+
+        # Store the token budget, by default derived from the model's limits
+        self._token_budget = token_budget or TokenBudget(describe_llm(llm)[0])
+
+        # Store the retry settings used to repair incomplete chunk responses
+        self._max_retries = max(0, int(max_retries))
+        self._retry_base_delay = float(retry_base_delay)
+
+        # Store the optional batch job client, used for offline bulk enrichment
+        if batch_client is not None:
+            check_batch_model(describe_llm(llm)[0])
+        self._batch_client = batch_client
+
+        # FHIR schemas repeat the same datatypes, we describe each RECORD shape once
+        self._dedupe_shapes = dedupe_shapes
+
+        # Descriptions of common elements are shared across tables and resources
+        self._description_store = description_store
+
+        # The compact wire format only has the LLM return descriptions, not the structure
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"Unknown wire format '{wire_format}', expected one of {', '.join(WIRE_FORMATS)}")
+        self._wire_format = wire_format
+
+        # Cheap models describe the fields first, failing fields escalate to the next tier
+        self._cascade_tiers = cascade_tiers or []
+
+        # The static prompt prefix is shared by every chunk, the provider can cache it
+        self._context_cache = context_cache
+
+        # Trivial fields get short descriptions, and their requests a lower max_tokens
+        self._description_tiers = description_tiers or DescriptionTiers()
+
+        # Token usage of this manager's LLM requests, for cost reporting
+        self._usage_lock = threading.Lock()
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_input_tokens = 0
+
+        # The dotted paths of the fields of the last enriched schema the LLM did not describe
+        self.unresolved_paths = set()
 
 
     @property
@@ -164,11 +281,8 @@ class FHIRResourceManager:
                             table_name=self.fhir_resource_name, 
                             description_length=CHARACTER_LIMIT) 
 
-            # Create a message array containing the formatted prompt
-            messages = [HumanMessage(content=prompt)]
-
-            # Invoke the LLM model to generate a description
-            description = self.llm_model.invoke(input=messages).content
+            # Invoke the LLM model (or the response cache) to generate a description
+            description = self._invoke_llm(prompt, source="table")
 
             # Log successful retrieval of the description
             logger.info(f"Generated description for FHIR resource '{self._fhir_resource_name}' successfully retrieved.")
@@ -181,74 +295,229 @@ class FHIRResourceManager:
             return None
 
 
-    @log_entry_exit  
-    def generate_enriched_schema(self, json_schema):
+    @log_entry_exit
+    def generate_enriched_schema(self, json_schema, journal=None):
         """
         This methoid generates an enriched schema by adding column-level 
         descriptionss for a given FHIR resource.
 
         Args:
         - json_schema (dict): The JSON schema for the FHIR resource.
+        - journal (EnrichmentJournal): An optional journal. Every completed chunk is
+          written to it as soon as it finishes, and chunks that are already in the
+          journal (from an earlier, interrupted run) are not sent to the LLM again.
 
         Returns:
         - list: The enriched schema with the column descriptions.
         """
+        if self._description_store is None:
+            return self._flag_unresolved(self._cascade_enriched_schema(json_schema, journal))
+
+        # Fields that were described before (for this or, depending on the reuse
+        # policy, another resource) are taken from the description store
+        schema_index = index_by_path(json_schema)
+        stored_index = self._description_store.lookup(self._fhir_resource_name, schema_index)
+        generate_paths = set(schema_index) - set(stored_index)
+
+        logger.info(f"Description store for '{self._fhir_resource_name}': {len(stored_index)} fields reused, "
+                    f"{len(generate_paths)} fields to generate.")
+
+        # Only the remaining fields (and their parent RECORDs) are sent to the LLM
+        generated_index = {}
+        if generate_paths:
+            enriched_delta = self._cascade_enriched_schema(prune_schema(json_schema, generate_paths), journal)
+            if enriched_delta is None:
+                return None
+
+            generated_index = index_by_path(enriched_delta)
+            self._description_store.save(self._fhir_resource_name, 
+                                         {path: generated_index[path] for path in generate_paths 
+                                          if (generated_index.get(path) or {}).get("description")})
+
+        return self._flag_unresolved(merge_descriptions(json_schema, [stored_index, generated_index]))
+
+
+
+    def _flag_unresolved(self, enriched_schema):
+        """
+        Records the paths of the fields of an enriched schema that have no description
+        in unresolved_paths, and returns the schema.
+        """
+        if enriched_schema is not None:
+            self.unresolved_paths = {path for path, field in index_by_path(enriched_schema).items()
+                                     if not field.get("description")}
+        return enriched_schema
+
+
+
+    def _cascade_enriched_schema(self, json_schema, journal=None):
+        """
+        Enriches the schema with the model cascade, or with the LLM of this manager
+        when no cascade is configured.
+
+        Every tier receives the fields that are still pending: all fields for the 
+        first tier, and the fields that failed validation (see validate_enriched_field) 
+        for the tiers after it. A field that fails in every tier keeps the best 
+        description it got, so the last tier's output is never thrown away.
+        """
+        if not self._cascade_tiers:
+            return self._generate_enriched_schema(json_schema, journal)
+
+        accepted_index, fallback_index = {}, {}
+        pending_paths = set(index_by_path(json_schema))
+
+        for level, tier in enumerate(self._cascade_tiers):
+            is_last_tier = level == len(self._cascade_tiers) - 1
+            tier_schema = json_schema if level == 0 else prune_schema(json_schema, pending_paths)
+            tier_manager = self._create_tier_manager(tier)
+
+            # The journal only holds the chunks of the first tier
+            start_time = time.perf_counter()
+            tier_index = index_by_path(tier_manager._generate_enriched_schema(
+                tier_schema, journal if level == 0 else None) or [])
+            seconds = time.perf_counter() - start_time
+
+            failed_paths = set()
+            for path in pending_paths:
+                problems = validate_enriched_field(tier_index.get(path), CHARACTER_LIMIT)
+                if not problems:
+                    accepted_index[path] = tier_index[path]
+                    continue
+
+                failed_paths.add(path)
+                logger.debug(f"Field '{path}' failed validation with {tier.model_name}: {', '.join(problems)}")
+                if (tier_index.get(path) or {}).get("description"):
+                    fallback_index[path] = tier_index[path]
+
+            tier.record(fields_sent=len(pending_paths), fields_accepted=len(pending_paths) - len(failed_paths),
+                        fields_escalated=0 if is_last_tier else len(failed_paths), seconds=seconds,
+                        input_tokens=tier_manager.input_tokens, output_tokens=tier_manager.output_tokens)
+
+            logger.info(f"Cascade tier {level + 1} ({tier.model_name}) accepted "
+                        f"{len(pending_paths) - len(failed_paths)} of {len(pending_paths)} fields in {seconds:.1f}s.")
+
+            pending_paths = failed_paths
+            if not pending_paths:
+                break
+
+        if pending_paths:
+            logger.warning(f"{len(pending_paths)} fields failed validation in every cascade tier.")
+
+        return merge_descriptions(json_schema, [accepted_index, fallback_index])
+
+
+
+    def _create_tier_manager(self, tier):
+        """
+        Creates a manager with the same settings as this one for a cascade tier's model.
+        """
+        return FHIRResourceManager(tier.llm, self._full_table_name,
+                                   max_concurrency=self._max_concurrency,
+                                   cache=self._cache,
+                                   token_budget=tier.token_budget,
+                                   max_retries=self._max_retries,
+                                   retry_base_delay=self._retry_base_delay,
+                                   batch_client=self._batch_client,
+                                   dedupe_shapes=self._dedupe_shapes,
+                                   wire_format=self._wire_format,
+                                   context_cache=self._context_cache,
+                                   description_tiers=self._description_tiers)
+
+
+
+    def _generate_enriched_schema(self, json_schema, journal=None):
+        """
+        Sends the schema to the LLM in chunks and returns the enriched schema,
+        see generate_enriched_schema.
+        """
 
         # We use the JSON Output Parser to extract the JSON array from the response
         # Using this parser, we get very predictable results, and we do not have
         # to worry about the structure of the response and extra "bits" emitted
         # by the LLM model
         parser = JsonOutputParser()
-        instructions = parser.get_format_instructions()
 
         logger.info(f"Generating enriched schema for fhir resource: {self._fhir_resource_name}")
 
         try:
-            # Define chunk size (e.g., process 10 fields at a time)
-            # Because of the potentially large size of the models, we decided to 
-            # use chunking here. This is a common practice when working with large
-            # models and large amounts of data. We can adjust the chunk size as needed, 
-            # but 10 is a good starting point.
-            chunk_size = 10
-            logger.info(f"Splitting schema into chunks of {chunk_size} fields...")
-            schema_chunks = [json_schema[i:i + chunk_size] for i in range(0, len(json_schema), chunk_size)]
-    
-
             # Retrieve the appropriate prompt template from our prompt database
-            prompt_name = prompt_names.GENERATE_RESOURCE_SCHEMA_DESCRIPTIONS
+            prompt_name = (prompt_names.GENERATE_RESOURCE_SCHEMA_DESCRIPTIONS_COMPACT if self._wire_format == "compact"
+                           else prompt_names.GENERATE_RESOURCE_SCHEMA_DESCRIPTIONS)
             prompt_template_str = read_prompt_template(prompt_name, "prompts")
 
-            # Set up the prompt template with the expected input variables                  
+            # Set up the prompt template with the expected input variables, the character
+            # length is filled in per description tier                  
             prompt_template = PromptTemplate(
-                input_variables=["input_json_schema", "fhir_resource", "character_length"],
-                template=prompt_template_str)
-
-            # Process each chunk
-            enriched_schema = []
-            for idx, chunk in enumerate(schema_chunks):
-                logger.info(f"Processing chunk {idx + 1}/{len(schema_chunks)}...")
-
-                # Format the prompt with the chunk
-                prompt = prompt_template.format(
-                                fhir_resource=self.fhir_resource_name, 
-                                character_length = CHARACTER_LIMIT,
-                                input_json_schema=json.dumps(chunk, indent=2))
-
-                # Create a message array containing the formatted prompt
-                messages = [HumanMessage(content=prompt)]
-                
-                # Send request to LLM
-                response = self.llm_model.invoke(input=messages).content
-
-                # Parse response and extend enriched schema
-                try:
-                    # Use the JSsonOutputParser to extract the JSON array from the response,
-                    # and add it to the enriched schema
-                    enriched_chunk = parser.parse(response)
+                input_variables=["input_json_schema", "fhir_resource"],
+                template=prompt_template_str,
+                partial_variables={"character_length": CHARACTER_LIMIT})
+
+            # Because of the potentially large size of the schemas, we use chunking here.
+            # The chunks are sized by their measured token counts against the model's
+            # input and output budget, so a chunk of small scalar fields holds many
+            # fields, while an oversized RECORD is split into several pieces. The prompt
+            # size is measured per call, the token budget may be shared with other tables
+            prompt_tokens = count_tokens(
+                prompt_template.format(
+                    fhir_resource=self.fhir_resource_name,
+                    character_length=CHARACTER_LIMIT,
+                    input_json_schema=""),
+                self._token_budget.model_name)
+
+            # The instructions and examples come first in the template, and the resource and
+            # the fields last, so every chunk starts with the same prefix the provider can cache
+            if self._context_cache is not None:
+                self._context_cache.register(self.llm_model, static_prompt_prefix(prompt_template, {}))
+
+            # Repeated RECORD shapes (identifier, coding, period, ...) are only sent with 
+            # their subfields once. Their other occurrences are still described in their 
+            # own context, and receive the shared subfield descriptions afterwards
+            shape_projections = {}
+            if self._dedupe_shapes:
+                deduped_schema, shape_projections = dedupe_record_shapes(json_schema)
+                logger.info(f"Deduplicated {len(shape_projections)} repeated RECORD shapes, "
+                            f"{count_fields(deduped_schema)} of {count_fields(json_schema)} fields are sent to the LLM.")
+                json_schema = deduped_schema
+
+            # Every description tier is enriched on its own, with its own character limit in
+            # the prompt, and chunks sized for the output tokens of its descriptions
+            tier_plans = []
+            for tier, tier_schema in self._description_tiers.split_schema(json_schema):
+                tier_template = prompt_template.partial(
+                    character_length=self._description_tiers.character_limit(tier))
+
+                logger.info(f"Splitting the {tier} tier into token-budgeted chunks...")
+                tier_plans.append((tier, tier_template,
+                                   plan_schema_chunks(tier_schema, self._tier_budget(tier_template, prompt_tokens))))
+
+            # Process the chunks, either serially or with several requests in flight, or
+            # the chunks of all tiers through one batch job. The results come back in the
+            # original chunk order, so the enriched schema has the same field order as the input
+            if self._batch_client is not None:
+                tier_enriched_chunks = self._enrich_chunks_with_batch(
+                    [(tier_template, schema_chunks) for _, tier_template, schema_chunks in tier_plans], parser, journal)
+            else:
+                tier_enriched_chunks = [
+                    self._dispatch_chunks(
+                        schema_chunks,
+                        lambda idx, chunk, tier_template=tier_template, total_chunks=len(schema_chunks):
+                            self._enrich_journaled_chunk(idx, total_chunks, chunk, tier_template, parser, journal))
+                    for _, tier_template, schema_chunks in tier_plans]
+
+            enriched_tier_schemas = []
+            for (tier, _, _), enriched_chunks in zip(tier_plans, tier_enriched_chunks):
+                enriched_schema = []
+                for enriched_chunk in enriched_chunks:
                     enriched_schema.extend(enriched_chunk)
 
-                except json.JSONDecodeError as e:
-                    logger.error(f"Error parsing JSON for chunk {idx + 1}. error:{e}")
+                # Stitch the pieces of RECORD fields that were split across chunks back together
+                enriched_tier_schemas.append((tier, merge_split_records(enriched_schema)))
+
+            enriched_schema = self._description_tiers.merge(json_schema, enriched_tier_schemas)
+
+            # Copy the shared subfield descriptions onto the repeated RECORD shapes
+            if shape_projections:
+                enriched_schema = project_record_shapes(enriched_schema, shape_projections)
 
             logger.info("Creation of enriched schema completed successfully...")
             return enriched_schema
@@ -258,6 +527,486 @@ class FHIRResourceManager:
 
 
 
+    def _enrich_chunk(self, idx, total_chunks, chunk, prompt_template, parser, initial_fields=None):
+        """
+        Sends a single schema chunk to the LLM and parses the enriched fields.
+
+        The returned field names are compared with the chunk's input. Fields that 
+        are missing (the model stopped early or skipped them) or that came back 
+        without a description are requested again, on their own, as are all fields 
+        of a response that could not be parsed. Retries are bounded by max_retries 
+        and spaced with exponential backoff and jitter.
+
+        Args:
+        - idx (int): The zero-based index of the chunk, used for logging.
+        - total_chunks (int): The total number of chunks, used for logging.
+        - chunk (list): The schema fields in this chunk.
+        - prompt_template (PromptTemplate): The enrichment prompt template.
+        - parser (JsonOutputParser): The parser used to extract the JSON array.
+        - initial_fields (list): Enriched fields that were already obtained for this
+          chunk (for example from a batch job). Only the fields missing from them 
+          are requested. 
+
+        Returns:
+        - list: The enriched fields for this chunk, with the structure of the chunk. Fields
+          that are still missing after the last retry keep their name, type, mode and
+          subfields without a description.
+        """
+        logger.info(f"Processing chunk {idx + 1}/{total_chunks}...")
+
+        enriched_fields = []
+        missing_fields = chunk
+        first_attempt = 0
+
+        # Start from the fields we already have, and only repair what is missing
+        if initial_fields is not None:
+            enriched_fields = reconcile_fields(chunk, initial_fields)
+            missing_fields = find_missing_fields(chunk, enriched_fields)
+            first_attempt = 1
+
+        for attempt in range(first_attempt, self._max_retries + 1):
+            if not missing_fields:
+                break
+
+            if attempt > 0:
+                delay = self._retry_delay(attempt)
+                logger.warning(f"Chunk {idx + 1}: re-requesting {count_fields(missing_fields)} missing fields "
+                               f"in {delay:.1f}s (retry {attempt}/{self._max_retries})...")
+                get_telemetry().record_retry(describe_llm(self.llm_model)[0], "missing_fields")
+                time.sleep(delay)
+
+            # Format the prompt with the fields we still need
+            prompt = self._render_chunk_prompt(prompt_template, missing_fields)
+
+            # Send request to LLM and parse the response
+            try:
+                # Use the JSsonOutputParser to extract the JSON array from the response
+                response_fields = self._fields_from_response(missing_fields, 
+                                                             self._invoke_llm(prompt, parse=parser.parse,
+                                                                              label=f"chunk {idx + 1}/{total_chunks}",
+                                                                              max_tokens=self._chunk_max_tokens(
+                                                                                  prompt_template, missing_fields)))
+
+            except (OutputParserException, json.JSONDecodeError) as e:
+                logger.error(f"Error parsing JSON for chunk {idx + 1}. error:{e}")
+                continue
+
+            # Merge the response with what we have, and check what is still missing
+            enriched_fields = reconcile_fields(chunk, enriched_fields + list(response_fields or []))
+            missing_fields = find_missing_fields(chunk, enriched_fields)
+
+        if missing_fields:
+            logger.error(f"Chunk {idx + 1}: {count_fields(missing_fields)} fields are still missing "
+                         f"after {self._max_retries} retries: {', '.join(sorted(index_by_path(missing_fields)))}")
+
+        # Rebuild the result on the chunk's structure, so a field the LLM never described
+        # is still part of the schema (and of its DDL), only without a description
+        return merge_descriptions(chunk, [index_by_path(enriched_fields)])
+
+
+
+    def _render_chunk_prompt(self, prompt_template, fields):
+        """
+        Renders the enrichment prompt for a list of schema fields, in the wire format
+        of this manager.
+        """
+        if self._wire_format == "compact":
+            input_json_schema = "\n".join(compact_field_lines(fields))
+        else:
+            input_json_schema = json.dumps(fields, indent=2)
+
+        return prompt_template.format(
+                        fhir_resource=self.fhir_resource_name, 
+                        input_json_schema=input_json_schema)
+
+
+
+    def _tier_budget(self, prompt_template, prompt_tokens=None):
+        """
+        Returns the token budget of a description tier: the output tokens per field 
+        are scaled to the character length the prompt template asks for.
+
+        The budget is a copy, the token budget of this manager can be shared with the
+        managers of other tables (see CascadeTier), which may run at the same time.
+        """
+        budget = copy.copy(self._token_budget)
+        budget.echo_schema = self._wire_format == "json"
+        if prompt_tokens is not None:
+            budget.prompt_tokens = prompt_tokens
+        budget.output_tokens_per_field = output_tokens_per_field(
+            self._token_budget.output_tokens_per_field, prompt_template.partial_variables["character_length"],
+            CHARACTER_LIMIT)
+        return budget
+
+
+
+    def _chunk_max_tokens(self, prompt_template, fields):
+        """
+        Returns the max_tokens of a chunk request: the expected output of its fields at
+        the character length of their tier, with some headroom, so a verbose response
+        cannot run far beyond the latency we planned for the chunk.
+        """
+        budget = self._tier_budget(prompt_template)
+        _, output_tokens = budget.estimate(fields)
+        return min(budget.max_output_tokens, math.ceil(output_tokens * MAX_TOKENS_HEADROOM))
+
+
+
+    def _fields_from_response(self, fields, parsed_response):
+        """
+        Turns a parsed LLM response into a list of enriched fields.
+
+        A compact response (an object keyed by field path) is expanded onto the 
+        structure of the fields that were sent. A JSON array is used as is, and a 
+        single field that was returned as an object instead of an array is wrapped.
+        """
+        if isinstance(parsed_response, dict):
+            if self._wire_format == "compact" and all(isinstance(value, dict) for value in parsed_response.values()):
+                return expand_compact_response(fields, parsed_response)
+            return [parsed_response]
+
+        return list(parsed_response or [])
+
+
+
+    def _retry_delay(self, attempt):
+        """
+        Returns the delay before a retry: exponential backoff with full jitter,
+        capped at 60 seconds.
+        """
+        return random.uniform(0, min(60.0, self._retry_base_delay * (2 ** (attempt - 1))))
+
+
+
+    @log_entry_exit
+    def generate_incremental_enriched_schema(self, json_schema, previous_schema, journal=None):
+        """
+        Generates an enriched schema, reusing the descriptions of a previous run.
+
+        The new input schema is compared field by field (on the full dotted path, type 
+        and mode) with the previously enriched schema. Only the fields that were added
+        or changed are sent through generate_enriched_schema, and their descriptions 
+        are merged back into the existing ones.
+
+        Args:
+        - json_schema (list): The (new) JSON schema for the FHIR resource.
+        - previous_schema (list): The enriched schema produced by an earlier run.
+        - journal (EnrichmentJournal): An optional journal, see generate_enriched_schema.
+
+        Returns:
+        - list: The enriched schema, with the structure of json_schema.
+        """
+        diff = diff_schemas(previous_schema, json_schema)
+        regenerate_paths = diff["added"] | diff["changed"]
+
+        logger.info(f"Schema diff for '{self._fhir_resource_name}': {len(diff['added'])} added, "
+                    f"{len(diff['changed'])} changed, {len(diff['unchanged'])} unchanged fields.")
+
+        # Only send the added and changed fields (and their parent RECORDs) to the LLM
+        regenerated_index = {}
+        if regenerate_paths:
+            delta_schema = prune_schema(json_schema, regenerate_paths)
+            logger.info(f"Sending {count_fields(delta_schema)} fields for enrichment...")
+
+            enriched_delta = self.generate_enriched_schema(delta_schema, journal=journal)
+            if enriched_delta is None:
+                return None
+            regenerated_index = index_by_path(enriched_delta)
+
+        # Regenerated fields take their new descriptions, all others keep the previous 
+        # ones. A regenerated field the LLM did not return falls back to its previous description
+        previous_index = index_by_path(previous_schema)
+        combined_index = dict(previous_index)
+        regenerated_paths = [path for path in regenerate_paths
+                             if (regenerated_index.get(path) or {}).get("description")]
+        combined_index.update({path: regenerated_index[path] for path in regenerated_paths})
+
+        enriched_schema = self._flag_unresolved(merge_descriptions(json_schema, [combined_index, previous_index]))
+
+        regenerated = len(regenerated_paths)
+        logger.info(f"Incremental enrichment for '{self._fhir_resource_name}': reused {len(diff['unchanged'])} "
+                    f"fields, regenerated {regenerated} of {len(regenerate_paths)} added/changed fields.")
+
+        return enriched_schema
+
+
+
+    def _enrich_journaled_chunk(self, idx, total_chunks, chunk, prompt_template, parser, journal):
+        """
+        Enriches a chunk, using the journal to skip chunks that completed earlier
+        and to record the chunks that complete now. Without a journal, this is
+        the same as _enrich_chunk.
+
+        Returns:
+        - list: The enriched fields for this chunk.
+        """
+        if journal is None:
+            return self._enrich_chunk(idx, total_chunks, chunk, prompt_template, parser)
+
+        # Skip chunks that were completed by an earlier run with the same settings
+        journal_settings = self._journal_settings(prompt_template)
+        journaled_fields = journal.get(chunk, journal_settings)
+        if journaled_fields is not None:
+            logger.info(f"Chunk {idx + 1}/{total_chunks} restored from the journal.")
+            return journaled_fields
+
+        enriched_fields = self._enrich_chunk(idx, total_chunks, chunk, prompt_template, parser)
+
+        # Only journal chunks that were described completely, so failed fields are retried on resume
+        if not find_missing_fields(chunk, enriched_fields):
+            journal.record(chunk, enriched_fields, journal_settings)
+
+        return enriched_fields
+
+
+
+    def _journal_settings(self, prompt_template):
+        """
+        Returns the settings a chunk is journaled with: the model, the prompt, the wire
+        format and the character limit of the description tier. A resumed run only 
+        reuses the chunks that were enriched with the same settings.
+        """
+        model_name, temperature = describe_llm(self.llm_model)
+        return {
+            "model": model_name,
+            "temperature": temperature,
+            "prompt": fingerprint(prompt_template.template)[:16],
+            "wire_format": self._wire_format,
+            "character_length": prompt_template.partial_variables.get("character_length"),
+        }
+
+
+
+    @log_entry_exit
+    def _enrich_chunks_with_batch(self, chunk_groups, parser, journal):
+        """
+        Enriches the chunks of all description tiers through a single batch job.
+
+        Chunks that are already journaled or cached are not submitted. Every other 
+        chunk prompt becomes one request of the batch job file, with the max_tokens
+        of its tier, and the results are mapped back to their chunks through the 
+        request's custom_id. The responses go through the same gap repair as 
+        interactive responses, so fields missing from a batch result are requested 
+        again interactively.
+
+        Args:
+        - chunk_groups (list): (prompt_template, schema_chunks) tuples, one per description tier.
+        - parser (JsonOutputParser): The parser used to extract the JSON array.
+        - journal (EnrichmentJournal): An optional journal, see generate_enriched_schema.
+
+        Returns:
+        - list: For every group, the enriched fields of each chunk, in the original chunk order.
+        """
+        model_name, temperature = describe_llm(self.llm_model)
+
+        # The chunks of all groups are numbered as one sequence, for the custom_ids and the logging
+        chunks = [(group, idx, prompt_template, chunk)
+                  for group, (prompt_template, schema_chunks) in enumerate(chunk_groups)
+                  for idx, chunk in enumerate(schema_chunks)]
+        total_chunks = len(chunks)
+
+        enriched_chunks = [None] * total_chunks
+        initial_fields = [None] * total_chunks
+        prompts = {}
+        batch_requests = []
+
+        for number, (_, _, prompt_template, chunk) in enumerate(chunks):
+            journaled_fields = (journal.get(chunk, self._journal_settings(prompt_template))
+                                if journal is not None else None)
+            if journaled_fields is not None:
+                enriched_chunks[number] = journaled_fields
+                continue
+
+            prompt = self._render_chunk_prompt(prompt_template, chunk)
+            cached_response = self._cache.get(model_name, temperature, prompt) if self._cache is not None else None
+            if cached_response is not None:
+                initial_fields[number] = self._parse_chunk_response(number, chunk, cached_response, parser)
+                continue
+
+            custom_id = f"chunk-{number + 1:05d}"
+            prompts[custom_id] = (number, prompt)
+            _, invoke_kwargs = (self._context_cache.prepare(self.llm_model, prompt) if self._context_cache is not None
+                                else (prompt, {}))
+            batch_requests.append(build_chat_request(custom_id, model_name, prompt, temperature,
+                                                     max_tokens=self._chunk_max_tokens(prompt_template, chunk),
+                                                     prompt_cache_key=(invoke_kwargs.get("extra_body") or {}).get("prompt_cache_key")))
+
+        # Submit the remaining chunks as one batch job, the name is unique per submission
+        # because the job files are named after it
+        if batch_requests:
+            job_name = f"{self._full_table_name}.{time.strftime('%Y%m%d%H%M%S')}.{uuid.uuid4().hex[:8]}"
+            usage = {}
+            results = self._batch_client.run(batch_requests, job_name, usage=usage)
+
+            for custom_id, (number, prompt) in prompts.items():
+                chunk = chunks[number][3]
+                response = results.get(custom_id)
+                if response:
+                    self._record_usage(prompt, response, usage.get(custom_id), source="batch", label=custom_id)
+                initial_fields[number] = self._parse_chunk_response(number, chunk, response, parser) if response else []
+
+                if initial_fields[number] and self._cache is not None:
+                    self._cache.put(model_name, temperature, prompt, response)
+
+        # Repair any gaps interactively, and journal the completed chunks
+        for number, (_, _, prompt_template, chunk) in enumerate(chunks):
+            if enriched_chunks[number] is not None:
+                continue
+
+            enriched_chunks[number] = self._enrich_chunk(number, total_chunks, chunk, prompt_template, parser,
+                                                         initial_fields=initial_fields[number] or [])
+            if journal is not None and not find_missing_fields(chunk, enriched_chunks[number]):
+                journal.record(chunk, enriched_chunks[number], self._journal_settings(prompt_template))
+
+        # Hand the results back per group
+        grouped = [[None] * len(schema_chunks) for _, schema_chunks in chunk_groups]
+        for number, (group, idx, _, _) in enumerate(chunks):
+            grouped[group][idx] = enriched_chunks[number]
+        return grouped
+
+
+
+    def _parse_chunk_response(self, idx, chunk, response, parser):
+        """
+        Parses a chunk response, returning an empty list if it cannot be parsed.
+        """
+        try:
+            return self._fields_from_response(chunk, self._parse_response(describe_llm(self.llm_model)[0],
+                                                                          response, parser.parse))
+        except (OutputParserException, json.JSONDecodeError) as e:
+            logger.error(f"Error parsing JSON for chunk {idx + 1}. error:{e}")
+            return []
+
+
+
+    def _invoke_llm(self, prompt, parse=None, source="chunk", label=None, max_tokens=None):
+        """
+        Sends a prompt to the LLM, consulting the response cache first.
+
+        When a parse function is provided, the response is parsed before it is 
+        stored, so responses that cannot be parsed never end up in the cache.
+        Every request, cache hit and parse failure is recorded in the telemetry.
+
+        Args:
+        - prompt (str): The fully rendered prompt.
+        - parse (callable): Optional function used to parse the response text.
+        - source (str): What the request is for ('chunk' or 'table'), for the telemetry.
+        - label (str): An optional label of the request (like the chunk), for the telemetry.
+        - max_tokens (int): An optional limit on the output tokens of this request.
+
+        Returns:
+        - The response text, or the parsed response when parse is provided.
+        """
+        model_name, temperature = describe_llm(self.llm_model)
+        telemetry = get_telemetry()
+
+        # Serve the response from the cache if we have seen this prompt before
+        if self._cache is not None:
+            cached_response = self._cache.get(model_name, temperature, prompt)
+            if cached_response is not None:
+                telemetry.record_cache_hit(model_name)
+                return self._parse_response(model_name, cached_response, parse)
+
+        # With a context cache, the request refers to the cached prompt prefix
+        prompt_to_send, invoke_kwargs = (self._context_cache.prepare(self.llm_model, prompt)
+                                         if self._context_cache is not None else (prompt, {}))
+        if max_tokens:
+            invoke_kwargs.update(max_tokens_kwargs(model_name, max_tokens))
+
+        # Create a message array containing the formatted prompt, and send it to the LLM
+        messages = [HumanMessage(content=prompt_to_send)]
+        start_time = time.perf_counter()
+        try:
+            llm_response = self.llm_model.invoke(input=messages, **invoke_kwargs)
+        except Exception:
+            telemetry.record_error(model_name)
+            raise
+
+        response = llm_response.content
+        self._record_usage(prompt, response, getattr(llm_response, "usage_metadata", None),
+                           latency_seconds=time.perf_counter() - start_time, source=source, label=label)
+
+        # Parse before caching, so we only cache usable responses
+        result = self._parse_response(model_name, response, parse)
+
+        if self._cache is not None:
+            self._cache.put(model_name, temperature, prompt, response)
+
+        return result
+
+
+
+    def _parse_response(self, model_name, response, parse):
+        """
+        Parses a response with the given parse function, recording parse failures.
+        """
+        if parse is None:
+            return response
+
+        try:
+            return parse(response)
+        except (OutputParserException, json.JSONDecodeError):
+            get_telemetry().record_parse_failure(model_name)
+            raise
+
+
+
+    def _record_usage(self, prompt, response, usage_metadata=None, latency_seconds=None, source="chunk", label=None):
+        """
+        Adds the tokens of an LLM request to the usage counters and the telemetry. The token 
+        counts reported by the provider are used when available, otherwise they are counted.
+        """
+        usage_metadata = usage_metadata or {}
+        input_tokens = usage_metadata.get("input_tokens") or count_tokens(prompt, self._token_budget.model_name)
+        output_tokens = usage_metadata.get("output_tokens") or count_tokens(response or "", self._token_budget.model_name)
+        cached_tokens = cached_prompt_tokens(usage_metadata)
+
+        with self._usage_lock:
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.cached_input_tokens += cached_tokens
+
+        get_telemetry().record_request(describe_llm(self.llm_model)[0], input_tokens, output_tokens,
+                                       latency_seconds=latency_seconds, source=source,
+                                       label=f"{self._full_table_name} {label}" if label else self._full_table_name,
+                                       cached_prompt_tokens=cached_tokens)
+
+
+
+    def _dispatch_chunks(self, schema_chunks, process_chunk):
+        """
+        Runs process_chunk for every chunk and returns the results in chunk order.
+
+        With a max_concurrency of 1 the chunks are processed one after another. 
+        Otherwise a thread pool keeps up to max_concurrency chunk requests in 
+        flight. LLM calls are I/O bound, so threads are sufficient here. Each 
+        task runs in a copy of the current context, so the log indentation 
+        is preserved inside the worker threads.
+
+        Args:
+        - schema_chunks (list): The list of schema chunks to process.
+        - process_chunk (callable): Called as process_chunk(idx, chunk).
+
+        Returns:
+        - list: The result of process_chunk for each chunk, in the original order.
+        """
+        if self._max_concurrency == 1 or len(schema_chunks) <= 1:
+            return [process_chunk(idx, chunk) for idx, chunk in enumerate(schema_chunks)]
+
+        max_workers = min(self._max_concurrency, len(schema_chunks))
+        logger.info(f"Dispatching {len(schema_chunks)} chunks with up to {max_workers} requests in flight...")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, process_chunk, idx, chunk)
+                for idx, chunk in enumerate(schema_chunks)
+            ]
+
+            # Collect the results in submission order, not completion order
+            return [future.result() for future in futures]
+
+
+
     def escape_description(self, desc: str) -> str:
         """
         Escapes special characters in descriptions for BigQuery SQL.
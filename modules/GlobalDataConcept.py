@@ -8,7 +8,7 @@ class GlobalDataConcept:
         self,
         global_concept_id,
         concept_name,
-        data_product_id,
+        version,
         context,
         business_definition,
         data_type_id,
@@ -25,7 +25,7 @@ class GlobalDataConcept:
     ):
         self.global_concept_id = global_concept_id
         self.concept_name = concept_name
-        self.data_product_id = data_product_id
+        self.version = version
         self.context = context
         self.business_definition = business_definition
         self.data_type_id = data_type_id
@@ -45,7 +45,7 @@ class GlobalDataConcept:
             f"GlobalDataConcept("
             f"global_concept_id={self.global_concept_id}, "
             f"concept_name='{self.concept_name}', "
-            f"data_product_id={self.data_product_id}, "
+            f"version={self.version}, "
             f"context='{self.context}', "
             f"business_definition='{self.business_definition}', "
             f"data_type_id={self.data_type_id}, "
@@ -67,7 +67,7 @@ class GlobalDataConcept:
         return {
             "global_concept_id": self.global_concept_id,
             "concept_name": self.concept_name,
-            "data_product_id": self.data_product_id,
+            "version": self.version,
             "context": self.context,
             "business_definition": self.business_definition,
             "data_type_id": self.data_type_id,
@@ -117,7 +117,9 @@ def fetch_global_data_concepts(db_config) -> List[GlobalDataConcept]:
             hca_metadata.global_data_concept A
         INNER JOIN
             hca_metadata.data_type B
-            ON A.data_type_id = B.data_type_id;
+            ON A.data_type_id = B.data_type_id
+        ORDER BY
+            global_concept_id;
         """
 
         # Execute the query
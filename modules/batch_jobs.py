@@ -0,0 +1,239 @@
+import os
+import json
+import time
+
+import requests
+
+from logger_setup import logger, log_entry_exit
+
+# The default directory in which the batch job files are written
+BATCH_DIR = "batch_jobs"
+
+# The endpoint every request in a batch job is sent to
+CHAT_COMPLETIONS_ENDPOINT = "/v1/chat/completions"
+
+# Batch statuses after which the job will not change anymore
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+
+def check_batch_model(model_name: str):
+    """
+    Raises a ValueError for a model that the Batch API mode cannot serve. The batch
+    jobs use the OpenAI Batch API format (see build_chat_request), which Gemini 
+    models are not served through.
+    """
+    if "gemini" in (model_name or "").lower():
+        raise ValueError(f"Batch mode submits OpenAI Batch API jobs, but '{model_name}' is not an OpenAI model. "
+                         f"Run without --batch, or use an OpenAI model (and cascade tiers) for batch runs.")
+
+
+
+def build_chat_request(custom_id: str, model_name: str, prompt: str, temperature: float = 0.0,
+                       max_tokens=None, prompt_cache_key=None) -> dict:
+    """
+    Builds a single line of a batch job file: a chat completion request for one prompt.
+
+    Parameters:
+    - custom_id (str): The id used to map the result back to the request.
+    - model_name (str): The name of the model.
+    - prompt (str): The fully rendered prompt.
+    - temperature (float): The sampling temperature.
+    - max_tokens (int): An optional limit on the number of output tokens.
+    - prompt_cache_key (str): An optional key that routes requests with the same prompt
+      prefix to the same provider-side prompt cache.
+    """
+    body = {
+        "model": model_name,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+    }
+    if max_tokens:
+        body["max_tokens"] = int(max_tokens)
+    if prompt_cache_key:
+        body["prompt_cache_key"] = prompt_cache_key
+
+    return {"custom_id": custom_id, "method": "POST", "url": CHAT_COMPLETIONS_ENDPOINT, "body": body}
+
+
+
+def write_batch_file(batch_requests: list, path: str) -> str:
+    """
+    Writes the batch requests to a JSONL file, one request per line.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for batch_request in batch_requests:
+            f.write(json.dumps(batch_request) + "\n")
+    return path
+
+
+
+def parse_batch_results(content: str, usage=None) -> dict:
+    """
+    Maps the lines of a batch output file back to their requests.
+
+    Parameters:
+    - content (str): The content of the batch output file.
+    - usage (dict): When provided, receives the token usage per custom_id, in the
+      usage_metadata format of LangChain responses.
+
+    Returns:
+    - dict: The response text per custom_id. Requests that failed map to None.
+    """
+    results = {}
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+
+        result = json.loads(line)
+        response = result.get("response") or {}
+
+        if result.get("error") or response.get("status_code") != 200:
+            logger.warning(f"Batch request '{result.get('custom_id')}' failed: "
+                           f"{result.get('error') or response.get('status_code')}")
+            results[result.get("custom_id")] = None
+            continue
+
+        body = response.get("body") or {}
+        choices = body.get("choices") or [{}]
+        results[result.get("custom_id")] = (choices[0].get("message") or {}).get("content")
+
+        if usage is not None and body.get("usage"):
+            token_usage = body["usage"]
+            usage[result.get("custom_id")] = {
+                "input_tokens": token_usage.get("prompt_tokens", 0),
+                "output_tokens": token_usage.get("completion_tokens", 0),
+                "total_tokens": token_usage.get("total_tokens", 0),
+                "input_token_details": {
+                    "cache_read": (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)},
+            }
+
+    return results
+
+
+
+class BatchJobClient:
+    """
+    A small client for OpenAI-compatible Batch APIs.
+
+    A batch job file is uploaded, a batch is created for it, and the batch is polled
+    until it reaches a terminal status, after which the output file is downloaded.
+    The base URL is configurable, so the same client runs against the provider or
+    against a local stand-in server (see modules/batch_stub_server.py).
+    """
+
+    @log_entry_exit
+    def __init__(self, base_url="https://api.openai.com/v1", api_key=None, batch_dir=BATCH_DIR,
+                 poll_interval_seconds=60, timeout_seconds=24 * 60 * 60, completion_window="24h"):
+        """
+        Initializes the client.
+
+        Parameters:
+        - base_url (str): The base URL of the API, including the version (e.g. ".../v1").
+        - api_key (str): The API key, defaults to the OPENAI_API_KEY environment variable.
+        - batch_dir (str): The directory in which the batch job files are written.
+        - poll_interval_seconds (float): The time between two status checks.
+        - timeout_seconds (float): How long we wait for a batch before giving up.
+        - completion_window (str): The completion window requested from the provider.
+        """
+        self._base_url = base_url.rstrip("/")
+        self._api_key = api_key or os.getenv("OPENAI_API_KEY", "")
+        self._batch_dir = batch_dir
+        self._poll_interval_seconds = float(poll_interval_seconds)
+        self._timeout_seconds = float(timeout_seconds)
+        self._completion_window = completion_window
+        self._session = requests.Session()
+        self._session.headers["Authorization"] = f"Bearer {self._api_key}"
+
+
+    @property
+    def batch_dir(self):
+        """The directory in which the batch job files are written."""
+        return self._batch_dir
+
+
+
+    def _upload_file(self, path: str) -> str:
+        """Uploads a batch job file and returns its file id."""
+        with open(path, "rb") as f:
+            response = self._session.post(f"{self._base_url}/files", data={"purpose": "batch"},
+                                          files={"file": (os.path.basename(path), f, "application/jsonl")})
+        response.raise_for_status()
+        return response.json()["id"]
+
+
+
+    def _create_batch(self, input_file_id: str) -> dict:
+        """Creates a batch for an uploaded job file."""
+        response = self._session.post(f"{self._base_url}/batches", json={
+            "input_file_id": input_file_id,
+            "endpoint": CHAT_COMPLETIONS_ENDPOINT,
+            "completion_window": self._completion_window,
+        })
+        response.raise_for_status()
+        return response.json()
+
+
+
+    def _get_batch(self, batch_id: str) -> dict:
+        """Retrieves the current state of a batch."""
+        response = self._session.get(f"{self._base_url}/batches/{batch_id}")
+        response.raise_for_status()
+        return response.json()
+
+
+
+    def _download_file(self, file_id: str) -> str:
+        """Downloads the content of an (output) file."""
+        response = self._session.get(f"{self._base_url}/files/{file_id}/content")
+        response.raise_for_status()
+        return response.text
+
+
+
+    @log_entry_exit
+    def run(self, batch_requests: list, job_name: str, usage=None) -> dict:
+        """
+        Runs a batch job from start to finish.
+
+        Parameters:
+        - batch_requests (list): The requests, see build_chat_request.
+        - job_name (str): The name of the job, used for the name of the job file.
+        - usage (dict): When provided, receives the token usage per custom_id.
+
+        Returns:
+        - dict: The response text per custom_id, None for requests that failed.
+
+        Raises:
+        - RuntimeError: If the batch does not complete, or does not finish in time.
+        """
+        path = write_batch_file(batch_requests, os.path.join(self._batch_dir, f"{job_name}.jsonl"))
+        logger.info(f"Wrote {len(batch_requests)} requests to batch job file: {path}")
+
+        input_file_id = self._upload_file(path)
+        batch = self._create_batch(input_file_id)
+        logger.info(f"Created batch '{batch['id']}' for file '{input_file_id}'")
+
+        # Poll until the batch reaches a terminal status
+        deadline = time.monotonic() + self._timeout_seconds
+        while batch.get("status") not in TERMINAL_STATUSES:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Batch '{batch['id']}' did not finish within {self._timeout_seconds:.0f}s")
+
+            time.sleep(self._poll_interval_seconds)
+            batch = self._get_batch(batch["id"])
+            counts = batch.get("request_counts") or {}
+            logger.info(f"Batch '{batch['id']}' status: {batch.get('status')} "
+                        f"({counts.get('completed', 0)}/{counts.get('total', len(batch_requests))} completed)")
+
+        if batch["status"] != "completed" or not batch.get("output_file_id"):
+            raise RuntimeError(f"Batch '{batch['id']}' ended with status '{batch['status']}'")
+
+        results = parse_batch_results(self._download_file(batch["output_file_id"]), usage)
+
+        # Save the raw results next to the job file, for troubleshooting
+        with open(os.path.join(self._batch_dir, f"{job_name}.results.json"), "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+        return results
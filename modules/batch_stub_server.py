@@ -0,0 +1,211 @@
+"""
+A local stand-in for an OpenAI-compatible Batch API, used to exercise the batch
+mode of the enrichment pipeline without paying for (or waiting on) real batches.
+
+Run it with:
+    python -m modules.batch_stub_server --port 8089
+
+and point the 'batch_api.base_url' YAML setting to http://localhost:8089/v1.
+
+Batches are answered as soon as they are created, and report 'completed' from
+the first status poll on. By default, every chat request is answered with a
+placeholder description and PHI/PII and HIPAA flags for every field of its
+prompt, in the compact format (one 'path TYPE MODE' line per field) or by
+echoing the JSON array found in the prompt. The token usage of every response
+reports the cached prompt tokens of a simulated prefix cache.
+"""
+import re
+import json
+import uuid
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from modules.prompt_cache import PromptCacheSimulator
+from modules.schema_chunker import count_tokens
+
+
+def describe_fields(fields: list) -> list:
+    """Adds a placeholder description and flags to every field, recursively."""
+    described = []
+    for field in fields:
+        field = dict(field)
+        field["description"] = f"Stub description of {field.get('name')}."
+        field["PHI/PII"] = False
+        field["HIPAA"] = False
+        if field.get("fields"):
+            field["fields"] = describe_fields(field["fields"])
+        described.append(field)
+    return described
+
+
+
+def echo_responder(body: dict) -> str:
+    """
+    The default responder: describes the fields of the prompt with placeholder descriptions.
+    """
+    prompt = body["messages"][-1]["content"]
+
+    # Compact prompts list the fields as 'path TYPE MODE' lines
+    field_lines = re.findall(r"^([\w.]+) [A-Z0-9]+ (?:NULLABLE|REQUIRED|REPEATED)$", prompt, re.MULTILINE)
+    if field_lines:
+        return json.dumps({path: {"description": f"Stub description of {path}.", "PHI/PII": False, "HIPAA": False}
+                           for path in field_lines})
+
+    match = re.search(r"\[\s*\{.*\}\s*\]", prompt, re.DOTALL)
+    fields = json.loads(match.group(0)) if match else []
+    return json.dumps(describe_fields(fields))
+
+
+
+class BatchStubServer(ThreadingHTTPServer):
+    """
+    An in-memory, OpenAI-compatible batch server. 'responder' is called with the body
+    of every chat request in a batch and returns the text of the assistant message.
+    """
+
+    def __init__(self, address, responder=echo_responder):
+        super().__init__(address, _BatchStubHandler)
+        self.responder = responder
+        self.prompt_cache = PromptCacheSimulator()
+        self.files = {}
+        self.batches = {}
+
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+    def start(self):
+        """Starts serving in a background thread and returns the server."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+    def run_batch(self, input_file_id: str) -> str:
+        """Answers every request of an uploaded job file and returns the output file id."""
+        output_lines = []
+        for line in self.files[input_file_id].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+
+            batch_request = json.loads(line)
+            body = batch_request["body"]
+            content = self.responder(body)
+
+            prompt = "\n".join(message["content"] for message in body["messages"])
+            prompt_tokens = count_tokens(prompt, body["model"])
+            completion_tokens = count_tokens(content, body["model"])
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": self.prompt_cache.cached_tokens(prompt, body["model"])},
+            }
+
+            output_lines.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                "custom_id": batch_request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "body": {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                             "usage": usage},
+                },
+                "error": None,
+            }))
+
+        output_file_id = f"file-{uuid.uuid4().hex[:12]}"
+        self.files[output_file_id] = "\n".join(output_lines).encode("utf-8")
+        return output_file_id
+
+
+
+class _BatchStubHandler(BaseHTTPRequestHandler):
+    """Handles the files and batches endpoints of the stub server."""
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+
+    def do_POST(self):
+        body = self._read_body()
+
+        if self.path == "/v1/files":
+            # Parse the multipart upload and store the 'file' part
+            message = BytesParser(policy=default_policy).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + body)
+            for part in message.iter_parts():
+                if part.get_param("name", header="content-disposition") == "file":
+                    file_id = f"file-{uuid.uuid4().hex[:12]}"
+                    self.server.files[file_id] = part.get_payload(decode=True)
+                    return self._send_json({"id": file_id, "object": "file", "purpose": "batch"})
+            return self._send_json({"error": {"message": "No file in upload"}}, status=400)
+
+        if self.path == "/v1/batches":
+            request = json.loads(body)
+            batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+            output_file_id = self.server.run_batch(request["input_file_id"])
+            total = len([line for line in self.server.files[request["input_file_id"]].splitlines() if line.strip()])
+            self.server.batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": request["endpoint"],
+                "input_file_id": request["input_file_id"],
+                "status": "in_progress",
+                "output_file_id": output_file_id,
+                "request_counts": {"total": total, "completed": total, "failed": 0},
+            }
+            return self._send_json(self.server.batches[batch_id])
+
+        self._send_json({"error": {"message": f"Unknown endpoint {self.path}"}}, status=404)
+
+
+    def do_GET(self):
+        batch_match = re.fullmatch(r"/v1/batches/([\w-]+)", self.path)
+        if batch_match and batch_match.group(1) in self.server.batches:
+            # The batch is created 'in_progress', and is completed from the first poll on
+            batch = self.server.batches[batch_match.group(1)]
+            batch["status"] = "completed"
+            return self._send_json(batch)
+
+        file_match = re.fullmatch(r"/v1/files/([\w-]+)/content", self.path)
+        if file_match and file_match.group(1) in self.server.files:
+            data = self.server.files[file_match.group(1)]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/jsonl")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        self._send_json({"error": {"message": f"Unknown resource {self.path}"}}, status=404)
+
+
+    def log_message(self, format, *args):
+        # Keep the stub quiet, the client logs the batch progress
+        pass
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stand-in for an OpenAI-compatible Batch API.")
+    parser.add_argument('--host', type=str, default="localhost", help='The host to bind to')
+    parser.add_argument('--port', type=int, default=8089, help='The port to listen on')
+    args = parser.parse_args()
+
+    server = BatchStubServer((args.host, args.port))
+    print(f"Batch stub server listening on {server.base_url}")
+    server.serve_forever()
@@ -0,0 +1,306 @@
+import os
+import json
+import hashlib
+import threading
+
+import numpy as np
+
+from logger_setup import logger, log_entry_exit
+
+# The sentence embedding model used to match column names to global data concepts
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# The default directory of the persisted concept embeddings
+CONCEPT_EMBEDDINGS_DIR = "db/concept_embeddings"
+
+# The CPU inference backends: the PyTorch model, the PyTorch model with dynamically
+# quantized (int8) linear layers, the exported ONNX model, and the quantized ONNX model
+EMBEDDING_BACKENDS = ("torch", "torch-qint8", "onnx", "onnx-qint8")
+DEFAULT_BACKEND = "torch"
+
+# The packages every backend needs, sentence-transformers[onnx] adds onnxruntime and optimum.
+# Their versions are pinned in requirements-embeddings.txt
+BACKEND_PACKAGES = {
+    "torch": "sentence-transformers",
+    "torch-qint8": "sentence-transformers",
+    "onnx": "'sentence-transformers[onnx]'",
+    "onnx-qint8": "'sentence-transformers[onnx]'",
+}
+
+# The quantized ONNX export of the model hub repository, AVX2 runs on every x86-64 worker
+ONNX_QINT8_FILE = "onnx/model_quint8_avx2.onnx"
+
+# The number of texts encoded per forward pass
+DEFAULT_BATCH_SIZE = 64
+
+# The minimum cosine similarity between the embeddings of a backend and of the torch
+# reference model, for the same text
+EMBEDDING_TOLERANCE = 0.99
+
+# The embedding models loaded by this process, one per model and backend settings
+_models = {}
+_models_lock = threading.Lock()
+
+# The torch thread count of the process before a model set its own
+_default_torch_threads = None
+
+
+class EmbeddingModel:
+    """
+    A loaded SentenceTransformer with its backend, thread count and batch size.
+    encode() always returns a float32 numpy array, whatever the backend computes in.
+    """
+
+    def __init__(self, model, model_name, backend, threads=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.model = model
+        self.model_name = model_name
+        self.backend = backend
+        self.threads = threads
+        self.batch_size = int(batch_size)
+
+
+    def encode(self, texts):
+        """Encodes a text, or a list of texts, into one embedding per text."""
+        embeddings = self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+
+
+def _set_torch_threads(threads):
+    """
+    Sets the intra-op thread count of torch. It is global to the process: it applies to
+    every torch model, so the torch model loaded last decides it. None restores the
+    count torch started with (one per core).
+    """
+    global _default_torch_threads
+    import torch
+    if _default_torch_threads is None:
+        _default_torch_threads = torch.get_num_threads()
+    torch.set_num_threads(int(threads or _default_torch_threads))
+
+
+
+def _load_sentence_transformer(model_name, backend, threads):
+    """
+    Loads a SentenceTransformer on the CPU for one of the EMBEDDING_BACKENDS. An ONNX
+    session gets threads intra-op threads (None keeps the runtime's default, one per
+    core), the torch backends set them once, see _set_torch_threads.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {', '.join(EMBEDDING_BACKENDS)}")
+
+    # The backends need optional packages, they are listed in requirements-embeddings.txt
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError as e:
+        raise ImportError(f"The '{backend}' embedding backend needs sentence-transformers, "
+                          f"install it with: pip install {BACKEND_PACKAGES[backend]}") from e
+
+    if backend.startswith("torch"):
+        _set_torch_threads(threads)
+        model = SentenceTransformer(model_name, device="cpu")
+        if backend == "torch-qint8":
+            import torch
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+
+    # The ONNX backends run on onnxruntime, through optimum
+    try:
+        import optimum.onnxruntime
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError(f"The '{backend}' embedding backend needs onnxruntime and optimum, "
+                          f"install them with: pip install {BACKEND_PACKAGES[backend]}") from e
+    session_options = onnxruntime.SessionOptions()
+    if threads:
+        session_options.intra_op_num_threads = int(threads)
+
+    model_kwargs = {"provider": "CPUExecutionProvider", "session_options": session_options}
+    if backend == "onnx-qint8":
+        model_kwargs["file_name"] = ONNX_QINT8_FILE
+    return SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+
+
+def get_embedding_model(model_name=EMBEDDING_MODEL, backend=DEFAULT_BACKEND, threads=None,
+                        batch_size=DEFAULT_BATCH_SIZE) -> EmbeddingModel:
+    """
+    Returns the EmbeddingModel for a model and backend, loading it on first use. The
+    model is shared by every caller of the process, and sentence_transformers (with
+    torch or onnxruntime) is only imported when a model is actually needed.
+
+    Parameters:
+    - model_name (str): The sentence embedding model.
+    - backend (str): One of EMBEDDING_BACKENDS.
+    - threads (int): The number of inference threads, None uses every core. The torch
+      thread count is process-wide, so it is shared with the other torch models.
+    - batch_size (int): The number of texts encoded per forward pass.
+    """
+    key = (model_name, backend, threads, batch_size)
+    with _models_lock:
+        if key not in _models:
+            logger.info(f"Loading sentence embedding model: {model_name} ({backend} backend, "
+                        f"{threads or 'default'} threads, batch size {batch_size})")
+            _models[key] = EmbeddingModel(_load_sentence_transformer(model_name, backend, threads),
+                                          model_name, backend, threads, batch_size)
+        return _models[key]
+
+
+
+def embedding_similarity(reference, embeddings) -> np.ndarray:
+    """
+    Returns the cosine similarity of every row of embeddings with the same row of the
+    reference embeddings, to check a backend against EMBEDDING_TOLERANCE.
+    """
+    reference = np.asarray(reference, dtype=np.float32)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(embeddings, axis=1)
+    return (reference * embeddings).sum(axis=1) / np.maximum(norms, 1e-12)
+
+
+
+def concept_key(concept) -> str:
+    """
+    Returns the key of a concept's embedding: its id, its version and a hash of the
+    name that is embedded, so an edited concept is always encoded again.
+    """
+    name_hash = hashlib.sha256(str(concept.concept_name).encode("utf-8")).hexdigest()[:16]
+    return f"{concept.global_concept_id}:{concept.version}:{name_hash}"
+
+
+
+class ConceptEmbeddingStore:
+    """
+    A persistent store of the embeddings of the global data concepts.
+
+    The embeddings are kept in a .npy file, one row per concept, that is opened as a
+    memory map, next to a JSON index with the model name and the key of every row
+    (see concept_key). As long as hca_metadata.global_data_concept does not change,
+    loading the embeddings is a single mmap. When concepts are added, removed or
+    edited, only those are encoded, and the store is rewritten.
+    """
+
+    @log_entry_exit
+    def __init__(self, store_dir=CONCEPT_EMBEDDINGS_DIR, model_name=EMBEDDING_MODEL, backend=DEFAULT_BACKEND):
+        """
+        Initializes the store.
+
+        Parameters:
+        - store_dir (str): The directory of the embeddings and index files.
+        - model_name (str): The sentence embedding model, the store is rebuilt when it changes.
+        - backend (str): The inference backend of the model, the store is rebuilt when it changes.
+        """
+        self._store_dir = store_dir
+        self._model_name = model_name
+        self._backend = backend
+        # A store of the default backend keeps the plain model name, as before there were backends
+        self._model_id = model_name if backend == DEFAULT_BACKEND else f"{model_name}/{backend}"
+        self._embeddings_path = os.path.join(store_dir, "embeddings.npy")
+        self._index_path = os.path.join(store_dir, "index.json")
+        self._lock = threading.Lock()
+
+
+    @property
+    def store_dir(self) -> str:
+        """The directory of the store, derived data like the concept index is kept next to it."""
+        return self._store_dir
+
+
+    def fingerprint(self, concepts: list) -> str:
+        """
+        Returns a hash of the model and the keys of the concepts, which identifies the
+        embeddings get_embeddings returns for them.
+        """
+        keys = [concept_key(concept) for concept in concepts]
+        return hashlib.sha256(json.dumps([self._model_id, keys]).encode("utf-8")).hexdigest()
+
+
+    def _load(self):
+        """
+        Returns the stored keys and the memory-mapped embeddings, or ([], None) when
+        there is no usable store for this model.
+        """
+        if not (os.path.exists(self._index_path) and os.path.exists(self._embeddings_path)):
+            return [], None
+
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            embeddings = np.load(self._embeddings_path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring the unreadable concept embedding store '{self._store_dir}': {e}")
+            return [], None
+
+        if index.get("model") != self._model_id or len(index.get("keys", [])) != embeddings.shape[0]:
+            return [], None
+
+        return index["keys"], embeddings
+
+
+    def get_embeddings(self, concepts: list, model=None):
+        """
+        Returns the embeddings of the concepts, one row per concept in the given order.
+
+        Parameters:
+        - concepts (list): The GlobalDataConcept objects.
+        - model: The EmbeddingModel, by default the shared model of model_name and backend.
+
+        Returns:
+        - numpy.ndarray: The (memory-mapped, read-only) embeddings.
+        """
+        keys = [concept_key(concept) for concept in concepts]
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        with self._lock:
+            stored_keys, stored_embeddings = self._load()
+            if stored_keys == keys:
+                logger.info(f"Loaded {len(keys)} concept embeddings from '{self._embeddings_path}'.")
+                return stored_embeddings
+
+            # Reuse the rows of unchanged concepts, and only encode the others
+            stored_rows = {key: row for row, key in enumerate(stored_keys)}
+            missing = [i for i, key in enumerate(keys) if key not in stored_rows]
+            logger.info(f"Concept embedding store is out of date: encoding {len(missing)} of "
+                        f"{len(keys)} concepts, {len(keys) - len(missing)} reused.")
+
+            encoded = None
+            if missing:
+                model = model or get_embedding_model(self._model_name, self._backend)
+                encoded = np.asarray(model.encode([concepts[i].concept_name for i in missing]), dtype=np.float32)
+            dimension = encoded.shape[1] if encoded is not None else stored_embeddings.shape[1]
+
+            # Fill a new memory-mapped file, from the old store and the newly encoded concepts
+            os.makedirs(self._store_dir, exist_ok=True)
+            temp_path = f"{self._embeddings_path}.{os.getpid()}.tmp"
+            embeddings = np.lib.format.open_memmap(temp_path, mode="w+", dtype=np.float32,
+                                                   shape=(len(keys), dimension))
+            for row, key in enumerate(keys):
+                if key in stored_rows:
+                    embeddings[row] = stored_embeddings[stored_rows[key]]
+            for position, row in enumerate(missing):
+                embeddings[row] = encoded[position]
+            embeddings.flush()
+
+            # Release both memory maps, a mapped file cannot be replaced on every platform
+            del embeddings, stored_embeddings
+            self._replace(temp_path, keys)
+
+            _, embeddings = self._load()
+            return embeddings
+
+
+
+    def _replace(self, temp_path, keys):
+        """
+        Replaces the store with a newly written embeddings file. The old index is removed
+        first, and the new one written last, so a store that was interrupted halfway has
+        no index, and is rebuilt.
+        """
+        if os.path.exists(self._index_path):
+            os.remove(self._index_path)
+        os.replace(temp_path, self._embeddings_path)
+        with open(self._index_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self._model_id, "keys": keys}, f)
+
+        logger.info(f"Wrote {len(keys)} concept embeddings to '{self._embeddings_path}'.")
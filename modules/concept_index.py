@@ -0,0 +1,355 @@
+import os
+import json
+import time
+
+import numpy as np
+
+from logger_setup import logger
+
+# The supported index kinds: an exact brute-force scan, an inverted file (IVF) index, or
+# a scan of quantized vectors
+INDEX_KINDS = ("exact", "ivf", "quantized")
+
+# The number of queries scored against the index at once, bounds the memory of the scores
+SEARCH_BLOCK_SIZE = 1024
+
+# The number of inverted lists an IVF index probes per query, by default
+DEFAULT_N_PROBE = 16
+
+# The k-means iterations, and the training sample per list, of an IVF index
+IVF_TRAINING_ITERATIONS = 10
+IVF_TRAINING_POINTS_PER_LIST = 40
+
+# The precisions of a quantized index, and the number of candidates re-ranked with the float vectors
+QUANTIZED_PRECISIONS = ("int8", "float16")
+DEFAULT_RERANK = 32
+
+# The number of quantized vectors converted to float32 at once, bounds the memory of a scan
+QUANTIZED_BLOCK_SIZE = 8192
+
+
+def normalize_embeddings(embeddings) -> np.ndarray:
+    """
+    Scales every row to unit length, like util.cos_sim does, so the dot product of two
+    normalized rows is their cosine similarity.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    Returns the indices of the top_k scores of every row, best first, using argpartition.
+    The first column always is the argmax of the row, so the best match of a scan is
+    the same as with scores.argmax().
+    """
+    top_k = max(1, min(top_k, scores.shape[1]))
+    best = scores.argmax(axis=1)
+    if top_k == 1:
+        return best[:, None]
+
+    candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    ranked = np.take_along_axis(candidates, np.lexsort((candidates, -candidate_scores), axis=1), axis=1)
+
+    # With more ties than top_k, argpartition may leave out the argmax
+    for row in np.nonzero(ranked[:, 0] != best)[0]:
+        ranked[row] = [best[row]] + [idx for idx in ranked[row] if idx != best[row]][:top_k - 1]
+    return ranked
+
+
+
+class ExactConceptIndex:
+    """
+    Scans every concept for every query: exact, and O(queries x concepts).
+    """
+    kind = "exact"
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+
+    @classmethod
+    def build(cls, embeddings, **params):
+        """Builds the index from the (not yet normalized) concept embeddings."""
+        return cls(normalize_embeddings(embeddings))
+
+
+    def search(self, queries, top_k: int) -> tuple:
+        """
+        Finds the top_k concepts of every (normalized) query.
+
+        Returns:
+        - tuple: (indices, scores), both of shape (queries, top_k), best first.
+        """
+        indices, scores = [], []
+        for start in range(0, len(queries), SEARCH_BLOCK_SIZE):
+            block_scores = queries[start:start + SEARCH_BLOCK_SIZE] @ self.vectors.T
+            block_indices = top_k_indices(block_scores, top_k)
+            indices.append(block_indices)
+            scores.append(np.take_along_axis(block_scores, block_indices, axis=1))
+        return np.vstack(indices), np.vstack(scores)
+
+
+    def arrays(self) -> dict:
+        return {"vectors": self.vectors}
+
+
+    @classmethod
+    def from_arrays(cls, arrays, params, embeddings):
+        return cls(arrays["vectors"])
+
+
+
+class IVFConceptIndex:
+    """
+    An inverted file index: the concepts are clustered with spherical k-means, and a
+    query only scans the concepts of the n_probe clusters closest to it.
+
+    The vectors are stored in cluster order, so every inverted list is a contiguous
+    slice, and 'order' maps them back to the rows of the concept embeddings.
+    """
+    kind = "ivf"
+
+    def __init__(self, centroids, vectors, order, offsets, n_probe=DEFAULT_N_PROBE):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.order = order
+        self.offsets = offsets
+        self.n_probe = int(n_probe)
+
+
+    @classmethod
+    def build(cls, embeddings, n_lists=None, n_probe=DEFAULT_N_PROBE, seed=0, **params):
+        """
+        Builds the index from the (not yet normalized) concept embeddings.
+
+        Parameters:
+        - embeddings: The concept embeddings, one row per concept.
+        - n_lists (int): The number of clusters, by default 4 * sqrt(concepts).
+        - n_probe (int): The number of clusters scanned per query.
+        - seed (int): The seed of the k-means initialization and training sample.
+        """
+        vectors = normalize_embeddings(embeddings)
+        n_lists = int(n_lists or max(1, 4 * int(np.sqrt(len(vectors)))))
+        n_lists = max(1, min(n_lists, len(vectors)))
+        rng = np.random.default_rng(seed)
+
+        # Train the centroids on a sample, then assign every concept to its closest centroid
+        sample_size = min(len(vectors), n_lists * IVF_TRAINING_POINTS_PER_LIST)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(IVF_TRAINING_ITERATIONS):
+            assignments = cls._assign(sample, centroids)
+            counts = np.bincount(assignments, minlength=n_lists)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+            # Sum the members of every non-empty cluster, an empty cluster keeps its centroid
+            sums = centroids.copy()
+            filled = counts > 0
+            sums[filled] = np.add.reduceat(sample[np.argsort(assignments, kind="stable")], starts[filled], axis=0)
+            centroids = normalize_embeddings(sums)
+
+        assignments = cls._assign(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=n_lists))))
+        return cls(centroids, vectors[order], order, offsets, n_probe)
+
+
+    @staticmethod
+    def _assign(vectors, centroids) -> np.ndarray:
+        """Returns the index of the closest centroid of every vector."""
+        return np.concatenate([(vectors[start:start + SEARCH_BLOCK_SIZE] @ centroids.T).argmax(axis=1)
+                               for start in range(0, len(vectors), SEARCH_BLOCK_SIZE)])
+
+
+    def search(self, queries, top_k: int) -> tuple:
+        """
+        Finds the (approximate) top_k concepts of every (normalized) query.
+
+        Returns:
+        - tuple: (indices, scores), both of shape (queries, top_k), best first. When the
+          probed clusters hold fewer than top_k concepts, the rest is -1 with score -inf.
+        """
+        n_probe = max(1, min(self.n_probe, len(self.centroids)))
+        indices = np.full((len(queries), top_k), -1, dtype=np.int64)
+        scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+
+        for start in range(0, len(queries), SEARCH_BLOCK_SIZE):
+            block = queries[start:start + SEARCH_BLOCK_SIZE]
+            probes = top_k_indices(block @ self.centroids.T, n_probe)
+
+            for row, query in enumerate(block):
+                candidates = np.concatenate([np.arange(self.offsets[probe], self.offsets[probe + 1])
+                                             for probe in probes[row]])
+                if not len(candidates):
+                    continue
+
+                candidate_scores = self.vectors[candidates] @ query
+                best = top_k_indices(candidate_scores[None, :], top_k)[0]
+                indices[start + row, :len(best)] = self.order[candidates[best]]
+                scores[start + row, :len(best)] = candidate_scores[best]
+
+        return indices, scores
+
+
+    def arrays(self) -> dict:
+        return {"centroids": self.centroids, "vectors": self.vectors, "order": self.order, "offsets": self.offsets}
+
+
+    @classmethod
+    def from_arrays(cls, arrays, params, embeddings):
+        return cls(arrays["centroids"], arrays["vectors"], arrays["order"], arrays["offsets"],
+                   params.get("n_probe", DEFAULT_N_PROBE))
+
+
+
+class QuantizedConceptIndex:
+    """
+    Scans every concept like ExactConceptIndex, but on quantized vectors: int8 codes
+    with a scale per vector (a quarter of the float32 memory), or float16 (half).
+
+    The quantized vectors are converted to float32 one block at a time, so a scan
+    never holds more than QUANTIZED_BLOCK_SIZE float rows. The best 'rerank'
+    candidates of every query are then scored again with the float embeddings, which
+    stay memory-mapped in the ConceptEmbeddingStore, so only their rows are read.
+    """
+    kind = "quantized"
+
+    def __init__(self, codes, scales, embeddings, rerank=DEFAULT_RERANK):
+        self.codes = codes
+        self.scales = scales
+        self.embeddings = embeddings
+        self.rerank = int(rerank)
+
+
+    @classmethod
+    def build(cls, embeddings, precision="int8", rerank=DEFAULT_RERANK, **params):
+        """
+        Builds the index from the (not yet normalized) concept embeddings.
+
+        Parameters:
+        - embeddings: The concept embeddings, one row per concept, kept for the re-ranking.
+        - precision (str): One of QUANTIZED_PRECISIONS.
+        - rerank (int): The number of candidates per query re-ranked with the float vectors.
+        """
+        if precision not in QUANTIZED_PRECISIONS:
+            raise ValueError(f"Unknown precision '{precision}', expected one of {', '.join(QUANTIZED_PRECISIONS)}")
+
+        codes = np.empty(embeddings.shape, dtype=np.int8 if precision == "int8" else np.float16)
+        scales = np.ones(len(embeddings), dtype=np.float32)
+        for start in range(0, len(embeddings), QUANTIZED_BLOCK_SIZE):
+            block = normalize_embeddings(embeddings[start:start + QUANTIZED_BLOCK_SIZE])
+            if precision == "int8":
+                block_scales = np.maximum(np.abs(block).max(axis=1), 1e-12) / 127
+                scales[start:start + len(block)] = block_scales
+                block = np.rint(block / block_scales[:, None])
+            codes[start:start + len(block)] = block
+
+        return cls(codes, scales, embeddings, rerank)
+
+
+    def search(self, queries, top_k: int) -> tuple:
+        """
+        Finds the top_k concepts of every (normalized) query: the best 'rerank' candidates
+        of the quantized scan, ordered by their exact float scores.
+
+        Returns:
+        - tuple: (indices, scores), both of shape (queries, top_k), best first.
+        """
+        top_k = max(1, min(top_k, len(self.codes)))
+        rerank = max(top_k, min(self.rerank, len(self.codes)))
+        indices, scores = [], []
+
+        for start in range(0, len(queries), SEARCH_BLOCK_SIZE):
+            block = queries[start:start + SEARCH_BLOCK_SIZE]
+
+            # Keep the best 'rerank' candidates of every query over the blocks of quantized vectors
+            candidates = np.empty((len(block), 0), dtype=np.int64)
+            candidate_scores = np.empty((len(block), 0), dtype=np.float32)
+            for offset in range(0, len(self.codes), QUANTIZED_BLOCK_SIZE):
+                dequantized = self.codes[offset:offset + QUANTIZED_BLOCK_SIZE].astype(np.float32)
+                block_scores = (block @ dequantized.T) * self.scales[offset:offset + QUANTIZED_BLOCK_SIZE]
+                block_rerank = min(rerank, block_scores.shape[1])
+                block_best = np.argpartition(-block_scores, block_rerank - 1, axis=1)[:, :block_rerank]
+                candidates = np.hstack((candidates, block_best + offset))
+                candidate_scores = np.hstack((candidate_scores, np.take_along_axis(block_scores, block_best, axis=1)))
+
+                if candidates.shape[1] > rerank:
+                    kept = np.argpartition(-candidate_scores, rerank - 1, axis=1)[:, :rerank]
+                    candidates = np.take_along_axis(candidates, kept, axis=1)
+                    candidate_scores = np.take_along_axis(candidate_scores, kept, axis=1)
+
+            # Re-rank the candidates with their exact float scores, reading every row once
+            unique, positions = np.unique(candidates, return_inverse=True)
+            exact_vectors = normalize_embeddings(self.embeddings[unique])
+            exact_scores = np.einsum("qd,qrd->qr", block, exact_vectors[positions.reshape(candidates.shape)])
+            best = top_k_indices(exact_scores, top_k)
+            indices.append(np.take_along_axis(candidates, best, axis=1))
+            scores.append(np.take_along_axis(exact_scores, best, axis=1))
+
+        return np.vstack(indices), np.vstack(scores)
+
+
+    def arrays(self) -> dict:
+        return {"codes": self.codes, "scales": self.scales}
+
+
+    @classmethod
+    def from_arrays(cls, arrays, params, embeddings):
+        return cls(arrays["codes"], arrays["scales"], embeddings, params.get("rerank", DEFAULT_RERANK))
+
+
+
+INDEX_CLASSES = {index_class.kind: index_class
+                 for index_class in (ExactConceptIndex, IVFConceptIndex, QuantizedConceptIndex)}
+
+
+def load_or_build_index(kind, embeddings, index_dir=None, fingerprint=None, **params):
+    """
+    Returns a concept index, loaded from index_dir when it was built from the same
+    embeddings (fingerprint) with the same parameters, and built (and saved) otherwise.
+
+    Parameters:
+    - kind (str): One of INDEX_KINDS.
+    - embeddings: The concept embeddings, see ConceptEmbeddingStore.get_embeddings.
+    - index_dir (str): The directory to persist the index in, None keeps it in memory.
+    - fingerprint (str): Identifies the embeddings, see ConceptEmbeddingStore.fingerprint.
+    - params: The parameters of the index, like n_lists and n_probe of an IVF index, or
+      precision and rerank of a quantized index.
+    """
+    if kind not in INDEX_CLASSES:
+        raise ValueError(f"Unknown concept index '{kind}', expected one of {', '.join(INDEX_KINDS)}")
+    index_class = INDEX_CLASSES[kind]
+
+    meta_path = os.path.join(index_dir, f"{kind}_index.json") if index_dir else None
+    if meta_path and fingerprint and os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") == fingerprint and meta.get("params") == params:
+            try:
+                arrays = {name: np.load(os.path.join(index_dir, f"{kind}_{name}.npy"), mmap_mode="r")
+                          for name in meta["arrays"]}
+                logger.info(f"Loaded the {kind} concept index from '{index_dir}'.")
+                return index_class.from_arrays(arrays, params, embeddings)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Rebuilding the unreadable {kind} concept index: {e}")
+
+    start_time = time.perf_counter()
+    index = index_class.build(embeddings, **params)
+    logger.info(f"Built the {kind} concept index for {len(embeddings)} concepts "
+                f"in {time.perf_counter() - start_time:.1f}s.")
+
+    if meta_path and fingerprint:
+        os.makedirs(index_dir, exist_ok=True)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        for name, array in index.arrays().items():
+            np.save(os.path.join(index_dir, f"{kind}_{name}.npy"), np.asarray(array))
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": fingerprint, "params": params, "arrays": list(index.arrays())}, f)
+
+    return index
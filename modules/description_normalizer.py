@@ -0,0 +1,144 @@
+import re
+from collections import Counter
+
+from logger_setup import logger
+
+# The generated boolean flags of an enriched field
+FLAG_KEYS = ("PHI/PII", "HIPAA")
+
+# String values of a flag that mean False, everything else ("true", "yes", "maybe", ...)
+# is coerced to True, so a field is never silently marked as free of PHI/PII
+FALSE_VALUES = ("false", "no", "n", "0", "none", "null", "")
+
+# Appended to descriptions that had to be cut without a sentence boundary
+ELLIPSIS = "..."
+
+# A sentence boundary is only used when it keeps at least this part of the limit
+MIN_SENTENCE_FRACTION = 0.5
+
+_WHITESPACE = re.compile(r"\s+")
+_SENTENCE_END = re.compile(r"[.!?](?=\s|$)")
+
+
+def truncate_description(text: str, character_limit: int) -> str:
+    """
+    Shortens a description to at most character_limit characters.
+
+    The description is cut after the last complete sentence that fits. When that
+    would drop more than half of the allowed length, it is cut at the last word
+    boundary instead, and an ellipsis is appended.
+    """
+    if len(text) <= character_limit:
+        return text
+
+    sentence_ends = [match.end() for match in _SENTENCE_END.finditer(text) if match.end() <= character_limit]
+    if sentence_ends and sentence_ends[-1] >= character_limit * MIN_SENTENCE_FRACTION:
+        return text[:sentence_ends[-1]]
+
+    cut = text[:character_limit - len(ELLIPSIS)]
+    if " " in cut:
+        cut = cut[:cut.rindex(" ")]
+    return cut.rstrip(" ,;:-") + ELLIPSIS
+
+
+
+def normalize_description(text, character_limit: int) -> tuple:
+    """
+    Normalizes a single description: collapses whitespace and newlines into single
+    spaces, and truncates it to the character limit.
+
+    Returns:
+    - tuple: (normalized text, list of the changes that were made)
+    """
+    if not isinstance(text, str):
+        return text, []
+
+    changes = []
+    normalized = _WHITESPACE.sub(" ", text).strip()
+    if normalized != text:
+        changes.append("whitespace")
+
+    truncated = truncate_description(normalized, character_limit)
+    if truncated != normalized:
+        changes.append("truncated")
+
+    return truncated, changes
+
+
+
+def coerce_flag(value) -> bool:
+    """
+    Coerces a generated flag ("True", "no", 1, None, ...) to a boolean.
+    """
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return False
+    if isinstance(value, (int, float)):
+        return value != 0
+
+    text = str(value).strip().lower()
+    if text in FALSE_VALUES:
+        return False
+    return True
+
+
+
+def normalize_enriched_schema(fields: list, character_limit: int, prefix: str = "") -> tuple:
+    """
+    Deterministically cleans up the generated attributes of an enriched schema, so it
+    can be turned into DDL that BigQuery accepts.
+
+    Descriptions are normalized (see normalize_description), and the PHI/PII and HIPAA
+    flags are coerced to booleans. Fields and their structure are never changed.
+
+    Args:
+        fields (list): The enriched schema.
+        character_limit (int): The maximum length of a description.
+        prefix (str): The dotted path of the parent field.
+
+    Returns:
+        tuple: The normalized schema, and a list of (path, change) tuples
+    """
+    normalized, changes = [], []
+
+    for field in fields:
+        path = f"{prefix}.{field.get('name')}" if prefix else field.get("name")
+        field = dict(field)
+
+        if "description" in field:
+            field["description"], description_changes = normalize_description(field["description"], character_limit)
+            changes.extend((path, change) for change in description_changes)
+
+        for flag in FLAG_KEYS:
+            if flag in field and not isinstance(field[flag], bool):
+                field[flag] = coerce_flag(field[flag])
+                changes.append((path, "flag"))
+
+        if field.get("fields"):
+            field["fields"], nested_changes = normalize_enriched_schema(field["fields"], character_limit, path)
+            changes.extend(nested_changes)
+
+        normalized.append(field)
+
+    return normalized, changes
+
+
+
+def log_normalization_changes(full_table_name: str, changes: list):
+    """
+    Logs a summary of the changes made by normalize_enriched_schema, and every
+    truncated field, since those lost part of their description.
+    """
+    if not changes:
+        logger.info(f"Description normalization for '{full_table_name}': no changes needed.")
+        return
+
+    counts = Counter(change for _, change in changes)
+    logger.info(f"Description normalization for '{full_table_name}': "
+                f"{counts['whitespace']} whitespace fixes, {counts['truncated']} truncated descriptions, "
+                f"{counts['flag']} coerced flags.")
+
+    for path, change in changes:
+        if change == "truncated":
+            logger.warning(f"Description of '{path}' was truncated to the character limit.")
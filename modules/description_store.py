@@ -0,0 +1,192 @@
+import re
+import json
+import time
+import sqlite3
+import threading
+
+from logger_setup import logger, log_entry_exit
+from modules.schema_utils import STRUCTURAL_KEYS
+
+# The default location of the description store, it lives next to our prompt database
+DESCRIPTION_STORE_DB = "db/description_store.db"
+
+# The reuse policies of the store:
+# - exact: reuse a description stored for the same normalized path and type, preferring
+#   the one of the same FHIR resource, but falling back to any other resource
+# - resource: only reuse descriptions stored for the same FHIR resource, so every
+#   resource gets (and keeps) its own, resource-specific descriptions
+# - regenerate: never reuse, every field is described again and the store is overwritten
+REUSE_POLICIES = ("exact", "resource", "regenerate")
+
+
+def normalize_path(path: str) -> str:
+    """
+    Normalizes a dotted field path, so 'meta.lastUpdated' and 'meta.last_updated'
+    end up under the same key.
+    """
+    return ".".join(re.sub(r"(?<=[a-z0-9])(?=[A-Z])", "_", segment).lower()
+                    for segment in path.split("."))
+
+
+
+class DescriptionStore:
+    """
+    A persistent store of generated field descriptions, shared by all tables and resources.
+
+    Common FHIR elements (meta.last_updated, identifier.system, subject.reference, ...)
+    appear in almost every resource. Every description generated by the LLM is stored
+    under its normalized path, BigQuery type and FHIR resource, and is looked up
+    before a field is sent to the LLM again, following the reuse policy of the store.
+    """
+
+    @log_entry_exit
+    def __init__(self, db_path=DESCRIPTION_STORE_DB, reuse_policy="exact"):
+        """
+        Initializes the store and creates the descriptions table if it does not exist.
+
+        Parameters:
+        - db_path (str): The location of the SQLite database.
+        - reuse_policy (str): One of REUSE_POLICIES.
+        """
+        if reuse_policy not in REUSE_POLICIES:
+            raise ValueError(f"Unknown reuse policy '{reuse_policy}', expected one of {', '.join(REUSE_POLICIES)}")
+
+        self._db_path = db_path
+        self.reuse_policy = reuse_policy
+
+        # SQLite connections are opened per operation, the lock serializes
+        # access when several tables are described at the same time
+        self._lock = threading.Lock()
+
+        # Hit/miss counters for this process
+        self.hits = 0
+        self.misses = 0
+
+        self._create_table()
+
+
+
+    def _connect(self):
+        """Opens a new connection to the store database."""
+        return sqlite3.connect(self._db_path, timeout=30)
+
+
+
+    def _create_table(self):
+        """Creates the descriptions table if it does not exist yet."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS field_descriptions (
+                        normalized_path TEXT NOT NULL,
+                        field_type TEXT NOT NULL,
+                        fhir_resource TEXT NOT NULL,
+                        attributes TEXT NOT NULL,
+                        updated_at REAL NOT NULL,
+                        PRIMARY KEY (normalized_path, field_type, fhir_resource)
+                    )
+                """)
+                conn.commit()
+            finally:
+                conn.close()
+
+
+
+    def lookup(self, fhir_resource: str, fields_by_path: dict) -> dict:
+        """
+        Looks up the stored descriptions for a set of fields.
+
+        Parameters:
+        - fhir_resource (str): The FHIR resource the fields belong to.
+        - fields_by_path (dict): The fields to look up, by their dotted path (see index_by_path).
+
+        Returns:
+        - dict: The stored attributes (description, PHI/PII, HIPAA, ...) of every field
+          that can be reused, by path. Fields without a usable description are left out.
+        """
+        if self.reuse_policy == "regenerate":
+            self.misses += len(fields_by_path)
+            return {}
+
+        resource_filter = "AND fhir_resource = ?" if self.reuse_policy == "resource" else ""
+        found = {}
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                for path, field in fields_by_path.items():
+                    params = [normalize_path(path), (field.get("type") or "").upper()]
+                    if self.reuse_policy == "resource":
+                        params.append(fhir_resource)
+
+                    # The description of the same resource comes first, then the most recent one
+                    row = conn.execute(f"""
+                        SELECT attributes FROM field_descriptions
+                        WHERE normalized_path = ? AND field_type = ? {resource_filter}
+                        ORDER BY fhir_resource = ? DESC, updated_at DESC
+                        LIMIT 1
+                    """, params + [fhir_resource]).fetchone()
+
+                    if row is None:
+                        self.misses += 1
+                        continue
+
+                    self.hits += 1
+                    found[path] = json.loads(row[0])
+            finally:
+                conn.close()
+
+        return found
+
+
+
+    def save(self, fhir_resource: str, fields_by_path: dict):
+        """
+        Stores the generated attributes of enriched fields. Fields without a description are skipped.
+
+        Parameters:
+        - fhir_resource (str): The FHIR resource the fields belong to.
+        - fields_by_path (dict): The enriched fields, by their dotted path (see index_by_path).
+        """
+        now = time.time()
+        rows = []
+        for path, field in fields_by_path.items():
+            if not field.get("description"):
+                continue
+
+            attributes = {key: value for key, value in field.items() if key not in STRUCTURAL_KEYS}
+            rows.append((normalize_path(path), (field.get("type") or "").upper(), fhir_resource,
+                         json.dumps(attributes), now))
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO field_descriptions "
+                    "(normalized_path, field_type, fhir_resource, attributes, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)", rows)
+                conn.commit()
+            finally:
+                conn.close()
+
+
+
+    def stats(self) -> dict:
+        """
+        Returns the hit/miss counters for this process.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+
+    def log_stats(self):
+        """Logs the hit/miss counters."""
+        stats = self.stats()
+        logger.info(f"Description store ({self.reuse_policy}): {stats['hits']} fields reused, "
+                    f"{stats['misses']} fields generated (reuse rate {stats['hit_rate']:.1%})")
@@ -0,0 +1,106 @@
+import math
+import fnmatch
+
+from logger_setup import logger
+from modules.schema_utils import index_by_path, prune_schema, merge_descriptions
+
+# The character limit of the descriptions of every tier
+DESCRIPTION_TIERS = {"short": 200, "standard": 500, "long": 1024}
+
+# The tier of fields that do not match a pattern, long is the BigQuery limit
+DEFAULT_TIER = "long"
+
+# The output tokens of a field besides its description (the path, the flags and the JSON syntax)
+MIN_OUTPUT_TOKENS_PER_FIELD = 30
+
+# The max_tokens of a chunk request leaves this much room above the expected output
+MAX_TOKENS_HEADROOM = 1.25
+
+
+def output_tokens_per_field(output_tokens_per_field: int, character_limit: int, full_limit: int = 1024) -> int:
+    """
+    Scales the expected output tokens per field, which hold for descriptions of
+    full_limit characters, to descriptions of character_limit characters.
+    """
+    return max(MIN_OUTPUT_TOKENS_PER_FIELD, math.ceil(output_tokens_per_field * character_limit / full_limit))
+
+
+
+class DescriptionTiers:
+    """
+    Assigns every field a description tier (short, standard or long), which sets the
+    character limit of its description, and with it the output tokens of its request.
+
+    The first pattern that matches the dotted path or the name of a field picks its
+    tier, every other field gets the default tier. Patterns use shell wildcards, for
+    example 'etl_*', 'meta.*' or '*.system'.
+    """
+
+    def __init__(self, default_tier=DEFAULT_TIER, patterns=None, limits=None):
+        """
+        Initializes the tiers.
+
+        Parameters:
+        - default_tier (str): The tier of the fields that do not match a pattern.
+        - patterns (list): A list of {'pattern': ..., 'tier': ...} dictionaries, in order of preference.
+        - limits (dict): Overrides the character limits of DESCRIPTION_TIERS.
+        """
+        self.limits = {**DESCRIPTION_TIERS, **(limits or {})}
+        self.default_tier = default_tier
+        self.patterns = [(entry['pattern'], entry['tier']) for entry in patterns or []]
+
+        for tier in [default_tier] + [tier for _, tier in self.patterns]:
+            if tier not in self.limits:
+                raise ValueError(f"Unknown description tier '{tier}', expected one of {', '.join(self.limits)}")
+
+
+    def tier_for(self, path: str) -> str:
+        """Returns the tier of the field with the given dotted path."""
+        name = path.rsplit(".", 1)[-1]
+        for pattern, tier in self.patterns:
+            if fnmatch.fnmatchcase(path, pattern) or fnmatch.fnmatchcase(name, pattern):
+                return tier
+        return self.default_tier
+
+
+    def character_limit(self, tier: str) -> int:
+        """Returns the character limit of the descriptions of a tier."""
+        return int(self.limits[tier])
+
+
+    def split_schema(self, fields: list) -> list:
+        """
+        Splits a schema into one partial schema per tier.
+
+        Returns:
+        - list: (tier, schema) tuples for the tiers that have fields, from the longest to
+          the shortest limit. A RECORD of one tier with subfields of another tier is also
+          part of the subfields' schema, as their container.
+        """
+        paths_by_tier = {}
+        for path in index_by_path(fields):
+            paths_by_tier.setdefault(self.tier_for(path), set()).add(path)
+
+        tiers = sorted(paths_by_tier, key=self.character_limit, reverse=True)
+        logger.info("Description tiers: " + ", ".join(
+            f"{len(paths_by_tier[tier])} {tier} ({self.character_limit(tier)} characters)" for tier in tiers))
+
+        return [(tier, prune_schema(fields, paths_by_tier[tier])) for tier in tiers]
+
+
+    def merge(self, fields: list, enriched_tier_schemas: list) -> list:
+        """
+        Merges the enriched schemas of the tiers (see split_schema) back into the
+        structure of fields. A field described in several tiers (as a container)
+        keeps the description of its own tier.
+        """
+        if len(enriched_tier_schemas) == 1:
+            return enriched_tier_schemas[0][1]
+
+        enriched_fields = {}
+        for tier, enriched_schema in enriched_tier_schemas:
+            for path, field in index_by_path(enriched_schema).items():
+                if path not in enriched_fields or self.tier_for(path) == tier:
+                    enriched_fields[path] = field
+
+        return merge_descriptions(fields, [enriched_fields])
@@ -0,0 +1,12 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# The inference backend of the sentence embedding model, see concept_embeddings.EMBEDDING_BACKENDS
+EMBEDDING_CONFIG = {
+    'backend': os.getenv("EMBEDDING_BACKEND", "torch"),
+    'threads': int(os.getenv("EMBEDDING_THREADS", "0")) or None,
+    'batch_size': int(os.getenv("EMBEDDING_BATCH_SIZE", "64")),
+}
@@ -0,0 +1,135 @@
+import os
+import json
+import hashlib
+import threading
+
+from logger_setup import logger, log_entry_exit
+
+# The default directory for the enrichment journals
+CHECKPOINT_DIR = "checkpoints"
+
+
+def fingerprint(data) -> str:
+    """
+    Returns a stable fingerprint (a SHA-256 hash of the canonical JSON) for any
+    JSON-serializable value, such as a schema or a schema chunk.
+    """
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+
+class EnrichmentJournal:
+    """
+    An append-only, on-disk journal of enriched schema chunks.
+
+    Every chunk is written to the journal as soon as it is enriched, so a failed or
+    killed run does not lose the chunks that already completed. The journal file is
+    keyed by the table name and the fingerprint of the input schema, and each entry
+    is keyed by the fingerprint of the chunk itself and of the settings it was 
+    enriched with (the model, the prompt, the wire format and the description tier). 
+    A resumed run skips every chunk that is already in the journal, even if the chunk 
+    plan changed in between, but a chunk enriched with other settings is sent again.
+    """
+
+    @log_entry_exit
+    def __init__(self, full_table_name, json_schema, checkpoint_dir=CHECKPOINT_DIR, resume=False):
+        """
+        Initializes the journal for a table and its input schema.
+
+        Parameters:
+        - full_table_name (str): The fully qualified BigQuery table name.
+        - json_schema (list): The input schema, used to fingerprint the journal.
+        - checkpoint_dir (str): The directory in which the journal files are stored.
+        - resume (bool): If True, chunks journaled by an earlier run are reused.
+          Otherwise an existing journal for this table and schema is discarded.
+        """
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        schema_fingerprint = fingerprint(json_schema)[:16]
+        self._path = os.path.join(checkpoint_dir, f"{full_table_name}.{schema_fingerprint}.jsonl")
+
+        if resume:
+            self._load()
+        elif os.path.exists(self._path):
+            logger.info(f"Discarding existing journal: {self._path}")
+            os.remove(self._path)
+
+
+    @property
+    def path(self):
+        """The location of the journal file."""
+        return self._path
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+
+    def _load(self):
+        """
+        Loads the chunks journaled by an earlier run. A run that was killed can leave
+        a truncated last line behind, lines that cannot be decoded are skipped.
+        """
+        if not os.path.exists(self._path):
+            logger.info(f"No journal found to resume from at: {self._path}")
+            return
+
+        with open(self._path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self._entries[entry["chunk_key"]] = entry["fields"]
+                except (json.JSONDecodeError, KeyError):
+                    logger.warning("Skipping an incomplete journal entry.")
+
+        logger.info(f"Resuming from journal '{self._path}' with {len(self._entries)} completed chunks.")
+
+
+
+    @staticmethod
+    def entry_key(chunk, settings=None) -> str:
+        """
+        Returns the key of a journal entry: the fingerprint of the chunk, and of the
+        settings it was enriched with.
+        """
+        return fingerprint({"chunk": chunk, "settings": settings})
+
+
+
+    def get(self, chunk, settings=None):
+        """
+        Returns the journaled enriched fields for a chunk, or None if the chunk
+        has not been completed yet with these settings.
+        """
+        return self._entries.get(self.entry_key(chunk, settings))
+
+
+
+    def record(self, chunk, enriched_fields, settings=None):
+        """
+        Appends a completed chunk to the journal and flushes it to disk.
+        """
+        chunk_key = self.entry_key(chunk, settings)
+        line = json.dumps({"chunk_key": chunk_key, "settings": settings, "fields": enriched_fields})
+
+        with self._lock:
+            with open(self._path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._entries[chunk_key] = enriched_fields
+
+
+
+    def clear(self):
+        """
+        Removes the journal, called once the enriched schema has been saved.
+        """
+        with self._lock:
+            if os.path.exists(self._path):
+                os.remove(self._path)
+            self._entries = {}
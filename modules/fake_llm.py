@@ -0,0 +1,177 @@
+"""
+A deterministic stand-in for a LangChain chat model, used to benchmark and
+regression-test the enrichment path without calling a real provider.
+
+The fake understands the prompts of this project: the compact field list and
+the JSON schema of the enrichment prompts, and anything else (like the table
+description prompt) is answered with a short description. Latency, token rate
+and failures are configurable, and every random decision is seeded by the
+prompt itself, so the same prompt always gets the same answer, on any thread.
+Repeated prompt prefixes are reported as cached prompt tokens, like a provider
+with automatic prompt caching would.
+"""
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+
+from langchain_core.messages import AIMessage
+
+from modules.schema_chunker import count_tokens
+from modules.prompt_cache import PromptCacheSimulator
+
+# The field list of the compact enrichment prompt, and the schema of the JSON prompt
+_COMPACT_FIELDS = re.compile(r"^([\w.]+) [A-Z0-9]+ (?:NULLABLE|REQUIRED|REPEATED)$", re.MULTILINE)
+_JSON_SCHEMA = re.compile(r"\*\*FHIR Schema:\*\*\s*(\[.*\])\s*\*\*Output", re.DOTALL)
+_DESCRIPTION_LIMIT = re.compile(r"\*\*Description limit:\*\* (\d+) characters")
+
+
+class FakeLLMError(RuntimeError):
+    """An injected provider error."""
+
+
+class FakeRateLimitError(FakeLLMError):
+    """An injected rate limit (HTTP 429) error, with a Retry-After header."""
+
+    class _Response:
+        status_code = 429
+        headers = {"retry-after": "0.05"}
+
+    status_code = 429
+    response = _Response()
+
+
+
+class FakeChatModel:
+    """
+    A fake chat model that plugs into FHIRResourceManager(llm, ...) like ChatOpenAI.
+
+    Parameters:
+    - model_name (str): The name reported to the cache, the telemetry and the token budget.
+    - latency_seconds (float): The fixed latency of every request.
+    - tokens_per_second (float): The output token rate, adds output_tokens / rate to the
+      latency. 0 means the output is returned instantly.
+    - failure_rate (float): The fraction of requests that raise a FakeLLMError.
+    - rate_limit_rate (float): The fraction of requests that raise a FakeRateLimitError.
+    - malformed_rate (float): The fraction of responses that are not valid JSON.
+    - drop_rate (float): The fraction of fields left out of a response.
+    - description_length (int): The approximate length of every generated description, capped
+      at the description limit of the prompt.
+    - seed (int): Seeds every random decision, together with the prompt.
+    - prompt_cache_min_tokens (int): The minimum length of a cached prompt prefix, 0 disables
+      the simulated prompt cache.
+    """
+
+    def __init__(self, model_name="fake-model", latency_seconds=0.0, tokens_per_second=0.0,
+                 failure_rate=0.0, rate_limit_rate=0.0, malformed_rate=0.0, drop_rate=0.0,
+                 description_length=200, seed=0, prompt_cache_min_tokens=1024):
+        self.model_name = model_name
+        self.temperature = 0.0
+        self.max_tokens = None
+        self.latency_seconds = float(latency_seconds)
+        self.tokens_per_second = float(tokens_per_second)
+        self.failure_rate = float(failure_rate)
+        self.rate_limit_rate = float(rate_limit_rate)
+        self.malformed_rate = float(malformed_rate)
+        self.drop_rate = float(drop_rate)
+        self.description_length = int(description_length)
+        self.seed = seed
+        self.prompt_cache = PromptCacheSimulator(min_tokens=prompt_cache_min_tokens)
+
+        self._lock = threading.Lock()
+        self._attempts = {}
+        self.calls = 0
+
+
+    def _random(self, prompt: str) -> random.Random:
+        """
+        Returns a random generator seeded by the prompt and the number of times it was
+        sent before, so a retried prompt can succeed where the first attempt failed.
+        """
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            self.calls += 1
+            attempt = self._attempts.get(prompt_hash, 0)
+            self._attempts[prompt_hash] = attempt + 1
+        return random.Random(f"{self.seed}|{prompt_hash}|{attempt}")
+
+
+    def _description(self, path: str, length: int = None) -> str:
+        """Builds a deterministic description of about length (or description_length) characters."""
+        length = length or self.description_length
+        sentence = f"The {path} element of the resource. "
+        return (sentence * (length // len(sentence) + 1))[:length].strip()
+
+
+    def _describe_fields(self, fields: list, rng: random.Random, prefix: str = "", length: int = None) -> list:
+        """Adds descriptions and flags to the fields of a JSON prompt, dropping some."""
+        described = []
+        for field in fields:
+            if rng.random() < self.drop_rate:
+                continue
+
+            path = f"{prefix}.{field.get('name')}" if prefix else field.get("name")
+            field = dict(field, description=self._description(path, length), **{"PHI/PII": False, "HIPAA": False})
+            if field.get("fields"):
+                field["fields"] = self._describe_fields(field["fields"], rng, path, length)
+            described.append(field)
+        return described
+
+
+    def _respond(self, prompt: str, rng: random.Random) -> str:
+        """Builds the response text for a prompt."""
+        if rng.random() < self.malformed_rate:
+            return '[{"name": "truncated response'
+
+        limit = _DESCRIPTION_LIMIT.search(prompt)
+        length = min(self.description_length, int(limit.group(1))) if limit else self.description_length
+
+        paths = _COMPACT_FIELDS.findall(prompt)
+        if paths:
+            return json.dumps({path: {"description": self._description(path, length), "PHI/PII": False, "HIPAA": False}
+                               for path in paths if rng.random() >= self.drop_rate})
+
+        schema = _JSON_SCHEMA.search(prompt)
+        if schema:
+            return json.dumps(self._describe_fields(json.loads(schema.group(1)), rng, length=length))
+
+        return self._description("table")
+
+
+    def invoke(self, input, config=None, **kwargs):
+        if hasattr(input, "to_string"):
+            input = input.to_string()
+        prompt = input if isinstance(input, str) else "\n".join(
+            str(getattr(message, "content", message)) for message in input)
+        rng = self._random(prompt)
+
+        if rng.random() < self.rate_limit_rate:
+            raise FakeRateLimitError("429 rate limit exceeded (injected)")
+        if rng.random() < self.failure_rate:
+            raise FakeLLMError("Provider error (injected)")
+
+        content = self._respond(prompt, rng)
+        input_tokens = count_tokens(prompt, self.model_name)
+        cached_tokens = self.prompt_cache.cached_tokens(prompt, self.model_name)
+        output_tokens = count_tokens(content, self.model_name)
+
+        # Like a provider, stop generating at max_tokens
+        max_tokens = kwargs.get("max_tokens")
+        if max_tokens and output_tokens > max_tokens:
+            content = content[:len(content) * max_tokens // output_tokens]
+            output_tokens = max_tokens
+
+        latency = self.latency_seconds
+        if self.tokens_per_second > 0:
+            latency += output_tokens / self.tokens_per_second
+        if latency > 0:
+            time.sleep(latency)
+
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "input_token_details": {"cache_read": cached_tokens},
+        })
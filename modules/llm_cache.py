@@ -0,0 +1,209 @@
+import time
+import sqlite3
+import hashlib
+import threading
+
+from logger_setup import logger, log_entry_exit
+
+# The default location of the cache database, it lives next to our prompt database
+LLM_CACHE_DB = "db/llm_cache.db"
+
+
+def describe_llm(llm):
+    """
+    Returns the model name and temperature of a LangChain chat model.
+
+    ChatOpenAI exposes the model as 'model_name', while ChatGoogleGenerativeAI
+    uses 'model', so we check both before falling back to the class name.
+
+    Parameters:
+    - llm: The language model instance.
+
+    Returns:
+    - tuple: (model_name, temperature)
+    """
+    model_name = getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+    temperature = getattr(llm, "temperature", None)
+    return str(model_name), float(temperature) if temperature is not None else 0.0
+
+
+
+class LLMResponseCache:
+    """
+    A persistent, content-addressed cache for LLM responses, stored in SQLite.
+
+    Every entry is keyed by a hash of the model name, the temperature and the fully
+    rendered prompt. As long as neither the input schema nor the prompt templates
+    change, a re-run produces the same prompts and is served from the cache.
+
+    Entries older than max_age_days are treated as misses and removed, and once the
+    cache holds more than max_entries responses, the least recently used ones are evicted.
+    """
+
+    @log_entry_exit
+    def __init__(self, db_path=LLM_CACHE_DB, max_entries=10000, max_age_days=30):
+        """
+        Initializes the cache and creates the cache table if it does not exist.
+
+        Parameters:
+        - db_path (str): The location of the SQLite cache database.
+        - max_entries (int): The maximum number of responses kept in the cache.
+        - max_age_days (float): The maximum age of a cached response, in days.
+        """
+        self._db_path = db_path
+        self._max_entries = int(max_entries)
+        self._max_age_seconds = float(max_age_days) * 24 * 60 * 60
+
+        # SQLite connections are opened per operation, the lock serializes
+        # access when chunks are enriched from several threads
+        self._lock = threading.Lock()
+
+        # Hit/miss/eviction counters for this process
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._create_table()
+
+
+
+    def _connect(self):
+        """Opens a new connection to the cache database."""
+        return sqlite3.connect(self._db_path, timeout=30)
+
+
+
+    def _create_table(self):
+        """Creates the cache table if it does not exist yet."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_cache (
+                        cache_key TEXT PRIMARY KEY,
+                        model_name TEXT NOT NULL,
+                        temperature REAL NOT NULL,
+                        prompt_hash TEXT NOT NULL,
+                        response TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_accessed REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_accessed ON llm_cache (last_accessed)")
+                conn.commit()
+            finally:
+                conn.close()
+
+
+
+    @staticmethod
+    def make_key(model_name: str, temperature: float, prompt: str) -> tuple:
+        """
+        Builds the content address for a prompt.
+
+        Returns:
+        - tuple: (cache_key, prompt_hash)
+        """
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        cache_key = hashlib.sha256(f"{model_name}|{temperature:.4f}|{prompt_hash}".encode("utf-8")).hexdigest()
+        return cache_key, prompt_hash
+
+
+
+    def get(self, model_name: str, temperature: float, prompt: str):
+        """
+        Looks up the cached response for a prompt.
+
+        Returns:
+        - str: The cached response, or None on a miss (or when the entry expired).
+        """
+        cache_key, _ = self.make_key(model_name, temperature, prompt)
+        now = time.time()
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT response, created_at FROM llm_cache WHERE cache_key = ?", (cache_key,)
+                ).fetchone()
+
+                # Expired entries are removed and count as a miss
+                if row and now - row[1] > self._max_age_seconds:
+                    conn.execute("DELETE FROM llm_cache WHERE cache_key = ?", (cache_key,))
+                    conn.commit()
+                    self.evictions += 1
+                    row = None
+
+                if row is None:
+                    self.misses += 1
+                    return None
+
+                # Track the access time, eviction removes the least recently used entries
+                conn.execute("UPDATE llm_cache SET last_accessed = ? WHERE cache_key = ?", (now, cache_key))
+                conn.commit()
+                self.hits += 1
+                return row[0]
+            finally:
+                conn.close()
+
+
+
+    def put(self, model_name: str, temperature: float, prompt: str, response: str):
+        """
+        Stores a response in the cache and evicts old entries if needed.
+        """
+        cache_key, prompt_hash = self.make_key(model_name, temperature, prompt)
+        now = time.time()
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache "
+                    "(cache_key, model_name, temperature, prompt_hash, response, created_at, last_accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (cache_key, model_name, temperature, prompt_hash, response, now, now))
+                self._evict(conn, now)
+                conn.commit()
+            finally:
+                conn.close()
+
+
+
+    def _evict(self, conn, now):
+        """
+        Removes expired entries, and the least recently used entries beyond max_entries.
+        """
+        cursor = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self._max_age_seconds,))
+        self.evictions += max(cursor.rowcount, 0)
+
+        cursor = conn.execute("""
+            DELETE FROM llm_cache WHERE cache_key IN (
+                SELECT cache_key FROM llm_cache
+                ORDER BY last_accessed DESC
+                LIMIT -1 OFFSET ?
+            )
+        """, (self._max_entries,))
+        self.evictions += max(cursor.rowcount, 0)
+
+
+
+    def stats(self) -> dict:
+        """
+        Returns the hit/miss/eviction counters for this process.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+
+    def log_stats(self):
+        """Logs the hit/miss/eviction counters."""
+        stats = self.stats()
+        logger.info(f"LLM response cache: {stats['hits']} hits, {stats['misses']} misses, "
+                    f"{stats['evictions']} evictions (hit rate {stats['hit_rate']:.1%})")
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+
+from prometheus_client import Counter, Histogram, start_http_server
+
+from logger_setup import logger
+
+# The default directory of the per-run JSON summaries
+TELEMETRY_DIR = "telemetry"
+
+# The number of slowest requests listed in the JSON summary
+SLOWEST_REQUESTS = 10
+
+# Prometheus metrics, labeled by model
+LLM_REQUESTS = Counter("llm_requests_total", "LLM requests sent to the provider", ["model", "source"])
+LLM_PROMPT_TOKENS = Counter("llm_prompt_tokens_total", "Prompt tokens sent to the provider", ["model"])
+LLM_CACHED_PROMPT_TOKENS = Counter("llm_cached_prompt_tokens_total", "Prompt tokens served from the provider's prompt cache", ["model"])
+LLM_COMPLETION_TOKENS = Counter("llm_completion_tokens_total", "Completion tokens received from the provider", ["model"])
+LLM_LATENCY = Histogram("llm_request_latency_seconds", "Latency of LLM requests", ["model"],
+                        buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300))
+LLM_RETRIES = Counter("llm_retries_total", "LLM requests that were retried", ["model", "reason"])
+LLM_CACHE_HITS = Counter("llm_cache_hits_total", "LLM requests served from the response cache", ["model"])
+LLM_PARSE_FAILURES = Counter("llm_parse_failures_total", "LLM responses that could not be parsed", ["model"])
+LLM_ERRORS = Counter("llm_errors_total", "LLM requests that raised an error", ["model"])
+
+
+def _percentile(values: list, fraction: float) -> float:
+    """Returns the value at the given fraction (0-1) of the sorted values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+
+class LLMTelemetry:
+    """
+    Records every LLM request of a run, both as Prometheus metrics and in memory
+    for the per-run JSON summary.
+
+    A single instance is shared by the whole process (see get_telemetry), all
+    methods are thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._requests = []
+        self._counters = defaultdict(lambda: defaultdict(int))
+
+
+    def record_request(self, model_name, prompt_tokens, completion_tokens, latency_seconds=None,
+                       source="chunk", label=None, cached_prompt_tokens=0):
+        """
+        Records a request that was answered by the provider.
+
+        Parameters:
+        - model_name (str): The model that answered the request.
+        - prompt_tokens (int): The number of prompt tokens.
+        - completion_tokens (int): The number of completion tokens.
+        - latency_seconds (float): The latency of the request, None for batch requests.
+        - source (str): What the request was for, like 'chunk', 'table' or 'batch'.
+        - label (str): An optional label, like the table and chunk, to find slow requests.
+        - cached_prompt_tokens (int): The part of the prompt tokens served from the provider's prompt cache.
+        """
+        LLM_REQUESTS.labels(model_name, source).inc()
+        LLM_PROMPT_TOKENS.labels(model_name).inc(prompt_tokens)
+        LLM_CACHED_PROMPT_TOKENS.labels(model_name).inc(cached_prompt_tokens)
+        LLM_COMPLETION_TOKENS.labels(model_name).inc(completion_tokens)
+        if latency_seconds is not None:
+            LLM_LATENCY.labels(model_name).observe(latency_seconds)
+
+        with self._lock:
+            self._requests.append({
+                "model": model_name,
+                "source": source,
+                "label": label,
+                "prompt_tokens": prompt_tokens,
+                "cached_prompt_tokens": cached_prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "latency_seconds": latency_seconds,
+                "timestamp": time.time(),
+            })
+
+
+    def _increment(self, model_name, counter):
+        with self._lock:
+            self._counters[model_name][counter] += 1
+
+
+    def record_cache_hit(self, model_name):
+        """Records a request that was served from the response cache."""
+        LLM_CACHE_HITS.labels(model_name).inc()
+        self._increment(model_name, "cache_hits")
+
+
+    def record_parse_failure(self, model_name):
+        """Records a response that could not be parsed."""
+        LLM_PARSE_FAILURES.labels(model_name).inc()
+        self._increment(model_name, "parse_failures")
+
+
+    def record_retry(self, model_name, reason):
+        """Records a retried request, the reason is 'rate_limit', 'error' or 'missing_fields'."""
+        LLM_RETRIES.labels(model_name, reason).inc()
+        self._increment(model_name, f"retries_{reason}")
+
+
+    def record_error(self, model_name):
+        """Records a request that raised an error."""
+        LLM_ERRORS.labels(model_name).inc()
+        self._increment(model_name, "errors")
+
+
+
+    def summary(self) -> dict:
+        """
+        Returns the per-model aggregates of this run, and its slowest requests.
+        """
+        with self._lock:
+            requests = list(self._requests)
+            counters = {model: dict(values) for model, values in self._counters.items()}
+
+        models = {}
+        for model_name in sorted({request["model"] for request in requests} | set(counters)):
+            model_requests = [request for request in requests if request["model"] == model_name]
+            latencies = [request["latency_seconds"] for request in model_requests
+                         if request["latency_seconds"] is not None]
+
+            prompt_tokens = sum(request["prompt_tokens"] for request in model_requests)
+            cached_prompt_tokens = sum(request["cached_prompt_tokens"] for request in model_requests)
+
+            models[model_name] = {
+                "requests": len(model_requests),
+                "prompt_tokens": prompt_tokens,
+                "cached_prompt_tokens": cached_prompt_tokens,
+                "uncached_prompt_tokens": prompt_tokens - cached_prompt_tokens,
+                "completion_tokens": sum(request["completion_tokens"] for request in model_requests),
+                "latency_p50_seconds": round(_percentile(latencies, 0.5), 3),
+                "latency_p95_seconds": round(_percentile(latencies, 0.95), 3),
+                "latency_max_seconds": round(max(latencies, default=0.0), 3),
+                "latency_total_seconds": round(sum(latencies), 3),
+                **counters.get(model_name, {}),
+            }
+
+        slowest = sorted((request for request in requests if request["latency_seconds"] is not None),
+                         key=lambda request: request["latency_seconds"], reverse=True)[:SLOWEST_REQUESTS]
+
+        return {
+            "started_at": self._started_at,
+            "finished_at": time.time(),
+            "models": models,
+            "slowest_requests": slowest,
+        }
+
+
+
+    def log_prompt_cache_report(self):
+        """
+        Logs the cached versus uncached prompt tokens of every model in this run.
+        """
+        for model_name, stats in self.summary()["models"].items():
+            if not stats["prompt_tokens"]:
+                continue
+            logger.info(f"Prompt cache '{model_name}': {stats['cached_prompt_tokens']} cached and "
+                        f"{stats['uncached_prompt_tokens']} uncached prompt tokens "
+                        f"({stats['cached_prompt_tokens'] / stats['prompt_tokens']:.0%} cached).")
+
+
+
+    def write_summary(self, path: str) -> str:
+        """
+        Writes the run summary to a JSON file and returns its path.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+
+        logger.info(f"LLM telemetry summary written to: {path}")
+        return path
+
+
+
+# The telemetry is shared by every LLM client of the process
+_telemetry = LLMTelemetry()
+
+
+def get_telemetry() -> LLMTelemetry:
+    """Returns the shared telemetry of this process."""
+    return _telemetry
+
+
+
+def start_metrics_server(port: int):
+    """
+    Exposes the Prometheus metrics over HTTP, on http://<host>:<port>/metrics.
+    """
+    start_http_server(int(port))
+    logger.info(f"Prometheus metrics exposed on port {port}")
@@ -1,53 +1,107 @@
-from langchain.prompts import PromptTemplate
-from langchain_openai.chat_models import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.output_parsers import PydanticOutputParser
+import time
+import threading
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import PydanticOutputParser
 
 from modules.ColumnInfo import ColumnInfo
+from modules.llm_cache import describe_llm
+from modules.rate_limiter import RateLimitedLLM, get_rate_limiter
+from modules.llm_telemetry import get_telemetry
+from modules.schema_chunker import count_tokens
+from modules.prompt_cache import cached_prompt_tokens
 from logger_setup import logger, log_entry_exit
 
+# The model behind the table and column description chains
+DEFAULT_MODEL = "gpt-4o"
+DEFAULT_MAX_TOKENS = 1000
+
+# The clients created by get_llm, one per (model, parameters), shared by the whole process
+_clients = {}
+_clients_lock = threading.Lock()
+
+# The table and column description chains, built on first use
+_chains = None
+_chains_lock = threading.Lock()
+
+
+def _create_client(model_name, temperature, max_tokens, max_retries=None):
+    """
+    Creates a provider client. The provider packages are only imported here, so a
+    Gemini-only run never loads the OpenAI client (and the other way around).
+    Without max_retries, the client retries failed requests as often as its default.
+    """
+    retry_kwargs = {"max_retries": max_retries} if max_retries is not None else {}
+
+    # Check if the model name contains "gemini" (case insensitive)
+    if "gemini" in model_name.lower():
+
+        # Initialize Google Gemini LLM
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        logger.info(f"Using Google Generative AI model: {model_name}")
+        return ChatGoogleGenerativeAI(model=model_name, temperature=temperature, max_tokens=max_tokens,
+                                      **retry_kwargs)
+
+    # Default to OpenAI Chat model
+    from langchain_openai.chat_models import ChatOpenAI
+    logger.info(f"Using OpenAI Chat model: {model_name}")
+    return ChatOpenAI(model=model_name, temperature=temperature, max_tokens=max_tokens, **retry_kwargs)
+
+
 
 # Function to initialize the LangChain LLM (Language Learning Model)
 @log_entry_exit  # Decorator for logging function entry and exit
-def get_llm(model_name):
+def get_llm(model_name, requests_per_minute=None, tokens_per_minute=None, temperature=0.0, max_tokens=None):
     """
-    Initializes and returns an appropriate LangChain LLM model based on the provided model name.
+    Returns an appropriate LangChain LLM model based on the provided model name.
     
     Parameters:
     - model_name (str): The name of the LLM model to be used.
+    - requests_per_minute (int): Optional request quota for this model.
+    - tokens_per_minute (int): Optional token quota for this model.
+    - temperature (float): The sampling temperature, 0.0 for deterministic output.
+    - max_tokens (int): Optional limit on the response length, None for the provider default.
     
     Returns:
     - An instance of either ChatGoogleGenerativeAI or ChatOpenAI, depending on the model name.
+      When a quota is provided, the model is wrapped in a RateLimitedLLM that shares one
+      rate limiter with every other client of the same model. The wrapped client does
+      not retry on its own, the RateLimitedLLM retries through the limiter.
     
     Behavior:
     - If the model name contains "gemini" (case-insensitive), it initializes a Google Gemini model.
     - Otherwise, it defaults to an OpenAI Chat model.
-    - Both models are initialized with:
-      - `temperature=0.0` (ensuring deterministic output)
-      - `max_tokens=15000` (limiting response length)
+    - The client is created once per (model, parameters) and cached, so every caller
+      (tables, cascade tiers, description chains) reuses its HTTP connection pool.
     """
+    key = (model_name, temperature, max_tokens, requests_per_minute, tokens_per_minute)
 
-    # Check if the model name contains "gemini" (case insensitive)
-    if "gemini" in model_name.lower():
-        
-        # Initialize Google Gemini LLM
-        logger.info(f"Using Google Generative AI model: {model_name}")
-        return ChatGoogleGenerativeAI(model=model_name, temperature=0.0) 
-    
-    else:
-    
-        # Default to OpenAI Chat model
-        logger.info(f"Using OpenAI Chat model: {model_name}")
-        return ChatOpenAI(model=model_name, temperature=0.0)
+    with _clients_lock:
+        if key in _clients:
+            return _clients[key]
 
+        # Pace the requests if we have a quota for this model. The retries of the client
+        # itself are disabled, they would bypass the limiter and multiply the attempts
+        if requests_per_minute or tokens_per_minute:
+            rate_limiter = get_rate_limiter(model_name, requests_per_minute, tokens_per_minute)
+            llm = RateLimitedLLM(_create_client(model_name, temperature, max_tokens, max_retries=0), rate_limiter)
+        else:
+            llm = _create_client(model_name, temperature, max_tokens)
+
+        _clients[key] = llm
+        return llm
+
+
+
+def max_tokens_kwargs(model_name, max_tokens) -> dict:
+    """
+    Returns the keyword arguments that limit the output tokens of a single llm.invoke
+    call. Gemini takes the limit through its generation config, OpenAI as max_tokens.
+    """
+    if "gemini" in model_name.lower():
+        return {"generation_config": {"max_output_tokens": int(max_tokens)}}
+    return {"max_tokens": int(max_tokens)}
 
 
-# Initialize the LangChain LLM
-llm = ChatOpenAI(
-    model="gpt-4o",  # Use GPT-4 or another supported model
-    temperature=0.0,
-    max_tokens=1000
-)
 
 # Initialize the output parser
 output_parser = PydanticOutputParser(pydantic_object=ColumnInfo)
@@ -82,28 +136,99 @@ column_prompt = PromptTemplate(
     partial_variables={"format_instructions": output_parser.get_format_instructions()}
 )
 
-# LangChain chains
-table_chain = table_prompt | llm
-column_chain = column_prompt | llm | output_parser
+
+def _get_chains():
+    """
+    Returns the LLM and the table and column chains, building them on first use,
+    so importing this module does not create a client (or require an API key).
+    """
+    global _chains
+    with _chains_lock:
+        if _chains is None:
+            llm = get_llm(DEFAULT_MODEL, max_tokens=DEFAULT_MAX_TOKENS)
+            _chains = (llm, table_prompt | llm, column_prompt | llm)
+        return _chains
 
 
-def generate_table_description(table_name: str) -> str:
+def _response_text(response) -> str:
     """
-    Generate a description for a table using LangChain.
+    Returns the text of a chain response, which is either a string or a message.
     """
-    response = table_chain.invoke({"table_name": table_name})
     return response.strip() if isinstance(response, str) else response.content
 
 
+def _parse_with_telemetry(model_name, response, parse):
+    """
+    Parses a response, recording parse failures in the telemetry.
+    """
+    try:
+        return parse(response)
+    except Exception:
+        get_telemetry().record_parse_failure(model_name)
+        raise
+
+
+def _invoke_chain(llm, chain, prompt_template, inputs: dict, cache=None, parse=None, source="column"):
+    """
+    Invokes a prompt | llm chain, consulting the response cache first.
+
+    The cache key is built from the rendered prompt, so the same table or column
+    is only sent to the LLM once while the prompt templates stay the same. When a
+    parse function is provided, the response is parsed before it is cached.
+    Every request, cache hit and parse failure is recorded in the telemetry.
+    """
+    parse = parse or (lambda text: text)
+    telemetry = get_telemetry()
+
+    model_name, temperature = describe_llm(llm)
+    prompt = prompt_template.format(**inputs)
+
+    if cache is not None:
+        cached_response = cache.get(model_name, temperature, prompt)
+        if cached_response is not None:
+            telemetry.record_cache_hit(model_name)
+            return _parse_with_telemetry(model_name, cached_response, parse)
+
+    start_time = time.perf_counter()
+    try:
+        chain_response = chain.invoke(inputs)
+    except Exception:
+        telemetry.record_error(model_name)
+        raise
+
+    response = _response_text(chain_response)
+    usage = getattr(chain_response, "usage_metadata", None) or {}
+    telemetry.record_request(model_name,
+                             usage.get("input_tokens") or count_tokens(prompt, model_name),
+                             usage.get("output_tokens") or count_tokens(response, model_name),
+                             latency_seconds=time.perf_counter() - start_time, source=source,
+                             label=inputs.get("column_name") or inputs.get("table_name"),
+                             cached_prompt_tokens=cached_prompt_tokens(usage))
+
+    result = _parse_with_telemetry(model_name, response, parse)
+    if cache is not None:
+        cache.put(model_name, temperature, prompt, response)
+    return result
+
+
+def generate_table_description(table_name: str, cache=None) -> str:
+    """
+    Generate a description for a table using LangChain.
+    """
+    llm, table_chain, _ = _get_chains()
+    return _invoke_chain(llm, table_chain, table_prompt, {"table_name": table_name}, cache, source="table")
+
+
 def generate_column_description(
-    table_name: str, column_name: str, data_type: str, valid_data_types: list
+    table_name: str, column_name: str, data_type: str, valid_data_types: list, cache=None
 ) -> ColumnInfo:
     """
     Generate a description for a column using LangChain.
     """
-    return column_chain.invoke({
+    llm, _, column_chain = _get_chains()
+    return _invoke_chain(llm, column_chain, column_prompt, {
         "table_name": table_name,
         "column_name": column_name,
         "data_type": data_type,
         "valid_data_types": ", ".join(valid_data_types)
-    })
+    }, cache, parse=output_parser.parse)
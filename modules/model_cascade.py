@@ -0,0 +1,121 @@
+import re
+import threading
+
+from logger_setup import logger
+
+# Descriptions shorter than this are too generic to be useful
+MIN_DESCRIPTION_LENGTH = 20
+
+# Boilerplate descriptions that say nothing about the field
+GENERIC_DESCRIPTION_PATTERNS = [
+    re.compile(r"^(n/?a|none|null|tbd|todo|unknown|description|no description( available)?)\.?$", re.IGNORECASE),
+    re.compile(r"^(this|the) (field|column|element) (contains|stores|holds|represents) "
+               r"(the |a |an )?(value|data|information|field)( of (this|the) (field|column))?\.?$", re.IGNORECASE),
+]
+
+# The generated boolean flags every enriched field must have
+REQUIRED_FLAGS = ("PHI/PII", "HIPAA")
+
+
+def validate_enriched_field(field: dict, character_limit: int) -> list:
+    """
+    Checks the generated attributes of a single enriched field.
+
+    Parameters:
+    - field (dict): The enriched field, or None if the LLM did not return it.
+    - character_limit (int): The maximum length of a description.
+
+    Returns:
+    - list: The problems found, an empty list if the field is valid.
+    """
+    if field is None:
+        return ["missing"]
+
+    problems = []
+    description = field.get("description")
+
+    if not isinstance(description, str) or not description.strip():
+        problems.append("no description")
+    else:
+        description = description.strip()
+        if len(description) > character_limit:
+            problems.append(f"description longer than {character_limit} characters")
+        if (len(description) < MIN_DESCRIPTION_LENGTH or description.lower() == str(field.get("name")).lower()
+                or any(pattern.match(description) for pattern in GENERIC_DESCRIPTION_PATTERNS)):
+            problems.append("generic description")
+
+    for flag in REQUIRED_FLAGS:
+        if not isinstance(field.get(flag), bool):
+            problems.append(f"'{flag}' is not a boolean")
+
+    return problems
+
+
+
+class CascadeTier:
+    """
+    One model of a cascade, with the statistics of the fields it handled.
+
+    The tiers are ordered from the cheapest (fastest) to the most capable model. The
+    first tier describes every field, and every following tier only receives the
+    fields that failed validation in the tier before it. A tier is shared by all
+    tables of a run, so its counters are thread-safe.
+    """
+
+    def __init__(self, model_name, llm, token_budget=None, input_cost_per_million=0.0, output_cost_per_million=0.0):
+        """
+        Initializes the tier.
+
+        Parameters:
+        - model_name (str): The name of the model, used for reporting.
+        - llm: The language model instance of this tier.
+        - token_budget (TokenBudget): The token budget for this model.
+        - input_cost_per_million (float): The price of one million input tokens.
+        - output_cost_per_million (float): The price of one million output tokens.
+        """
+        self.model_name = model_name
+        self.llm = llm
+        self.token_budget = token_budget
+        self.input_cost_per_million = float(input_cost_per_million or 0.0)
+        self.output_cost_per_million = float(output_cost_per_million or 0.0)
+
+        self._lock = threading.Lock()
+        self.fields_sent = 0
+        self.fields_accepted = 0
+        self.fields_escalated = 0
+        self.seconds = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+
+    def record(self, fields_sent, fields_accepted, fields_escalated, seconds, input_tokens, output_tokens):
+        """Adds the results of one enrichment run of this tier."""
+        with self._lock:
+            self.fields_sent += fields_sent
+            self.fields_accepted += fields_accepted
+            self.fields_escalated += fields_escalated
+            self.seconds += seconds
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+
+
+    @property
+    def cost(self) -> float:
+        """The cost of all tokens used by this tier."""
+        return (self.input_tokens * self.input_cost_per_million
+                + self.output_tokens * self.output_cost_per_million) / 1_000_000
+
+
+
+def log_cascade_report(tiers):
+    """
+    Logs the number of fields each tier handled, with its latency, token usage and cost.
+    """
+    logger.info(f"Model cascade: {len(tiers)} tiers")
+    logger.info(f"{'model':<28} {'sent':>7} {'accepted':>9} {'escalated':>10} {'latency':>9} "
+                f"{'in tokens':>11} {'out tokens':>11} {'cost':>9}")
+
+    for tier in tiers:
+        logger.info(f"{tier.model_name:<28} {tier.fields_sent:>7} {tier.fields_accepted:>9} "
+                    f"{tier.fields_escalated:>10} {tier.seconds:>8.1f}s {tier.input_tokens:>11} "
+                    f"{tier.output_tokens:>11} {tier.cost:>9.4f}")
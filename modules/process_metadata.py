@@ -1,28 +1,80 @@
-from sentence_transformers import SentenceTransformer, util
-
+from collections import namedtuple
 
 from modules.DataType import fetch_data_types
 from modules.GlobalDataConcept import fetch_global_data_concepts
 from modules.hca_metadata_config import DB_CONFIG as HCA_METADATA_DB_CONFIG
 from modules.llm_utils import generate_table_description, generate_column_description
+from modules.concept_embeddings import get_embedding_model
+from modules.concept_index import load_or_build_index, normalize_embeddings
+
+# A column only uses a global concept if their cosine similarity is above this score
+MATCH_THRESHOLD = 0.7
+
+# The number of candidate concepts returned for every column (the best match and its runner-ups)
+MATCH_TOP_K = 3
+
+# The best concept of a column (None below the threshold), its score, and the top-k
+# candidates as (concept, score) tuples, best first
+ConceptMatch = namedtuple("ConceptMatch", ["concept", "score", "candidates"])
 
-def find_best_match(model, column_name: str, concept_embeddings, global_concepts: list):
+
+def match_columns_to_concepts(model, column_names: list, concept_index, global_concepts: list,
+                              top_k: int = MATCH_TOP_K, threshold: float = MATCH_THRESHOLD) -> dict:
     """
-    Find the best matching global concept for a given column name using embeddings.
+    Finds the best matching global concept for many column names at once.
+
+    All column names are encoded in a single batched call, and searched in the
+    concept index. With an ExactConceptIndex the best match is the argmax of the
+    scores, exactly like a brute-force scan; an IVFConceptIndex only scans the
+    concepts of the clusters closest to a column.
+
+    Parameters:
+    - model: The EmbeddingModel (or SentenceTransformer) used to encode the column names.
+    - column_names (list): The column names to match, duplicates are matched once.
+    - concept_index: The index of the concept embeddings, see modules/concept_index.py.
+    - global_concepts (list): The GlobalDataConcept of every row of the index.
+    - top_k (int): The number of candidates returned per column.
+    - threshold (float): The minimum score (exclusive) of a usable match.
+
+    Returns:
+    - dict: A ConceptMatch per column name.
     """
-    column_embedding = model.encode(column_name)
-    scores = util.cos_sim(column_embedding, concept_embeddings)
-    best_match_idx = scores.argmax()
-    best_match_score = scores[0, best_match_idx].item()
-    return global_concepts[best_match_idx] if best_match_score > 0.7 else None
+    names = list(dict.fromkeys(column_names))
+    if not names or not global_concepts:
+        return {name: ConceptMatch(None, 0.0, []) for name in names}
+
+    column_embeddings = normalize_embeddings(model.encode(names))
+    top_k = max(1, min(top_k, len(global_concepts)))
+    indices, scores = concept_index.search(column_embeddings, top_k)
+    matches = {}
+
+    for row, name in enumerate(names):
+        candidates = [(global_concepts[idx], float(score))
+                      for idx, score in zip(indices[row], scores[row]) if idx >= 0]
+        if not candidates:
+            matches[name] = ConceptMatch(None, 0.0, [])
+            continue
 
+        best_concept, best_score = candidates[0]
+        matches[name] = ConceptMatch(best_concept if best_score > threshold else None, best_score, candidates)
+    return matches
 
-def process_metadata(metadata):
+
+
+def process_metadata(metadata, cache=None, embedding_store=None, index_kind="exact", index_params=None,
+                     embedding_config=None):
     """
     Process metadata to generate descriptions for tables and columns using LangChain.
+    When an LLMResponseCache is passed in, descriptions generated on an earlier run
+    are served from the cache. When a ConceptEmbeddingStore is passed in, the concept
+    embeddings are loaded from the store instead of being encoded on every run, and
+    the concept index (index_kind: exact, ivf or quantized, with index_params) is
+    persisted next to them. A quantized index keeps int8 or float16 vectors in memory
+    instead of the float32 matrix. The embedding_config (backend, threads, batch_size)
+    selects the inference backend of the embedding model, see EMBEDDING_CONFIG.
     """
-    # Load pre-trained model for embeddings
-    model = SentenceTransformer('all-MiniLM-L6-v2')
+    # Load pre-trained model for embeddings, once per process
+    model = get_embedding_model(**(embedding_config or {}))
 
     # Fetch data types and global data concepts
     existing_data_types = fetch_data_types(HCA_METADATA_DB_CONFIG)
@@ -30,13 +82,26 @@ def process_metadata(metadata):
 
     print(f"global_data_concepts: {global_data_concepts}")
 
-    concept_embeddings = model.encode([concept.concept_name for concept in global_data_concepts])
+    index_dir, fingerprint = None, None
+    if embedding_store is not None:
+        concept_embeddings = embedding_store.get_embeddings(global_data_concepts, model)
+        index_dir, fingerprint = embedding_store.store_dir, embedding_store.fingerprint(global_data_concepts)
+    else:
+        concept_embeddings = model.encode([concept.concept_name for concept in global_data_concepts])
+
+    # Match every column of the catalog in one batched pass
+    concept_index = load_or_build_index(index_kind, concept_embeddings, index_dir=index_dir,
+                                        fingerprint=fingerprint, **(index_params or {})) \
+        if global_data_concepts else None
+    concept_matches = match_columns_to_concepts(
+        model, [column[0] for columns in metadata.values() for column in columns],
+        concept_index, global_data_concepts)
 
     schema_descriptions = {}
 
     for table_name, columns in metadata.items():
         print(f"Processing table: {table_name}")
-        table_description = generate_table_description(table_name)
+        table_description = generate_table_description(table_name, cache=cache)
         schema_descriptions[table_name] = {"description": table_description, "columns": {}}
 
         for column_name, data_type, column_key,  referenced_table, referenced_column in columns:
@@ -45,7 +110,7 @@ def process_metadata(metadata):
             contains_pii = False
             hipadd_compliant = False
             is_foreign_key = referenced_table is not None
-            best_match = find_best_match(model, column_name, concept_embeddings, global_data_concepts)
+            best_match = concept_matches[column_name].concept
 
             if best_match:
                 schema_descriptions[table_name]["columns"][column_name] = {
@@ -61,7 +126,8 @@ def process_metadata(metadata):
                 }
             else:
                 column_info = generate_column_description(
-                    table_name, column_name, data_type, [dt.data_type_name for dt in existing_data_types]
+                    table_name, column_name, data_type, [dt.data_type_name for dt in existing_data_types],
+                    cache=cache
                 )
                 schema_descriptions[table_name]["columns"][column_name] = {
                     "is_primary_key": is_primary_key,
@@ -0,0 +1,199 @@
+"""
+Provider-side prompt caching of the enrichment prompts.
+
+The enrichment prompts start with a large static prefix (the instructions and the
+examples), and end with the per-chunk content (the FHIR resource and the field list).
+Every chunk of every table therefore sends the same prefix, which providers with
+automatic prefix caching (OpenAI) process and bill at a discount after the first
+request, and which providers with explicit context caches (Gemini) can hold in a
+named cache that every chunk refers to.
+"""
+import copy
+import hashlib
+import threading
+
+from logger_setup import logger
+from modules.llm_cache import describe_llm
+from modules.schema_chunker import count_tokens
+
+# Replaces the per-chunk variables when the static prefix of a prompt template is rendered
+_PER_CHUNK_MARKER = "\x00per-chunk\x00"
+
+# The minimum size of an explicit (Gemini) cached content, by model name prefix. The
+# provider rejects cached contents below it. The static prefix of the enrichment
+# prompts is about 1,000 tokens, so only models with a 1,024 token minimum can hold it
+GEMINI_MIN_CACHE_TOKENS = {
+    "gemini-1.5": 32768,
+    "gemini-2.0": 4096,
+    "gemini-2.5-flash": 1024,
+    "gemini-2.5-pro": 4096,
+}
+DEFAULT_MIN_CACHE_TOKENS = 4096
+
+
+def static_prompt_prefix(prompt_template, static_values: dict) -> str:
+    """
+    Renders the static prefix of a prompt template: everything before the first
+    variable that is not in static_values.
+
+    Parameters:
+    - prompt_template (PromptTemplate): The prompt template.
+    - static_values (dict): The values of the variables that are the same for every chunk.
+
+    Returns:
+    - str: The rendered prefix, identical for every prompt rendered with these static values.
+    """
+    per_chunk_values = {name: _PER_CHUNK_MARKER for name in prompt_template.input_variables
+                        if name not in static_values}
+    rendered = prompt_template.format(**static_values, **per_chunk_values)
+    return rendered.split(_PER_CHUNK_MARKER, 1)[0]
+
+
+
+def min_cache_tokens(model_name: str) -> int:
+    """
+    Returns the minimum size of an explicit cached content of a model, matched on
+    the longest known name prefix.
+    """
+    model_name = (model_name or "").lower()
+    matches = [prefix for prefix in GEMINI_MIN_CACHE_TOKENS if model_name.startswith(prefix)]
+    return GEMINI_MIN_CACHE_TOKENS[max(matches, key=len)] if matches else DEFAULT_MIN_CACHE_TOKENS
+
+
+
+def cached_prompt_tokens(usage_metadata) -> int:
+    """
+    Returns the number of prompt tokens the provider served from its prompt cache,
+    as reported in the usage metadata of a response, or 0 when it is not reported.
+    """
+    details = (usage_metadata or {}).get("input_token_details") or {}
+    return int(details.get("cache_read") or 0)
+
+
+
+class ContextCache:
+    """
+    Explicit context-cache handles for the static prompt prefixes.
+
+    OpenAI caches identical prompt prefixes of 1024 tokens or more automatically. Its
+    requests receive a prompt_cache_key derived from the prefix, which routes requests
+    with the same prefix to the same cache. The key is sent in the request body
+    (extra_body), the pinned openai client does not accept it as an argument yet.
+    Gemini needs an explicit cache: the prefix is uploaded once as cached content, and
+    its requests only send the rest of the prompt, together with the name of the cached
+    content. Prefixes below the model's minimum (see min_cache_tokens) are sent in full.
+
+    The handles are created once per (model, prefix) and shared by all tables and
+    threads of a run.
+    """
+
+    def __init__(self, ttl_seconds=3600, min_prefix_tokens=None):
+        """
+        Initializes the context cache.
+
+        Parameters:
+        - ttl_seconds (int): The lifetime of the explicit (Gemini) cached contents.
+        - min_prefix_tokens (int): Prefixes shorter than this are not cached explicitly.
+          None uses the minimum of each model, a lower value than that minimum has no effect.
+        """
+        self._ttl_seconds = int(ttl_seconds)
+        self._min_prefix_tokens = int(min_prefix_tokens or 0)
+        self._lock = threading.Lock()
+        self._handles = {}
+
+
+    def register(self, llm, prefix: str):
+        """
+        Creates the cache handle of a static prompt prefix for a model, unless it exists.
+        """
+        model_name, _ = describe_llm(llm)
+        key = (model_name, hashlib.sha256(prefix.encode("utf-8")).hexdigest())
+
+        with self._lock:
+            if key in self._handles:
+                return
+
+            if "gemini" not in model_name.lower():
+                self._handles[key] = (prefix, {"extra_body": {"prompt_cache_key": key[1][:32]}}, False)
+                return
+
+            prefix_tokens = count_tokens(prefix, model_name)
+            min_prefix_tokens = max(self._min_prefix_tokens, min_cache_tokens(model_name))
+            if prefix_tokens < min_prefix_tokens:
+                logger.info(f"Prompt prefix of {prefix_tokens} tokens is below the context cache minimum "
+                            f"of {min_prefix_tokens} tokens, '{model_name}' requests send the full prompt.")
+                self._handles[key] = None
+                return
+
+            try:
+                from langchain_core.messages import HumanMessage
+                name = llm.create_cached_content([HumanMessage(content=prefix)], ttl=self._ttl_seconds)
+            except Exception as e:
+                logger.warning(f"Could not create a context cache for '{model_name}', "
+                               f"requests send the full prompt: {e}")
+                self._handles[key] = None
+                return
+
+            logger.info(f"Created context cache '{name}' for a prompt prefix of {prefix_tokens} tokens.")
+            self._handles[key] = (prefix, {"cached_content": name}, True)
+
+
+    def prepare(self, llm, prompt: str) -> tuple:
+        """
+        Prepares a prompt for a model, using the handle of its static prefix.
+
+        Returns:
+        - tuple: (the prompt to send, the keyword arguments for llm.invoke). With an explicit
+          handle the prompt loses its prefix, which is already held by the provider.
+        """
+        model_name, _ = describe_llm(llm)
+
+        with self._lock:
+            handles = [handle for (name, _), handle in self._handles.items() if name == model_name and handle]
+
+        for prefix, invoke_kwargs, explicit in handles:
+            if prompt.startswith(prefix):
+                return (prompt[len(prefix):] if explicit else prompt), copy.deepcopy(invoke_kwargs)
+
+        return prompt, {}
+
+
+
+class PromptCacheSimulator:
+    """
+    Simulates automatic prefix caching for the local stand-ins of the providers
+    (modules/fake_llm.py and modules/batch_stub_server.py), so the cached token
+    reporting can be verified without a real provider.
+
+    Like OpenAI, a prompt is cached in blocks of block_tokens once it is at least
+    min_tokens long, and a request reads the longest cached prefix it shares with an
+    earlier request. The blocks are measured in characters (chars_per_token each).
+    """
+
+    def __init__(self, min_tokens=1024, block_tokens=128, chars_per_token=4):
+        self._min_chars = min_tokens * chars_per_token
+        self._block_chars = block_tokens * chars_per_token
+        self._lock = threading.Lock()
+        self._prefixes = set()
+
+
+    def cached_tokens(self, prompt: str, model_name: str) -> int:
+        """
+        Returns the number of prompt tokens read from the cache, and caches the prompt.
+        """
+        if self._min_chars <= 0:
+            return 0
+
+        hasher = hashlib.sha256()
+        digests = []
+        position = 0
+        for boundary in range(self._min_chars, len(prompt) + 1, self._block_chars):
+            hasher.update(prompt[position:boundary].encode("utf-8"))
+            position = boundary
+            digests.append((boundary, hasher.copy().hexdigest()))
+
+        with self._lock:
+            cached_chars = max((boundary for boundary, digest in digests if digest in self._prefixes), default=0)
+            self._prefixes.update(digest for _, digest in digests)
+
+        return count_tokens(prompt[:cached_chars], model_name) if cached_chars else 0
@@ -0,0 +1,309 @@
+import time
+import random
+import threading
+from langchain_core.runnables import Runnable
+
+from logger_setup import logger
+from modules.schema_chunker import count_tokens
+from modules.llm_telemetry import get_telemetry
+
+# The number of output tokens we reserve for a request when the client has no max_tokens set
+DEFAULT_RESERVED_OUTPUT_TOKENS = 4096
+
+# Rate limiters are shared by every client of the same model, across tables and threads
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket. The bucket holds up to 'capacity' tokens and is
+    refilled continuously at 'refill_rate' tokens per second. acquire() blocks
+    until enough tokens are available.
+    """
+
+    def __init__(self, capacity, refill_rate):
+        self.capacity = float(capacity)
+        self.refill_rate = float(refill_rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+
+    def _refill(self, now):
+        """Adds the tokens that accumulated since the last update."""
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_rate)
+        self._updated = now
+
+
+    def acquire(self, amount=1.0):
+        """
+        Takes 'amount' tokens from the bucket, waiting until they are available.
+        Requests larger than the capacity wait for a full bucket.
+        """
+        amount = min(float(amount), self.capacity)
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self._tokens >= amount:
+                        self._tokens -= amount
+                        return
+                    wait = (amount - self._tokens) / self.refill_rate
+
+            time.sleep(wait)
+
+
+    def refund(self, amount):
+        """Returns unused tokens to the bucket, for example when a request used fewer than reserved."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + float(amount))
+
+
+    def consume(self, amount):
+        """
+        Takes tokens without waiting, for example when a request used more than reserved.
+        The bucket can go into debt, which the next acquire() calls wait off.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= float(amount)
+
+
+    def block(self, seconds):
+        """Blocks every acquire() for the given number of seconds, and empties the bucket."""
+        with self._lock:
+            now = time.monotonic()
+            self._blocked_until = max(self._blocked_until, now + float(seconds))
+            self._tokens = 0.0
+            self._updated = now
+
+
+
+class RateLimiter:
+    """
+    Paces requests to a single model on requests per minute and tokens per minute.
+    Either limit can be left out (None), in which case it is not enforced.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_bucket = TokenBucket(requests_per_minute, requests_per_minute / 60.0) if requests_per_minute else None
+        self._token_bucket = TokenBucket(tokens_per_minute, tokens_per_minute / 60.0) if tokens_per_minute else None
+
+
+    def acquire(self, tokens):
+        """Waits until a request with the given number of tokens may be sent."""
+        if self._request_bucket:
+            self._request_bucket.acquire(1)
+        if self._token_bucket:
+            self._token_bucket.acquire(tokens)
+
+
+    def settle(self, reserved_tokens, used_tokens):
+        """
+        Settles a request with its actual token usage: the reserved but unused tokens
+        are returned, and the tokens used beyond the reservation are taken.
+        """
+        if not self._token_bucket:
+            return
+        if used_tokens < reserved_tokens:
+            self._token_bucket.refund(reserved_tokens - used_tokens)
+        elif used_tokens > reserved_tokens:
+            self._token_bucket.consume(used_tokens - reserved_tokens)
+
+
+    def block(self, seconds):
+        """Pauses all requests, used when the provider tells us to retry after a while."""
+        for bucket in (self._request_bucket, self._token_bucket):
+            if bucket:
+                bucket.block(seconds)
+
+
+
+def get_rate_limiter(model_name, requests_per_minute=None, tokens_per_minute=None):
+    """
+    Returns the shared rate limiter for a model, creating it on first use.
+
+    The provider's quota holds for the model as a whole, so every client of a model
+    shares one limiter, with the quota of the first caller. A later caller that asks
+    for a different quota gets the shared limiter and a warning.
+
+    Parameters:
+    - model_name (str): The name of the model, every client of this model shares the limiter.
+    - requests_per_minute (int): The maximum number of requests per minute.
+    - tokens_per_minute (int): The maximum number of (input + output) tokens per minute.
+    """
+    with _rate_limiters_lock:
+        if model_name not in _rate_limiters:
+            logger.info(f"Creating rate limiter for '{model_name}': {requests_per_minute} requests/min, "
+                        f"{tokens_per_minute} tokens/min")
+            _rate_limiters[model_name] = RateLimiter(requests_per_minute, tokens_per_minute)
+
+        rate_limiter = _rate_limiters[model_name]
+        if (rate_limiter.requests_per_minute, rate_limiter.tokens_per_minute) != (requests_per_minute, tokens_per_minute):
+            logger.warning(f"Ignoring the rate limits {requests_per_minute} requests/min, {tokens_per_minute} "
+                           f"tokens/min for '{model_name}', its shared rate limiter was created with "
+                           f"{rate_limiter.requests_per_minute} requests/min, "
+                           f"{rate_limiter.tokens_per_minute} tokens/min.")
+        return rate_limiter
+
+
+
+def _prompt_text(llm_input) -> str:
+    """Returns the text of an LLM input, which is a string, a prompt value or a list of messages."""
+    if isinstance(llm_input, str):
+        return llm_input
+    if hasattr(llm_input, "to_string"):
+        return llm_input.to_string()
+    if isinstance(llm_input, (list, tuple)):
+        return "\n".join(str(getattr(message, "content", message)) for message in llm_input)
+    return str(llm_input)
+
+
+
+def is_rate_limit_error(error) -> bool:
+    """
+    Returns True if an exception raised by an LLM client is a rate limit (HTTP 429) error.
+    OpenAI raises RateLimitError, Gemini raises ResourceExhausted.
+    """
+    if type(error).__name__ in ("RateLimitError", "ResourceExhausted", "TooManyRequests"):
+        return True
+
+    response = getattr(error, "response", None)
+    for status in (getattr(error, "status_code", None), getattr(error, "code", None),
+                   getattr(response, "status_code", None)):
+        if status == 429:
+            return True
+
+    return "429" in str(error) and "rate" in str(error).lower()
+
+
+
+def is_transient_error(error) -> bool:
+    """
+    Returns True if an exception raised by an LLM client is worth retrying: a rate limit,
+    a server (5xx) error, a timeout or a connection error. These are the errors the
+    provider clients retry themselves.
+    """
+    if is_rate_limit_error(error):
+        return True
+
+    if type(error).__name__ in ("APIConnectionError", "APITimeoutError", "InternalServerError",
+                                "ServiceUnavailable", "DeadlineExceeded"):
+        return True
+
+    response = getattr(error, "response", None)
+    for status in (getattr(error, "status_code", None), getattr(response, "status_code", None)):
+        if isinstance(status, int) and status >= 500:
+            return True
+
+    return False
+
+
+
+def retry_after_seconds(error):
+    """
+    Returns the delay the provider asked for, from the Retry-After (or retry-after-ms)
+    header of the error's HTTP response, or None if there is no such header.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers.get("retry-after-ms")) / 1000.0
+        if headers.get("retry-after") is not None:
+            return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        # Retry-After can also be an HTTP date, we fall back to our own backoff for those
+        pass
+
+    return None
+
+
+
+class RateLimitedLLM(Runnable):
+    """
+    Wraps a LangChain chat model so that every invoke() is paced by a shared RateLimiter.
+
+    Before a request is sent, one request and the estimated number of tokens (the
+    prompt plus the reserved output) are taken from the limiter. When the response
+    reports its actual token usage, the request is settled: the unused part of the
+    reservation is returned, and the usage beyond it is taken as well. Rate limit
+    errors pause the limiter for the Retry-After delay given by the provider (or an
+    exponential backoff without one) before the request is retried, and other
+    transient errors are retried with the same backoff.
+
+    The wrapper is a Runnable, so it can be used in a prompt | llm chain like the
+    wrapped model. The wrapped model should not retry itself (see get_llm), so every
+    attempt goes through the limiter and the attempts are not multiplied.
+
+    All other attributes (model_name, temperature, ...) are passed through to the wrapped model.
+    """
+
+    def __init__(self, llm, rate_limiter, max_retries=5):
+        self._llm = llm
+        self._rate_limiter = rate_limiter
+        self._max_retries = max_retries
+
+
+    def __getattr__(self, name):
+        # Private attributes are never passed through, copying an instance looks them up before __init__
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._llm, name)
+
+
+    @property
+    def wrapped_llm(self):
+        """The wrapped LangChain chat model."""
+        return self._llm
+
+
+    def invoke(self, input, config=None, **kwargs):
+        model_name = getattr(self._llm, "model_name", None) or getattr(self._llm, "model", "")
+        reserved_output = (kwargs.get("max_tokens") or (kwargs.get("generation_config") or {}).get("max_output_tokens")
+                           or getattr(self._llm, "max_tokens", None) or DEFAULT_RESERVED_OUTPUT_TOKENS)
+        estimated_tokens = count_tokens(_prompt_text(input), str(model_name)) + reserved_output
+
+        for attempt in range(self._max_retries + 1):
+            self._rate_limiter.acquire(estimated_tokens)
+
+            try:
+                response = self._llm.invoke(input, config, **kwargs)
+
+            except Exception as e:
+                if not is_transient_error(e) or attempt == self._max_retries:
+                    raise
+
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = random.uniform(0.5, 1.0) * min(60.0, 2.0 ** attempt)
+
+                if is_rate_limit_error(e):
+                    logger.warning(f"Rate limited by '{model_name}', pausing for {delay:.1f}s "
+                                   f"(retry {attempt + 1}/{self._max_retries})...")
+                    self._rate_limiter.block(delay)
+                    get_telemetry().record_retry(str(model_name), "rate_limit")
+                else:
+                    logger.warning(f"Request to '{model_name}' failed ({type(e).__name__}), retrying in "
+                                   f"{delay:.1f}s (retry {attempt + 1}/{self._max_retries})...")
+                    get_telemetry().record_retry(str(model_name), "error")
+                    time.sleep(delay)
+                continue
+
+            # Settle the reservation with the tokens the request actually used
+            usage = getattr(response, "usage_metadata", None) or {}
+            if usage.get("total_tokens"):
+                self._rate_limiter.settle(estimated_tokens, usage["total_tokens"])
+
+            return response
@@ -0,0 +1,285 @@
+import json
+import threading
+
+from logger_setup import logger, log_entry_exit
+from modules.schema_utils import is_record, count_fields, copy_with_subfields
+
+# Input/output token limits per model family, matched on the longest model name
+# prefix. The input limits are the context windows, the output limits are the
+# maximum number of tokens the model can generate in a single response.
+MODEL_TOKEN_BUDGETS = {
+    "gpt-4o":           {"max_input_tokens": 128000,  "max_output_tokens": 16384},
+    "gpt-4o-mini":      {"max_input_tokens": 128000,  "max_output_tokens": 16384},
+    "gpt-4-turbo":      {"max_input_tokens": 128000,  "max_output_tokens": 4096},
+    "gpt-4":            {"max_input_tokens": 8192,    "max_output_tokens": 4096},
+    "gemini-1.5-pro":   {"max_input_tokens": 2097152, "max_output_tokens": 8192},
+    "gemini-1.5-flash": {"max_input_tokens": 1048576, "max_output_tokens": 8192},
+    "gemini":           {"max_input_tokens": 1048576, "max_output_tokens": 8192},
+}
+
+# Conservative limits for models we do not know
+DEFAULT_TOKEN_BUDGET = {"max_input_tokens": 8192, "max_output_tokens": 4096}
+
+# The expected number of output tokens for the enriched description and the
+# PHI/PII and HIPAA flags of a single field. A 1024 character description is
+# roughly 250 tokens, the rest covers the flags and the JSON punctuation.
+OUTPUT_TOKENS_PER_FIELD = 300
+
+# The tokenizers are loaded once per model, the lock keeps concurrent
+# requests from all loading (or failing to download) the same encoding
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+# The fraction of the budget we actually plan for, this leaves headroom for
+# differences between our token counts and the provider's tokenizer
+BUDGET_SAFETY_MARGIN = 0.8
+
+
+
+def _load_encoder(model_name: str):
+    """
+    Loads the tiktoken encoder for a model, or returns None if tiktoken is not available.
+
+    Gemini models are not known to tiktoken, for those (and any other unknown
+    model) we use the cl100k_base encoding as a close approximation.
+    """
+    try:
+        import tiktoken
+        import tiktoken.model
+    except ImportError:
+        logger.warning("tiktoken is not installed, falling back to a character based token estimate.")
+        return None
+
+    try:
+        encoding_name = tiktoken.model.encoding_name_for_model(model_name)
+    except KeyError:
+        encoding_name = "cl100k_base"
+
+    # The encoding files are downloaded on first use, so this can fail when offline
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(f"Could not load the {encoding_name} encoding ({e}), falling back to a character based estimate.")
+        return None
+
+
+
+def _get_encoder(model_name: str):
+    """
+    Returns the (cached) tiktoken encoder for a model, see _load_encoder.
+    """
+    with _encoders_lock:
+        if model_name not in _encoders:
+            _encoders[model_name] = _load_encoder(model_name)
+        return _encoders[model_name]
+
+
+
+def count_tokens(text: str, model_name: str = "gpt-4o") -> int:
+    """
+    Counts the number of tokens in a text for the given model.
+    Without tiktoken, we estimate four characters per token.
+    """
+    encoder = _get_encoder(model_name)
+    if encoder is None:
+        return (len(text) + 3) // 4
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+
+def tokenizer_name(model_name: str = "gpt-4o") -> str:
+    """
+    Returns the name of the encoding count_tokens uses for a model, or 'characters'
+    for the estimate. Token counts are only comparable when this name is the same.
+    """
+    encoder = _get_encoder(model_name)
+    return encoder.name if encoder is not None else "characters"
+
+
+
+class TokenBudget:
+    """
+    The token budget for a single enrichment request.
+
+    The input side is the prompt (the static template plus the chunk's JSON), the
+    output side is a description for every field, plus the echoed JSON structure
+    when the LLM is asked to return the full fields (echo_schema).
+    """
+
+    def __init__(self, model_name, max_input_tokens=None, max_output_tokens=None,
+                 output_tokens_per_field=OUTPUT_TOKENS_PER_FIELD, prompt_tokens=0):
+        """
+        Initializes the budget, the limits default to the known limits of the model.
+
+        Parameters:
+        - model_name (str): The name of the LLM model, used to look up the limits and the tokenizer.
+        - max_input_tokens (int): Overrides the input token limit of the model.
+        - max_output_tokens (int): Overrides the output token limit of the model.
+        - output_tokens_per_field (int): The expected number of output tokens per field.
+        - prompt_tokens (int): The number of tokens of the prompt template without a schema.
+        """
+        model_limits = get_model_token_limits(model_name)
+
+        self.model_name = model_name
+        self.max_input_tokens = int(max_input_tokens or model_limits["max_input_tokens"])
+        self.max_output_tokens = int(max_output_tokens or model_limits["max_output_tokens"])
+        self.output_tokens_per_field = int(output_tokens_per_field or OUTPUT_TOKENS_PER_FIELD)
+        self.prompt_tokens = int(prompt_tokens)
+        self.echo_schema = True
+
+
+    @property
+    def input_limit(self) -> int:
+        """The number of input tokens available for the schema of a single chunk."""
+        return int(self.max_input_tokens * BUDGET_SAFETY_MARGIN) - self.prompt_tokens
+
+
+    @property
+    def output_limit(self) -> int:
+        """The number of output tokens we plan to use for a single chunk."""
+        return int(self.max_output_tokens * BUDGET_SAFETY_MARGIN)
+
+
+    def estimate(self, fields: list) -> tuple:
+        """
+        Estimates the input and output tokens needed to enrich the given fields.
+
+        Returns:
+        - tuple: (input_tokens, output_tokens)
+        """
+        schema_tokens = count_tokens(json.dumps(fields, indent=2), self.model_name)
+        echoed_tokens = schema_tokens if self.echo_schema else 0
+        return schema_tokens, echoed_tokens + count_fields(fields) * self.output_tokens_per_field
+
+
+    def fits(self, fields: list) -> bool:
+        """Returns True if the given fields fit in a single request."""
+        input_tokens, output_tokens = self.estimate(fields)
+        return input_tokens <= self.input_limit and output_tokens <= self.output_limit
+
+
+
+def get_model_token_limits(model_name: str) -> dict:
+    """
+    Returns the token limits of a model, matched on the longest known name prefix.
+    """
+    model_name = (model_name or "").lower()
+    matches = [prefix for prefix in MODEL_TOKEN_BUDGETS if model_name.startswith(prefix)]
+
+    if not matches:
+        return DEFAULT_TOKEN_BUDGET
+
+    return MODEL_TOKEN_BUDGETS[max(matches, key=len)]
+
+
+
+def wrap_in_ancestors(field: dict, ancestors: tuple) -> dict:
+    """
+    Returns the field nested in copies of its ancestor RECORDs (outermost first),
+    which hold only this field. This is how a piece of a nested RECORD is sent.
+    """
+    for ancestor in reversed(ancestors):
+        field = copy_with_subfields(ancestor, [field])
+    return field
+
+
+
+def split_field(field: dict, budget: TokenBudget, ancestors: tuple = ()) -> list:
+    """
+    Splits a field into pieces that each fit in the token budget.
+
+    Fields that fit are returned as-is. An oversized RECORD is split into several
+    copies of itself that each hold a consecutive run of its subfields, and
+    oversized subfields are split recursively. The pieces keep the field's name,
+    so merge_split_records can stitch the enriched pieces back together. A piece
+    of a nested RECORD is sent inside copies of its ancestors, so it is measured
+    inside them as well.
+
+    A scalar field (or a RECORD with a single subfield that cannot be split any
+    further) that exceeds the budget is returned on its own with a warning.
+    """
+    if budget.fits([wrap_in_ancestors(field, ancestors)]):
+        return [field]
+
+    subfields = field.get("fields") or []
+    if not is_record(field) or not subfields:
+        logger.warning(f"Field '{field.get('name')}' exceeds the token budget and cannot be split further.")
+        return [field]
+
+    # Split the subfields first, so every subfield piece fits on its own
+    subfield_pieces = []
+    for subfield in subfields:
+        subfield_pieces.extend(split_field(subfield, budget, ancestors + (field,)))
+
+    # Then group consecutive subfield pieces into copies of this RECORD, the
+    # cost of a copy is the cost of the RECORD itself plus that of its subfields,
+    # each measured at its nesting depth
+    header_input, header_output = budget.estimate([wrap_in_ancestors(copy_with_subfields(field, []), ancestors)])
+
+    pieces = []
+    current = []
+    current_input, current_output = header_input, header_output
+    for subfield_piece in subfield_pieces:
+        piece_input, piece_output = budget.estimate(
+            [wrap_in_ancestors(copy_with_subfields(field, [subfield_piece]), ancestors)])
+        piece_input, piece_output = piece_input - header_input, piece_output - header_output
+
+        if current and (current_input + piece_input > budget.input_limit
+                        or current_output + piece_output > budget.output_limit):
+            pieces.append(copy_with_subfields(field, current))
+            current = []
+            current_input, current_output = header_input, header_output
+
+        current.append(subfield_piece)
+        current_input += piece_input
+        current_output += piece_output
+
+    if current:
+        pieces.append(copy_with_subfields(field, current))
+
+    logger.info(f"Split RECORD field '{field.get('name')}' into {len(pieces)} pieces.")
+    return pieces
+
+
+
+@log_entry_exit
+def plan_schema_chunks(json_schema: list, budget: TokenBudget) -> list:
+    """
+    Splits a schema into chunks that each fit in the token budget.
+
+    Fields are added to the current chunk, in schema order, until the next field
+    would exceed either the input or the output budget. Oversized RECORD fields
+    are split into pieces first (see split_field).
+
+    Args:
+        json_schema (list): The schema to split.
+        budget (TokenBudget): The token budget for a single request.
+
+    Returns:
+        list: A list of chunks, each chunk being a list of (possibly split) fields.
+    """
+    chunks = []
+    current = []
+    current_input = 0
+    current_output = 0
+
+    for field in json_schema:
+        for piece in split_field(field, budget):
+            piece_input, piece_output = budget.estimate([piece])
+
+            # Start a new chunk if this piece does not fit in the current one
+            if current and (current_input + piece_input > budget.input_limit
+                            or current_output + piece_output > budget.output_limit):
+                chunks.append(current)
+                current, current_input, current_output = [], 0, 0
+
+            current.append(piece)
+            current_input += piece_input
+            current_output += piece_output
+
+    if current:
+        chunks.append(current)
+
+    logger.info(f"Planned {len(chunks)} chunks for {count_fields(json_schema)} fields "
+                f"(input limit {budget.input_limit}, output limit {budget.output_limit} tokens per chunk).")
+    return chunks
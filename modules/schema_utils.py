@@ -0,0 +1,455 @@
+import re
+import copy
+
+
+def is_record(field: dict) -> bool:
+    """
+    Returns True if the field is a nested structure (RECORD or STRUCT).
+    """
+    return (field.get("type") or "").upper() in ("RECORD", "STRUCT")
+
+
+
+def count_fields(fields: list) -> int:
+    """
+    Counts all fields in a schema, including the nested subfields of RECORD fields.
+    """
+    return sum(1 + count_fields(field.get("fields") or []) for field in fields)
+
+
+
+def copy_with_subfields(field: dict, subfields: list) -> dict:
+    """
+    Returns a shallow copy of a RECORD field that only contains the given subfields.
+    This is used to split a large RECORD into several smaller pieces.
+    """
+    piece = copy.copy(field)
+    piece["fields"] = subfields
+    return piece
+
+
+
+def merge_split_records(fields: list) -> list:
+    """
+    Stitches the pieces of split RECORD fields back together.
+
+    BigQuery field names are unique within a STRUCT, so two adjacent siblings
+    with the same name can only be pieces of a RECORD that was split across
+    chunks. Their subfields are concatenated in order, and the description of
+    the first piece that has one is kept. Nested pieces end up adjacent once their
+    parents are merged, so the merge is applied recursively.
+
+    Args:
+        fields (list): The (enriched) fields, possibly containing split pieces.
+
+    Returns:
+        list: The fields with all pieces merged back into single RECORD fields.
+    """
+    merged = []
+    for field in fields:
+        previous = merged[-1] if merged else None
+
+        if (previous is not None and is_record(previous) and is_record(field)
+                and previous.get("name") == field.get("name")):
+            # Another piece of the previous RECORD, append its subfields
+            previous["fields"] = (previous.get("fields") or []) + (field.get("fields") or [])
+            for key, value in field.items():
+                if key != "fields" and not previous.get(key):
+                    previous[key] = value
+        else:
+            merged.append(dict(field))
+
+    # Pieces of nested RECORDs are adjacent now, so merge them as well
+    for field in merged:
+        if is_record(field):
+            field["fields"] = merge_split_records(field.get("fields") or [])
+
+    return merged
+
+
+
+# The keys that describe the structure of a field, every other key (description,
+# PHI/PII, HIPAA, ...) is generated by the LLM
+STRUCTURAL_KEYS = ("name", "type", "mode", "fields")
+
+
+def field_signature(field: dict) -> tuple:
+    """
+    Returns the (type, mode) signature of a field. An empty mode is the same as NULLABLE.
+    """
+    return ((field.get("type") or "").upper(), (field.get("mode") or "NULLABLE").upper())
+
+
+
+def index_by_path(fields: list, prefix: str = "") -> dict:
+    """
+    Indexes all fields of a schema, including nested subfields, by their full dotted path.
+
+    Args:
+        fields (list): The schema to index.
+        prefix (str): The dotted path of the parent field.
+
+    Returns:
+        dict: A dictionary mapping paths like "hospitalization.discharge_disposition" to fields.
+    """
+    index = {}
+    for field in fields:
+        path = f"{prefix}.{field.get('name')}" if prefix else field.get("name")
+        index[path] = field
+        index.update(index_by_path(field.get("fields") or [], path))
+    return index
+
+
+
+def diff_schemas(previous_schema: list, new_schema: list) -> dict:
+    """
+    Compares a previously enriched schema with a new input schema, field by field.
+
+    Fields are matched on their full dotted path. A field is 'added' if its path
+    did not exist before, 'changed' if its type or mode changed (or if the previous
+    run did not produce a description for it), and 'unchanged' otherwise.
+
+    Returns:
+        dict: The sets of paths under the keys 'added', 'changed' and 'unchanged'.
+    """
+    previous_index = index_by_path(previous_schema)
+    diff = {"added": set(), "changed": set(), "unchanged": set()}
+
+    for path, field in index_by_path(new_schema).items():
+        previous_field = previous_index.get(path)
+
+        if previous_field is None:
+            diff["added"].add(path)
+        elif field_signature(previous_field) != field_signature(field) or not previous_field.get("description"):
+            diff["changed"].add(path)
+        else:
+            diff["unchanged"].add(path)
+
+    return diff
+
+
+
+def prune_schema(fields: list, paths: set, prefix: str = "") -> list:
+    """
+    Returns the part of a schema that contains the given paths.
+
+    A field is kept if its own path is in paths, or if one of its descendants is.
+    RECORD fields that are only kept as a container hold just the subfields
+    that are needed.
+    """
+    pruned = []
+    for field in fields:
+        path = f"{prefix}.{field.get('name')}" if prefix else field.get("name")
+        subfields = prune_schema(field.get("fields") or [], paths, path)
+
+        if path in paths or subfields:
+            pruned.append(copy_with_subfields(field, subfields) if is_record(field) else field)
+
+    return pruned
+
+
+
+def merge_descriptions(new_schema: list, sources: list, prefix: str = "") -> list:
+    """
+    Rebuilds a schema with the structure of new_schema and the generated attributes
+    (description, PHI/PII, HIPAA, ...) of the first source that has the field.
+
+    Args:
+        new_schema (list): The schema that defines the structure of the result.
+        sources (list): Path indexes (see index_by_path) in order of preference.
+        prefix (str): The dotted path of the parent field.
+
+    Returns:
+        list: The merged schema.
+    """
+    merged = []
+    for field in new_schema:
+        path = f"{prefix}.{field.get('name')}" if prefix else field.get("name")
+        merged_field = {key: value for key, value in field.items() if key != "fields"}
+
+        # Take the generated attributes from the first source that described this field
+        for source in sources:
+            source_field = source.get(path)
+            if source_field is not None and source_field.get("description"):
+                merged_field.update({key: value for key, value in source_field.items()
+                                     if key not in STRUCTURAL_KEYS})
+                break
+
+        if "fields" in field:
+            merged_field["fields"] = merge_descriptions(field.get("fields") or [], sources, path)
+
+        merged.append(merged_field)
+
+    return merged
+
+
+
+def reconcile_fields(input_fields: list, enriched_fields: list) -> list:
+    """
+    Matches enriched fields returned by the LLM to the input fields they describe.
+
+    The result follows the order of input_fields. Enriched fields with the same name
+    (for example from a first response and a repair response) are merged, keeping the
+    first non-empty value of every attribute and the subfields of both. Fields that
+    the LLM made up, which do not exist in the input, are dropped.
+
+    Args:
+        input_fields (list): The fields that were sent to the LLM.
+        enriched_fields (list): The enriched fields received so far.
+
+    Returns:
+        list: The enriched fields, in input order.
+    """
+    by_name = {}
+    for field in enriched_fields:
+        if not isinstance(field, dict):
+            continue
+
+        name = field.get("name")
+        if name not in by_name:
+            by_name[name] = dict(field)
+            continue
+
+        existing = by_name[name]
+        for key, value in field.items():
+            if key == "fields":
+                existing["fields"] = (existing.get("fields") or []) + (value or [])
+            elif not existing.get(key):
+                existing[key] = value
+
+    reconciled = []
+    for input_field in input_fields:
+        field = by_name.get(input_field.get("name"))
+        if field is None:
+            continue
+
+        if is_record(input_field):
+            field["fields"] = reconcile_fields(input_field.get("fields") or [], field.get("fields") or [])
+
+        reconciled.append(field)
+
+    return reconciled
+
+
+
+def find_missing_fields(input_fields: list, enriched_fields: list) -> list:
+    """
+    Returns the part of input_fields that is missing from enriched_fields.
+
+    A field is missing if the LLM did not return it, or returned it without a
+    description. For a RECORD that was returned but lacks some of its subfields,
+    a copy of the RECORD with only the missing subfields is returned, so just
+    those subfields can be requested again.
+
+    Args:
+        input_fields (list): The fields that were sent to the LLM.
+        enriched_fields (list): The reconciled enriched fields (see reconcile_fields).
+
+    Returns:
+        list: The fields to request again, an empty list if nothing is missing.
+    """
+    by_name = {field.get("name"): field for field in enriched_fields}
+
+    missing = []
+    for input_field in input_fields:
+        field = by_name.get(input_field.get("name"))
+
+        if field is None:
+            missing.append(input_field)
+            continue
+
+        missing_subfields = []
+        if is_record(input_field):
+            missing_subfields = find_missing_fields(input_field.get("fields") or [], field.get("fields") or [])
+
+        if missing_subfields or not field.get("description"):
+            missing.append(copy_with_subfields(input_field, missing_subfields) if is_record(input_field) else input_field)
+
+    return missing
+
+
+
+# RECORD shapes with fewer subfields than this are not worth deduplicating
+MIN_SHARED_SHAPE_FIELDS = 2
+
+
+def record_shape(field: dict) -> tuple:
+    """
+    Returns the structural fingerprint of a RECORD: the names, types and modes of
+    all its descendants. Two RECORDs with the same shape (for example two FHIR
+    'period' or 'identifier' structures) only differ in their own name and position.
+    """
+    return tuple((subfield.get("name"),) + field_signature(subfield) + (record_shape(subfield),)
+                 for subfield in field.get("fields") or [])
+
+
+
+def dedupe_record_shapes(fields: list, seen: dict = None, prefix: str = "") -> tuple:
+    """
+    Removes the subfields of every repeated RECORD shape except its first occurrence.
+
+    The schema is walked in order. The first RECORD of each shape is kept as is, and
+    every later RECORD with the same shape keeps only its own attributes, so the LLM
+    describes the RECORD in its own context without describing the shared subfields
+    again. See project_record_shapes for restoring the subfields afterwards.
+
+    Args:
+        fields (list): The schema to deduplicate.
+        seen (dict): The paths of the first occurrence of each shape seen so far.
+        prefix (str): The dotted path of the parent field.
+
+    Returns:
+        tuple: The deduplicated schema, and a dictionary mapping the path of every
+        repeated RECORD to the path of the first RECORD with its shape.
+    """
+    seen = {} if seen is None else seen
+    deduped, projections = [], {}
+
+    for field in fields:
+        path = f"{prefix}.{field.get('name')}" if prefix else field.get("name")
+
+        if not is_record(field) or len(field.get("fields") or []) < MIN_SHARED_SHAPE_FIELDS:
+            deduped.append(field)
+            continue
+
+        shape = record_shape(field)
+        if shape in seen:
+            deduped.append(copy_with_subfields(field, []))
+            projections[path] = seen[shape]
+            continue
+
+        seen[shape] = path
+        subfields, nested_projections = dedupe_record_shapes(field.get("fields") or [], seen, path)
+        deduped.append(copy_with_subfields(field, subfields))
+        projections.update(nested_projections)
+
+    return deduped, projections
+
+
+
+def retarget_description(description: str, source_path: str, target_path: str) -> str:
+    """
+    Rewrites a description written for a subfield of the RECORD at source_path for
+    the same subfield of the RECORD at target_path: dotted paths below the source
+    RECORD, and its name (as identifier or in words), are replaced by the target's.
+    """
+    description = re.sub(rf"(?<![\w.]){re.escape(source_path)}(?=\.\w)", target_path, description)
+
+    source_name, target_name = source_path.rsplit(".", 1)[-1], target_path.rsplit(".", 1)[-1]
+    if source_name == target_name:
+        return description
+
+    # A name without underscores is an ordinary word, which is replaced by the target's words
+    replacements = [(source_name.replace("_", " "), target_name.replace("_", " "))]
+    if "_" in source_name:
+        replacements.insert(0, (source_name, target_name))
+
+    for source, target in replacements:
+        description = re.sub(rf"(?<![\w.]){re.escape(source)}(?![\w])", target, description)
+    return description
+
+
+
+def retarget_descriptions(fields: list, source_path: str, target_path: str) -> list:
+    """
+    Applies retarget_description to the descriptions of all fields, including nested subfields.
+    """
+    for field in fields:
+        if isinstance(field.get("description"), str):
+            field["description"] = retarget_description(field["description"], source_path, target_path)
+        retarget_descriptions(field.get("fields") or [], source_path, target_path)
+    return fields
+
+
+
+def project_record_shapes(enriched_fields: list, projections: dict, prefix: str = "", index: dict = None) -> list:
+    """
+    Copies the enriched subfields of the first occurrence of every RECORD shape onto
+    its repeated occurrences (see dedupe_record_shapes). The repeated RECORDs keep
+    their own generated attributes, only their subfields are copied, and mentions of
+    the first occurrence in their descriptions are rewritten for the repeated
+    occurrence (see retarget_description). Wording that is specific to the context
+    of the first occurrence otherwise stays, which is why deduplication is opt-in.
+
+    Args:
+        enriched_fields (list): The enriched, deduplicated schema.
+        projections (dict): The repeated RECORD paths and the paths of their first occurrence.
+        prefix (str): The dotted path of the parent field.
+        index (dict): The path index of the complete enriched schema.
+
+    Returns:
+        list: The enriched schema with the subfields of all repeated RECORDs restored.
+    """
+    index = index_by_path(enriched_fields) if index is None else index
+
+    projected = []
+    for field in enriched_fields:
+        path = f"{prefix}.{field.get('name')}" if prefix else field.get("name")
+
+        if path in projections:
+            # The first occurrence can hold repeated RECORDs itself, so project its copy as well
+            source = index.get(projections[path]) or {}
+            subfields = copy.deepcopy(source.get("fields") or [])
+            subfields = project_record_shapes(subfields, projections, projections[path], index)
+            field = copy_with_subfields(field, retarget_descriptions(subfields, projections[path], path))
+        elif field.get("fields"):
+            field = copy_with_subfields(field, project_record_shapes(field["fields"], projections, path, index))
+
+        projected.append(field)
+
+    return projected
+
+
+
+def compact_field_lines(fields: list, prefix: str = "") -> list:
+    """
+    Flattens a schema into one 'path TYPE MODE' line per field, including nested subfields.
+    This is the compact wire format sent to the LLM instead of the full field JSON.
+    """
+    lines = []
+    for field in fields:
+        path = f"{prefix}.{field.get('name')}" if prefix else field.get("name")
+        field_type, field_mode = field_signature(field)
+        lines.append(f"{path} {field_type} {field_mode}")
+        lines.extend(compact_field_lines(field.get("fields") or [], path))
+    return lines
+
+
+
+def expand_compact_response(fields: list, attributes_by_path: dict, prefix: str = "") -> list:
+    """
+    Rebuilds enriched fields from a compact LLM response.
+
+    The structure (name, type, mode, nested fields) is taken from the input fields, 
+    and the generated attributes (description, PHI/PII, HIPAA) from the response, 
+    which maps every field path to its attributes. Every input field is part of the
+    result, the fields the response does not mention have an empty description, so
+    find_missing_fields requests them again.
+
+    Args:
+        fields (list): The fields that were sent to the LLM.
+        attributes_by_path (dict): The parsed response, keyed by dotted field path.
+        prefix (str): The dotted path of the parent field.
+
+    Returns:
+        list: The enriched fields.
+    """
+    # Paths are matched exactly, with a case insensitive fallback
+    lowercase_attributes = {str(path).lower(): value for path, value in attributes_by_path.items()}
+
+    expanded = []
+    for field in fields:
+        path = f"{prefix}.{field.get('name')}" if prefix else field.get("name")
+        attributes = attributes_by_path.get(path, lowercase_attributes.get(path.lower()))
+
+        enriched_field = {key: value for key, value in field.items() if key != "fields"}
+        if isinstance(attributes, dict):
+            enriched_field.update({key: value for key, value in attributes.items() if key not in STRUCTURAL_KEYS})
+        else:
+            enriched_field["description"] = ""
+        if "fields" in field:
+            enriched_field["fields"] = expand_compact_response(field.get("fields") or [], attributes_by_path, path)
+
+        expanded.append(enriched_field)
+
+    return expanded
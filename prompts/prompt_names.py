@@ -1,2 +1,3 @@
 GET_TABLE_DESCRIPTION = "get_table_description.txt"
-GENERATE_RESOURCE_SCHEMA_DESCRIPTIONS = "generate_resource_schema_with_descriptions.txt"
\ No newline at end of file
+GENERATE_RESOURCE_SCHEMA_DESCRIPTIONS = "generate_resource_schema_with_descriptions.txt"
+GENERATE_RESOURCE_SCHEMA_DESCRIPTIONS_COMPACT = "generate_resource_schema_descriptions_compact.txt"
\ No newline at end of file
@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# The modules are imported from, and read their prompts and schemas relative to, the repository root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+@pytest.fixture(autouse=True)
+def repo_root_cwd(monkeypatch):
+    """Runs every test from the repository root."""
+    monkeypatch.chdir(REPO_ROOT)
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from generate_description_for_schema import build_batch_client
+from modules.fake_llm import FakeChatModel
+from modules.FHIResourceManager import FHIRResourceManager
+from modules.batch_jobs import BatchJobClient, build_chat_request
+from modules.batch_stub_server import BatchStubServer
+from modules.schema_utils import index_by_path
+
+
+@pytest.fixture
+def stub_server():
+    server = BatchStubServer(("127.0.0.1", 0)).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+
+def test_batch_job_round_trip(stub_server, tmp_path):
+    """Every request of a batch job comes back under its custom_id, with its usage."""
+    prompts = {
+        "chunk-00001": "Describe these fields:\nencounter_id STRING NULLABLE\nperiod.start TIMESTAMP NULLABLE",
+        "chunk-00002": "Describe these fields:\nstatus STRING REQUIRED",
+    }
+    batch_requests = [build_chat_request(custom_id, "gpt-4o", prompt, max_tokens=500)
+                      for custom_id, prompt in prompts.items()]
+
+    client = BatchJobClient(base_url=stub_server.base_url, api_key="test", batch_dir=str(tmp_path),
+                            poll_interval_seconds=0, timeout_seconds=10)
+    usage = {}
+    results = client.run(batch_requests, "test.round_trip", usage=usage)
+
+    assert set(results) == set(prompts)
+    assert set(json.loads(results["chunk-00001"])) == {"encounter_id", "period.start"}
+    assert json.loads(results["chunk-00002"])["status"]["description"] == "Stub description of status."
+    assert set(usage) == set(prompts)
+    assert all(usage[custom_id]["input_tokens"] > 0 for custom_id in prompts)
+
+    # The job file and the raw results are kept next to each other
+    assert (tmp_path / "test.round_trip.jsonl").exists()
+    assert json.loads((tmp_path / "test.round_trip.results.json").read_text()) == results
+
+
+
+def test_batch_mode_rejects_gemini_models(stub_server, tmp_path):
+    """The batch jobs use the OpenAI Batch API format, a Gemini model is rejected up front."""
+    client = BatchJobClient(base_url=stub_server.base_url, api_key="test", batch_dir=str(tmp_path))
+
+    with pytest.raises(ValueError, match="gemini-1.5-pro"):
+        FHIRResourceManager(FakeChatModel(model_name="gemini-1.5-pro"), "test.synthetic.fhir_encounters",
+                            batch_client=client)
+    with pytest.raises(ValueError, match="gemini-1.5-flash"):
+        build_batch_client({"batch_api": {"base_url": stub_server.base_url}}, ["gpt-4o", "gemini-1.5-flash"])
+
+    assert isinstance(build_batch_client({"batch_api": {"base_url": stub_server.base_url}}, ["gpt-4o"]),
+                      BatchJobClient)
+
+
+
+def test_batch_enrichment_against_the_stub_server(stub_server, tmp_path):
+    """An OpenAI model enriches every field through one batch job on the stub server."""
+    with open("fhir files/encounters_table_schema.json", "r", encoding="utf-8") as f:
+        schema = json.load(f)
+    client = BatchJobClient(base_url=stub_server.base_url, api_key="test", batch_dir=str(tmp_path),
+                            poll_interval_seconds=0, timeout_seconds=10)
+    llm = FakeChatModel(model_name="gpt-4o")
+
+    fhir_mgr = FHIRResourceManager(llm, "test.synthetic.fhir_encounters", batch_client=client)
+    enriched_schema = fhir_mgr.generate_enriched_schema(schema)
+
+    assert llm.calls == 0
+    assert len(list(tmp_path.glob("*.results.json"))) == 1
+    assert set(index_by_path(enriched_schema)) == set(index_by_path(schema))
+    assert fhir_mgr.unresolved_paths == set()
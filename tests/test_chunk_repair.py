@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from modules.fake_llm import FakeChatModel
+from modules.FHIResourceManager import FHIRResourceManager
+from modules.schema_utils import index_by_path, reconcile_fields, find_missing_fields
+
+
+def load_encounter_schema() -> list:
+    with open("fhir files/encounters_table_schema.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+
+@pytest.mark.parametrize("wire_format", ["compact", "json"])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_enrichment_keeps_every_field(wire_format, seed):
+    """
+    With dropped fields and malformed responses, and too few retries to repair them all,
+    every input field still comes back, and the undescribed ones are reported.
+    """
+    schema = load_encounter_schema()
+    llm = FakeChatModel(drop_rate=0.2, malformed_rate=0.2, seed=seed)
+    fhir_mgr = FHIRResourceManager(llm, "test.synthetic.fhir_encounters", max_retries=1, retry_base_delay=0.0,
+                                   wire_format=wire_format)
+
+    enriched_schema = fhir_mgr.generate_enriched_schema(schema)
+
+    input_index = index_by_path(schema)
+    enriched_index = index_by_path(enriched_schema)
+    assert set(enriched_index) == set(input_index)
+    for path, field in input_index.items():
+        assert (enriched_index[path].get("type"), enriched_index[path].get("mode")) == \
+               (field.get("type"), field.get("mode"))
+
+    undescribed = {path for path, field in enriched_index.items() if not field.get("description")}
+    assert undescribed == fhir_mgr.unresolved_paths
+
+    # Every column ends up in the DDL, described or not
+    sql = fhir_mgr.generate_sql(enriched_schema, "A test table.", "create")
+    assert all(f"`{field['name']}`" in sql or f" {field['name']} " in sql for field in schema)
+
+
+
+INPUT_FIELDS = [
+    {"name": "status", "type": "STRING", "mode": "NULLABLE"},
+    {"name": "period", "type": "RECORD", "mode": "NULLABLE", "fields": [
+        {"name": "start", "type": "TIMESTAMP", "mode": "NULLABLE"},
+        {"name": "end", "type": "TIMESTAMP", "mode": "NULLABLE"},
+    ]},
+]
+
+
+def test_reconcile_merges_repair_responses_in_input_order():
+    """A first response and a repair response are merged, made up fields are dropped."""
+    first_response = [
+        {"name": "period", "type": "RECORD", "description": "The period.",
+         "fields": [{"name": "end", "type": "TIMESTAMP", "description": "The end."}]},
+        {"name": "invented", "type": "STRING", "description": "Not in the input."},
+    ]
+    repair_response = [
+        {"name": "status", "type": "STRING", "description": "The status."},
+        {"name": "period", "type": "RECORD", "description": "",
+         "fields": [{"name": "start", "type": "TIMESTAMP", "description": "The start."}]},
+    ]
+
+    reconciled = reconcile_fields(INPUT_FIELDS, first_response + repair_response)
+
+    assert [field["name"] for field in reconciled] == ["status", "period"]
+    assert reconciled[1]["description"] == "The period."
+    assert [field["name"] for field in reconciled[1]["fields"]] == ["start", "end"]
+    assert find_missing_fields(INPUT_FIELDS, reconciled) == []
+
+
+
+def test_find_missing_fields_requests_only_the_missing_subfields():
+    """A returned RECORD without some of its subfields is requested again with just those."""
+    reconciled = reconcile_fields(INPUT_FIELDS, [
+        {"name": "status", "type": "STRING", "description": ""},
+        {"name": "period", "type": "RECORD", "description": "The period.",
+         "fields": [{"name": "start", "type": "TIMESTAMP", "description": "The start."}]},
+    ])
+
+    assert find_missing_fields(INPUT_FIELDS, reconciled) == [
+        INPUT_FIELDS[0],
+        {"name": "period", "type": "RECORD", "mode": "NULLABLE", "fields": [INPUT_FIELDS[1]["fields"][1]]},
+    ]
+
+
+
+def test_retries_repair_the_gaps():
+    """With enough retries, every dropped field and malformed response is repaired."""
+    schema = load_encounter_schema()
+    llm = FakeChatModel(drop_rate=0.2, malformed_rate=0.2, seed=0)
+    fhir_mgr = FHIRResourceManager(llm, "test.synthetic.fhir_encounters", max_retries=10, retry_base_delay=0.0)
+
+    enriched_schema = fhir_mgr.generate_enriched_schema(schema)
+
+    assert fhir_mgr.unresolved_paths == set()
+    assert all(field.get("description") for field in index_by_path(enriched_schema).values())
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from modules.FHIResourceManager import FHIRResourceManager
+from modules.fake_llm import FakeChatModel
+from modules.schema_utils import compact_field_lines, expand_compact_response, index_by_path
+
+SCHEMA = [
+    {"name": "id", "type": "STRING", "mode": "", "description": ""},
+    {"name": "class", "type": "RECORD", "mode": "REPEATED", "description": "", "fields": [
+        {"name": "code", "type": "STRING", "mode": "", "description": ""},
+        {"name": "system", "type": "STRING", "mode": "REQUIRED", "description": ""},
+    ]},
+]
+
+
+
+def test_fields_are_flattened_to_path_lines():
+    assert compact_field_lines(SCHEMA) == [
+        "id STRING NULLABLE",
+        "class RECORD REPEATED",
+        "class.code STRING NULLABLE",
+        "class.system STRING REQUIRED",
+    ]
+
+
+
+def test_response_is_expanded_onto_every_input_path():
+    """The structure comes from the input, paths match case insensitively, missing paths stay empty."""
+    response = {
+        "id": {"description": "The id.", "PHI/PII": False, "HIPAA": False},
+        "CLASS": {"description": "The class.", "name": "renamed", "type": "INTEGER"},
+        "class.code": {"description": "The class code."},
+    }
+
+    expanded = expand_compact_response(SCHEMA, response)
+    index = index_by_path(expanded)
+
+    assert set(index) == set(index_by_path(SCHEMA))
+    assert index["id"]["PHI/PII"] is False
+    assert index["class"] == {"name": "class", "type": "RECORD", "mode": "REPEATED",
+                              "description": "The class.", "fields": index["class"]["fields"]}
+    assert index["class.code"]["description"] == "The class code."
+    assert index["class.system"]["description"] == ""
+    assert index["class.system"]["mode"] == "REQUIRED"
+
+
+
+@pytest.mark.parametrize("wire_format", ["compact", "json"])
+def test_both_wire_formats_describe_every_field(wire_format):
+    llm = FakeChatModel(model_name="fake-model")
+    fhir_mgr = FHIRResourceManager(llm, "test.synthetic.fhir_encounters", wire_format=wire_format)
+    enriched = fhir_mgr.generate_enriched_schema(SCHEMA)
+
+    index = index_by_path(enriched)
+    assert set(index) == set(index_by_path(SCHEMA))
+    assert all(field["description"] for field in index.values())
+    assert index["class.system"]["mode"] == "REQUIRED"
+
+
+
+def test_compact_requests_use_fewer_tokens():
+    """The compact format neither sends nor receives the field JSON."""
+    with open("fhir files/encounters_table_schema.json") as f:
+        schema = json.load(f)
+
+    tokens = {}
+    for wire_format in ("compact", "json"):
+        fhir_mgr = FHIRResourceManager(FakeChatModel(model_name="fake-model"), "test.synthetic.fhir_encounters",
+                                       wire_format=wire_format)
+        fhir_mgr.generate_enriched_schema(schema)
+        tokens[wire_format] = fhir_mgr.input_tokens + fhir_mgr.output_tokens
+
+    assert tokens["compact"] < tokens["json"]
+
+
+
+def test_unknown_wire_format_is_rejected():
+    with pytest.raises(ValueError):
+        FHIRResourceManager(FakeChatModel(), "test.synthetic.fhir_encounters", wire_format="xml")
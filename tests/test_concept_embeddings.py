@@ -0,0 +1,100 @@
+import hashlib
+from collections import namedtuple
+
+import numpy as np
+import pytest
+
+from modules.concept_embeddings import ConceptEmbeddingStore, concept_key, embedding_similarity
+
+# The columns of a GlobalDataConcept the embedding store uses
+Concept = namedtuple("Concept", ["global_concept_id", "concept_name", "version"])
+
+
+class HashEmbeddingModel:
+    """A stand-in for the sentence embedding model, with a deterministic vector per text."""
+
+    def __init__(self, dimension=8):
+        self.dimension = dimension
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        return np.array([np.frombuffer(hashlib.sha256(text.encode("utf-8")).digest()[:self.dimension],
+                                       dtype=np.uint8) for text in texts], dtype=np.float32)
+
+
+CONCEPTS = [Concept(1, "patient_id", 1), Concept(2, "admission_date", 1), Concept(3, "discharge_date", 2)]
+
+
+
+def test_key_changes_with_the_version_and_the_name():
+    key = concept_key(Concept(1, "patient_id", 1))
+    assert key.startswith("1:1:")
+    assert concept_key(Concept(1, "patient_id", 2)) != key
+    assert concept_key(Concept(1, "patient_identifier", 1)) != key
+
+
+
+def test_embeddings_are_encoded_once_and_memory_mapped(tmp_path):
+    model = HashEmbeddingModel()
+    store = ConceptEmbeddingStore(str(tmp_path / "store"))
+
+    first = np.array(store.get_embeddings(CONCEPTS, model))
+    assert model.encoded == ["patient_id", "admission_date", "discharge_date"]
+
+    # A new store (a new process) loads the same embeddings without encoding anything
+    second = ConceptEmbeddingStore(str(tmp_path / "store")).get_embeddings(CONCEPTS, model)
+    assert isinstance(second, np.memmap)
+    assert len(model.encoded) == 3
+    np.testing.assert_array_equal(first, second)
+
+
+
+def test_only_changed_concepts_are_encoded_again(tmp_path):
+    model = HashEmbeddingModel()
+    store = ConceptEmbeddingStore(str(tmp_path / "store"))
+    original = np.array(store.get_embeddings(CONCEPTS, model))
+    model.encoded.clear()
+
+    changed = [CONCEPTS[0], Concept(2, "admit_date", 2), CONCEPTS[2], Concept(4, "ward", 1)]
+    embeddings = store.get_embeddings(changed, model)
+
+    assert model.encoded == ["admit_date", "ward"]
+    np.testing.assert_array_equal(embeddings[0], original[0])
+    np.testing.assert_array_equal(embeddings[2], original[2])
+    np.testing.assert_array_equal(embeddings[1], HashEmbeddingModel().encode(["admit_date"])[0])
+    assert store.fingerprint(changed) != store.fingerprint(CONCEPTS)
+
+
+
+def test_store_of_another_model_is_rebuilt(tmp_path):
+    model = HashEmbeddingModel()
+    ConceptEmbeddingStore(str(tmp_path / "store")).get_embeddings(CONCEPTS, model)
+    model.encoded.clear()
+
+    other = ConceptEmbeddingStore(str(tmp_path / "store"), model_name="all-mpnet-base-v2")
+    other.get_embeddings(CONCEPTS, model)
+    assert len(model.encoded) == 3
+
+    # The backend is part of the model identity as well
+    ConceptEmbeddingStore(str(tmp_path / "store"), model_name="all-mpnet-base-v2",
+                          backend="onnx").get_embeddings(CONCEPTS, model)
+    assert len(model.encoded) == 6
+
+
+
+def test_interrupted_store_is_rebuilt(tmp_path):
+    model = HashEmbeddingModel()
+    store = ConceptEmbeddingStore(str(tmp_path / "store"))
+    store.get_embeddings(CONCEPTS, model)
+
+    (tmp_path / "store" / "index.json").unlink()
+    model.encoded.clear()
+    store.get_embeddings(CONCEPTS, model)
+    assert len(model.encoded) == 3
+
+
+
+def test_embedding_similarity_per_row():
+    reference = np.array([[1.0, 0.0], [0.0, 2.0]])
+    assert embedding_similarity(reference, np.array([[2.0, 0.0], [1.0, 0.0]])) == pytest.approx([1.0, 0.0])
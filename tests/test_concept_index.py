@@ -0,0 +1,160 @@
+import numpy as np
+import pytest
+
+from modules.concept_index import (ExactConceptIndex, IVFConceptIndex, QuantizedConceptIndex, load_or_build_index,
+                                   normalize_embeddings, top_k_indices)
+
+
+def clustered_embeddings(seed=0, concepts=4000, clusters=40, dimension=32):
+    """Concept embeddings around random cluster centers, like the names of related concepts."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension))
+    members = centers[rng.integers(clusters, size=concepts)]
+    return (members + rng.normal(scale=0.5, size=(concepts, dimension))).astype(np.float32)
+
+
+def queries_near(embeddings, seed=1, count=300):
+    """Queries close to random concepts, like column names that match a concept."""
+    rng = np.random.default_rng(seed)
+    picked = embeddings[rng.integers(len(embeddings), size=count)]
+    return normalize_embeddings(picked + rng.normal(scale=0.3, size=picked.shape))
+
+
+def recall(index, exact, queries, top_k=1):
+    """The fraction of the exact top_k concepts the index finds as well."""
+    found, _ = index.search(queries, top_k)
+    expected, _ = exact.search(queries, top_k)
+    return np.mean([len(set(row) & set(expected_row)) / top_k for row, expected_row in zip(found, expected)])
+
+
+
+def test_top_k_indices_start_with_the_argmax():
+    scores = np.array([[0.1, 0.9, 0.5, 0.9], [0.3, 0.3, 0.3, 0.3]])
+    ranked = top_k_indices(scores, 2)
+
+    assert list(ranked[:, 0]) == list(scores.argmax(axis=1))
+    assert list(ranked[0]) == [1, 3]
+
+
+
+def test_ivf_recall_against_the_exact_index():
+    embeddings = clustered_embeddings()
+    queries = queries_near(embeddings)
+    exact = ExactConceptIndex.build(embeddings)
+
+    index = IVFConceptIndex.build(embeddings, n_probe=16)
+    assert len(index.centroids) == 4 * int(np.sqrt(len(embeddings)))
+    assert recall(index, exact, queries) >= 0.95
+    assert recall(index, exact, queries, top_k=3) >= 0.9
+
+    # Every inverted list maps back to the concept rows, and scores are the exact cosine similarities
+    assert sorted(index.order) == list(range(len(embeddings)))
+    indices, scores = index.search(queries, 1)
+    np.testing.assert_allclose(scores[:, 0], np.sum(normalize_embeddings(embeddings[indices[:, 0]]) * queries, axis=1),
+                               rtol=1e-5)
+
+
+
+def test_ivf_probing_every_list_is_exact():
+    embeddings = clustered_embeddings(concepts=500)
+    queries = queries_near(embeddings, count=100)
+
+    index = IVFConceptIndex.build(embeddings, n_lists=10, n_probe=10)
+    assert recall(index, ExactConceptIndex.build(embeddings), queries, top_k=5) == 1.0
+
+
+
+def test_ivf_marks_missing_candidates():
+    """With fewer concepts in the probed lists than top_k, the rest is -1."""
+    embeddings = clustered_embeddings(concepts=20, clusters=4)
+    indices, scores = IVFConceptIndex.build(embeddings, n_lists=20, n_probe=1).search(queries_near(embeddings), 3)
+
+    assert (indices[:, 0] >= 0).all()
+    assert (indices[:, 1:] == -1).all() and np.isneginf(scores[:, 1:]).all()
+
+
+
+def test_index_is_persisted_with_its_fingerprint_and_params(tmp_path):
+    embeddings = clustered_embeddings(concepts=1000)
+    queries = queries_near(embeddings, count=50)
+    index_dir = str(tmp_path / "index")
+
+    built = load_or_build_index("ivf", embeddings, index_dir=index_dir, fingerprint="v1", n_probe=8)
+    loaded = load_or_build_index("ivf", embeddings, index_dir=index_dir, fingerprint="v1", n_probe=8)
+
+    assert isinstance(loaded.vectors, np.memmap)
+    assert loaded.n_probe == 8
+    for expected, found in zip(built.search(queries, 3), loaded.search(queries, 3)):
+        np.testing.assert_array_equal(expected, found)
+
+    # Other embeddings or other params build the index again
+    assert not isinstance(load_or_build_index("ivf", embeddings, index_dir=index_dir, fingerprint="v2",
+                                              n_probe=8).vectors, np.memmap)
+    assert not isinstance(load_or_build_index("ivf", embeddings, index_dir=index_dir, fingerprint="v2",
+                                              n_probe=4).vectors, np.memmap)
+
+
+
+@pytest.mark.parametrize("precision, dtype, bytes_per_value", [("int8", np.int8, 1), ("float16", np.float16, 2)])
+def test_quantized_recall_against_the_exact_index(precision, dtype, bytes_per_value):
+    embeddings = clustered_embeddings()
+    queries = queries_near(embeddings)
+    exact = ExactConceptIndex.build(embeddings)
+
+    index = QuantizedConceptIndex.build(embeddings, precision=precision)
+    assert index.codes.dtype == dtype
+    assert index.codes.nbytes == embeddings.nbytes * bytes_per_value // 4
+    assert recall(index, exact, queries) == 1.0
+    assert recall(index, exact, queries, top_k=3) >= 0.99
+
+    # The re-ranked scores are the exact float scores
+    expected_indices, expected_scores = exact.search(queries, 1)
+    indices, scores = index.search(queries, 1)
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+
+
+def test_quantized_scan_over_several_blocks(monkeypatch):
+    """The candidates of every block of quantized vectors are merged before the re-ranking."""
+    monkeypatch.setattr("modules.concept_index.QUANTIZED_BLOCK_SIZE", 300)
+    embeddings = clustered_embeddings(concepts=1000)
+    queries = queries_near(embeddings, count=100)
+
+    index = QuantizedConceptIndex.build(embeddings, rerank=8)
+    assert recall(index, ExactConceptIndex.build(embeddings), queries, top_k=3) >= 0.95
+
+
+
+def test_unknown_precision_is_rejected():
+    with pytest.raises(ValueError):
+        QuantizedConceptIndex.build(clustered_embeddings(concepts=10), precision="int4")
+
+
+
+def test_quantized_index_is_persisted_without_the_float_vectors(tmp_path):
+    embeddings = clustered_embeddings(concepts=1000)
+    queries = queries_near(embeddings, count=50)
+    index_dir = tmp_path / "index"
+
+    built = load_or_build_index("quantized", embeddings, index_dir=str(index_dir), fingerprint="v1",
+                                precision="int8", rerank=16)
+    loaded = load_or_build_index("quantized", embeddings, index_dir=str(index_dir), fingerprint="v1",
+                                 precision="int8", rerank=16)
+
+    assert sorted(path.name for path in index_dir.iterdir()) == \
+        ["quantized_codes.npy", "quantized_index.json", "quantized_scales.npy"]
+    assert isinstance(loaded.codes, np.memmap) and loaded.codes.dtype == np.int8
+    assert loaded.rerank == 16
+    for expected, found in zip(built.search(queries, 3), loaded.search(queries, 3)):
+        np.testing.assert_array_equal(expected, found)
+
+    # Another precision builds the index again
+    assert load_or_build_index("quantized", embeddings, index_dir=str(index_dir), fingerprint="v1",
+                               precision="float16", rerank=16).codes.dtype == np.float16
+
+
+
+def test_unknown_index_kind_is_rejected():
+    with pytest.raises(ValueError):
+        load_or_build_index("hnsw", clustered_embeddings(concepts=10))
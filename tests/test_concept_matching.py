@@ -0,0 +1,103 @@
+from collections import namedtuple
+
+import numpy as np
+import pytest
+
+pytest.importorskip("mysql.connector")
+
+from modules.concept_index import ExactConceptIndex, normalize_embeddings
+from modules.process_metadata import match_columns_to_concepts, MATCH_THRESHOLD
+
+Concept = namedtuple("Concept", ["global_concept_id", "concept_name", "version"])
+
+
+class TableEmbeddingModel:
+    """A stand-in for the sentence embedding model, with a fixed vector per text."""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.batches = []
+
+    def encode(self, texts):
+        self.batches.append(list(texts))
+        return np.array([self.vectors[text] for text in texts], dtype=np.float32)
+
+
+def random_catalog(seed=0, concepts=200, columns=300, dimension=32):
+    """Concepts with random vectors, and columns that are close to a concept or unrelated to all of them."""
+    rng = np.random.default_rng(seed)
+    concept_vectors = rng.normal(size=(concepts, dimension)).astype(np.float32)
+    global_concepts = [Concept(idx, f"concept_{idx}", 1) for idx in range(concepts)]
+
+    vectors = {}
+    for idx in range(columns):
+        if idx % 2:
+            vector = concept_vectors[rng.integers(concepts)] + rng.normal(scale=0.4, size=dimension)
+        else:
+            vector = rng.normal(size=dimension)
+        vectors[f"column_{idx}"] = vector.astype(np.float32)
+    return concept_vectors, global_concepts, vectors
+
+
+def brute_force_match(column_vector, concept_vectors):
+    scores = normalize_embeddings(concept_vectors) @ normalize_embeddings(column_vector[None, :])[0]
+    return int(scores.argmax()), float(scores.max())
+
+
+
+def test_matches_are_the_brute_force_argmax():
+    concept_vectors, global_concepts, vectors = random_catalog()
+    model = TableEmbeddingModel(vectors)
+
+    matches = match_columns_to_concepts(model, list(vectors), ExactConceptIndex.build(concept_vectors),
+                                        global_concepts)
+
+    assert len(model.batches) == 1
+    matched = 0
+    for name, vector in vectors.items():
+        best, score = brute_force_match(vector, concept_vectors)
+        match = matches[name]
+
+        assert match.candidates[0][0] == global_concepts[best]
+        assert match.score == pytest.approx(score, abs=1e-5)
+        assert match.concept == (global_concepts[best] if score > MATCH_THRESHOLD else None)
+        matched += match.concept is not None
+
+    # Only the columns that were derived from a concept are matched
+    assert 0 < matched <= len(vectors) // 2
+
+
+
+def test_candidates_are_the_top_k_best_first():
+    concept_vectors, global_concepts, vectors = random_catalog(seed=1, columns=20)
+    matches = match_columns_to_concepts(TableEmbeddingModel(vectors), list(vectors),
+                                        ExactConceptIndex.build(concept_vectors), global_concepts, top_k=5)
+
+    for name, vector in vectors.items():
+        scores = normalize_embeddings(concept_vectors) @ normalize_embeddings(vector[None, :])[0]
+        candidate_scores = [score for _, score in matches[name].candidates]
+
+        assert [concept.global_concept_id for concept, _ in matches[name].candidates] == \
+            list(np.argsort(-scores)[:5])
+        assert candidate_scores == sorted(candidate_scores, reverse=True)
+
+
+
+def test_duplicate_names_are_encoded_once():
+    concept_vectors, global_concepts, vectors = random_catalog(columns=4)
+    model = TableEmbeddingModel(vectors)
+    names = ["column_1", "column_2", "column_1", "column_3", "column_2"]
+
+    matches = match_columns_to_concepts(model, names, ExactConceptIndex.build(concept_vectors), global_concepts)
+
+    assert model.batches == [["column_1", "column_2", "column_3"]]
+    assert list(matches) == ["column_1", "column_2", "column_3"]
+
+
+
+def test_no_concepts_match_nothing():
+    model = TableEmbeddingModel({})
+    matches = match_columns_to_concepts(model, ["patient_id", "patient_id"], None, [])
+
+    assert matches == {"patient_id": (None, 0.0, [])}
+    assert model.batches == []
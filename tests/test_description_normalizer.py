@@ -0,0 +1,62 @@
+import pytest
+
+from modules.description_normalizer import (coerce_flag, normalize_description, normalize_enriched_schema,
+                                            truncate_description)
+
+
+
+def test_short_descriptions_are_kept():
+    assert truncate_description("The encounter status.", 100) == "The encounter status."
+
+
+
+def test_truncation_keeps_complete_sentences():
+    text = "The status of the encounter. It is one of planned, in-progress or finished."
+    assert truncate_description(text, 50) == "The status of the encounter."
+
+
+
+def test_truncation_falls_back_to_a_word_boundary():
+    """A sentence boundary that drops more than half of the limit is not used."""
+    text = "Short. The remaining text of this description is a single long sentence without an end"
+    truncated = truncate_description(text, 40)
+
+    assert truncated == "Short. The remaining text of this..."
+    assert len(truncated) <= 40
+
+
+
+def test_whitespace_is_collapsed():
+    assert normalize_description("The  status\nof the\tencounter. ", 100) == \
+        ("The status of the encounter.", ["whitespace"])
+    assert normalize_description("A description that is too long.", 10)[1] == ["truncated"]
+    assert normalize_description(None, 10) == (None, [])
+
+
+
+@pytest.mark.parametrize("value, expected", [
+    (True, True), (False, False), (None, False), (0, False), (1, True),
+    ("True", True), ("yes", True), ("maybe", True), (" FALSE ", False), ("no", False), ("null", False), ("", False),
+])
+def test_flags_are_coerced_to_booleans(value, expected):
+    assert coerce_flag(value) is expected
+
+
+
+def test_schema_normalization_reports_every_change():
+    schema = [
+        {"name": "id", "type": "STRING", "description": "The id.", "PHI/PII": "yes", "HIPAA": False},
+        {"name": "period", "type": "RECORD", "description": "The period.", "fields": [
+            {"name": "start", "type": "TIMESTAMP", "description": "The start\nof the period.", "HIPAA": "no"},
+        ]},
+    ]
+
+    normalized, changes = normalize_enriched_schema(schema, 100)
+
+    assert normalized[0]["PHI/PII"] is True
+    assert normalized[1]["fields"][0] == {"name": "start", "type": "TIMESTAMP",
+                                          "description": "The start of the period.", "HIPAA": False}
+    assert changes == [("id", "flag"), ("period.start", "whitespace"), ("period.start", "flag")]
+
+    # The input is left unchanged
+    assert schema[0]["PHI/PII"] == "yes"
@@ -0,0 +1,95 @@
+import pytest
+
+from modules.FHIResourceManager import FHIRResourceManager
+from modules.description_store import DescriptionStore, normalize_path
+from modules.fake_llm import FakeChatModel
+from modules.schema_utils import index_by_path
+
+
+def field(name, field_type="STRING", description=""):
+    return {"name": name, "type": field_type, "mode": "", "description": description}
+
+
+SCHEMA = [
+    field("id"),
+    {"name": "meta", "type": "RECORD", "mode": "", "description": "", "fields": [
+        field("lastUpdated", "TIMESTAMP"),
+        field("source"),
+    ]},
+]
+
+
+def stored_fields(description):
+    return {"meta.last_updated": field("last_updated", "TIMESTAMP", description)}
+
+
+
+def test_paths_are_normalized():
+    assert normalize_path("meta.lastUpdated") == "meta.last_updated"
+    assert normalize_path("Identifier.System") == "identifier.system"
+
+
+
+def test_unknown_policy_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        DescriptionStore(str(tmp_path / "store.db"), reuse_policy="sometimes")
+
+
+
+def test_exact_policy_prefers_the_same_resource(tmp_path):
+    store = DescriptionStore(str(tmp_path / "store.db"))
+    store.save("patient", stored_fields("Last update of the patient."))
+    store.save("encounter", stored_fields("Last update of the encounter."))
+
+    lookup = {"meta.lastUpdated": field("lastUpdated", "TIMESTAMP")}
+    assert store.lookup("encounter", lookup)["meta.lastUpdated"]["description"] == "Last update of the encounter."
+    assert store.lookup("condition", lookup)["meta.lastUpdated"]["description"]
+
+    # The type is part of the key
+    assert store.lookup("encounter", {"meta.lastUpdated": field("lastUpdated", "STRING")}) == {}
+    assert store.stats() == {"hits": 2, "misses": 1, "hit_rate": 0.667}
+
+
+
+def test_resource_policy_only_reuses_the_same_resource(tmp_path):
+    store = DescriptionStore(str(tmp_path / "store.db"), reuse_policy="resource")
+    store.save("patient", stored_fields("Last update of the patient."))
+
+    lookup = {"meta.last_updated": field("last_updated", "TIMESTAMP")}
+    assert store.lookup("encounter", lookup) == {}
+    assert store.lookup("patient", lookup)["meta.last_updated"]["description"] == "Last update of the patient."
+
+
+
+def test_regenerate_policy_never_reuses(tmp_path):
+    store = DescriptionStore(str(tmp_path / "store.db"), reuse_policy="regenerate")
+    store.save("patient", stored_fields("Last update of the patient."))
+    assert store.lookup("patient", {"meta.last_updated": field("last_updated", "TIMESTAMP")}) == {}
+    assert store.misses == 1
+
+
+
+def test_fields_without_a_description_are_not_stored(tmp_path):
+    store = DescriptionStore(str(tmp_path / "store.db"))
+    store.save("patient", {"id": field("id")})
+    assert store.lookup("patient", {"id": field("id")}) == {}
+
+
+
+def test_manager_only_sends_the_fields_that_are_not_stored(tmp_path):
+    """Stored fields are merged into the schema, the others are generated and stored."""
+    store = DescriptionStore(str(tmp_path / "store.db"))
+    store.save("encounters", stored_fields("Stored last update."))
+
+    llm = FakeChatModel(model_name="fake-model")
+    fhir_mgr = FHIRResourceManager(llm, "test.synthetic.fhir_encounters", description_store=store)
+    enriched = index_by_path(fhir_mgr.generate_enriched_schema(SCHEMA))
+
+    assert enriched["meta.lastUpdated"]["description"] == "Stored last update."
+    assert all(enriched[path]["description"] for path in ("id", "meta", "meta.source"))
+
+    # A second run takes everything from the store
+    second_llm = FakeChatModel(model_name="fake-model")
+    second = FHIRResourceManager(second_llm, "test.synthetic.fhir_encounters", description_store=store)
+    assert index_by_path(second.generate_enriched_schema(SCHEMA))["id"]["description"] == enriched["id"]["description"]
+    assert second_llm.calls == 0
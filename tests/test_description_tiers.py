@@ -0,0 +1,96 @@
+import pytest
+
+from modules.FHIResourceManager import FHIRResourceManager
+from modules.description_tiers import DescriptionTiers, output_tokens_per_field, MIN_OUTPUT_TOKENS_PER_FIELD
+from modules.fake_llm import FakeChatModel
+from modules.schema_utils import index_by_path
+
+SCHEMA = [
+    {"name": "diagnosis", "type": "STRING", "mode": "", "description": ""},
+    {"name": "etl_timestamp", "type": "TIMESTAMP", "mode": "", "description": ""},
+    {"name": "meta", "type": "RECORD", "mode": "", "description": "", "fields": [
+        {"name": "source", "type": "STRING", "mode": "", "description": ""},
+        {"name": "etl_batch", "type": "STRING", "mode": "", "description": ""},
+    ]},
+]
+
+PATTERNS = [{"pattern": "etl_*", "tier": "short"}, {"pattern": "meta.*", "tier": "standard"}]
+
+
+class RecordingChatModel(FakeChatModel):
+    """A fake model that records the max_tokens of every request."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.max_tokens_sent = []
+
+    def invoke(self, input, config=None, **kwargs):
+        self.max_tokens_sent.append(kwargs.get("max_tokens"))
+        return super().invoke(input, config, **kwargs)
+
+
+
+def test_first_matching_pattern_picks_the_tier():
+    tiers = DescriptionTiers(patterns=PATTERNS)
+
+    assert tiers.tier_for("diagnosis") == "long"
+    assert tiers.tier_for("etl_timestamp") == "short"
+    assert tiers.tier_for("meta.etl_batch") == "short"
+    assert tiers.tier_for("meta.source") == "standard"
+    assert tiers.character_limit("standard") == 500
+
+
+
+def test_unknown_tiers_are_rejected():
+    with pytest.raises(ValueError):
+        DescriptionTiers(default_tier="brief")
+    with pytest.raises(ValueError):
+        DescriptionTiers(patterns=[{"pattern": "etl_*", "tier": "tiny"}])
+
+
+
+def test_schema_is_split_per_tier_with_containers():
+    """A RECORD is sent with the tier of its subfields as their container, and keeps its own description."""
+    tiers = DescriptionTiers(patterns=PATTERNS)
+    split = tiers.split_schema(SCHEMA)
+
+    assert [tier for tier, _ in split] == ["long", "standard", "short"]
+    assert set(index_by_path(split[0][1])) == {"diagnosis", "meta"}
+    assert set(index_by_path(split[1][1])) == {"meta", "meta.source"}
+    assert set(index_by_path(split[2][1])) == {"etl_timestamp", "meta", "meta.etl_batch"}
+
+    described = [(tier, [dict(field, description=f"{tier} {field['name']}",
+                              fields=[dict(subfield, description=f"{tier} {subfield['name']}")
+                                      for subfield in field.get("fields") or []])
+                         for field in schema]) for tier, schema in split]
+    merged = index_by_path(tiers.merge(SCHEMA, described))
+
+    assert merged["meta"]["description"] == "long meta"
+    assert merged["meta.etl_batch"]["description"] == "short etl_batch"
+    assert [field["name"] for field in tiers.merge(SCHEMA, described)] == [field["name"] for field in SCHEMA]
+
+
+
+def test_output_tokens_scale_with_the_character_limit():
+    assert output_tokens_per_field(300, 1024) == 300
+    assert output_tokens_per_field(300, 500) == 147
+    assert output_tokens_per_field(300, 10) == MIN_OUTPUT_TOKENS_PER_FIELD
+
+
+
+def test_chunks_are_limited_to_their_tier_output():
+    """Every chunk request carries a max_tokens that follows its tier, and descriptions respect the limit."""
+    llm = RecordingChatModel(model_name="fake-model", description_length=2000)
+    tiers = DescriptionTiers(default_tier="short", patterns=[{"pattern": "diagnosis", "tier": "long"}])
+
+    enriched = FHIRResourceManager(llm, "test.synthetic.fhir_encounters",
+                                   description_tiers=tiers).generate_enriched_schema(SCHEMA)
+
+    index = index_by_path(enriched)
+    assert len(index["diagnosis"]["description"]) > 200
+    assert all(len(index[path]["description"]) <= 200 for path in index if path != "diagnosis")
+
+    # One request per tier, the short tier has more fields but a lower limit per field
+    assert len(llm.max_tokens_sent) == 2
+    assert all(max_tokens for max_tokens in llm.max_tokens_sent)
+    assert llm.max_tokens_sent[0] > llm.max_tokens_sent[1]
@@ -0,0 +1,94 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from modules import concept_embeddings
+from modules.concept_embeddings import get_embedding_model, DEFAULT_BATCH_SIZE
+
+
+class FakeSentenceTransformer:
+    """A stand-in for SentenceTransformer, that records how it was loaded and called."""
+
+    def __init__(self, model_name, device=None, **kwargs):
+        self.model_name = model_name
+        self.kwargs = kwargs
+        self.batch_sizes = []
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True):
+        self.batch_sizes.append(batch_size)
+        return np.ones((len(texts), 4), dtype=np.float64)
+
+
+@pytest.fixture
+def fake_torch(monkeypatch):
+    """Replaces torch and sentence_transformers, and starts without loaded models."""
+    torch = types.SimpleNamespace(threads=8, calls=[])
+    torch.get_num_threads = lambda: torch.threads
+
+    def set_num_threads(threads):
+        torch.calls.append(threads)
+        torch.threads = threads
+
+    torch.set_num_threads = set_num_threads
+    monkeypatch.setitem(sys.modules, "torch", torch)
+    monkeypatch.setitem(sys.modules, "sentence_transformers",
+                        types.SimpleNamespace(SentenceTransformer=FakeSentenceTransformer))
+    monkeypatch.setattr(concept_embeddings, "_models", {})
+    monkeypatch.setattr(concept_embeddings, "_default_torch_threads", None)
+    return torch
+
+
+
+def test_models_are_loaded_once_per_settings(fake_torch):
+    model = get_embedding_model("all-MiniLM-L6-v2")
+
+    assert get_embedding_model("all-MiniLM-L6-v2") is model
+    assert get_embedding_model("all-MiniLM-L6-v2", batch_size=128) is not model
+    assert get_embedding_model("all-mpnet-base-v2") is not model
+    assert isinstance(model.model, FakeSentenceTransformer)
+
+
+
+def test_encode_returns_float32_in_batches(fake_torch):
+    model = get_embedding_model(batch_size=16)
+    embeddings = model.encode(["patient_id", "admission_date"])
+
+    assert embeddings.dtype == np.float32 and embeddings.shape == (2, 4)
+    assert model.model.batch_sizes == [16]
+    assert get_embedding_model().batch_size == DEFAULT_BATCH_SIZE
+
+
+
+def test_torch_threads_are_set_at_load_only(fake_torch):
+    """The thread count is process-wide: it is set when a model loads, never when it encodes."""
+    model = get_embedding_model(threads=2)
+    assert fake_torch.threads == 2
+
+    model.encode(["patient_id"])
+    model.encode(["admission_date"])
+    assert fake_torch.calls == [2]
+
+    # A model without a thread count restores the count torch started with
+    get_embedding_model(threads=None)
+    assert fake_torch.threads == 8
+
+
+
+def test_unknown_backend_is_rejected(fake_torch):
+    with pytest.raises(ValueError):
+        get_embedding_model(backend="tensorrt")
+
+
+
+def test_missing_packages_name_the_install(monkeypatch, fake_torch):
+    monkeypatch.setitem(sys.modules, "sentence_transformers", None)
+    with pytest.raises(ImportError, match="pip install sentence-transformers"):
+        get_embedding_model()
+
+    monkeypatch.setitem(sys.modules, "sentence_transformers",
+                        types.SimpleNamespace(SentenceTransformer=FakeSentenceTransformer))
+    monkeypatch.setitem(sys.modules, "onnxruntime", None)
+    with pytest.raises(ImportError, match=r"sentence-transformers\[onnx\]"):
+        get_embedding_model(backend="onnx")
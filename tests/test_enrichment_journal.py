@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+from modules.fake_llm import FakeChatModel
+from modules.FHIResourceManager import FHIRResourceManager
+from modules.enrichment_journal import EnrichmentJournal, fingerprint
+from modules.description_tiers import DescriptionTiers
+
+TABLE_NAME = "test.synthetic.fhir_encounters"
+
+CHUNK = [{"name": "status", "type": "STRING", "mode": "NULLABLE"}]
+ENRICHED = [{"name": "status", "type": "STRING", "mode": "NULLABLE", "description": "The encounter status."}]
+SETTINGS = {"model": "gpt-4o", "temperature": 0.0, "prompt": "abc", "wire_format": "compact",
+            "character_length": 1024}
+
+
+@pytest.fixture
+def schema():
+    with open("fhir files/encounters_table_schema.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+
+def test_fingerprint_ignores_key_order():
+    assert fingerprint({"a": 1, "b": [1, 2]}) == fingerprint({"b": [1, 2], "a": 1})
+    assert fingerprint({"a": 1}) != fingerprint({"a": 2})
+
+
+
+def test_resume_restores_recorded_chunks(tmp_path):
+    """A resumed journal serves the chunks of the earlier run, a new run starts empty."""
+    journal = EnrichmentJournal(TABLE_NAME, CHUNK, str(tmp_path))
+    journal.record(CHUNK, ENRICHED, SETTINGS)
+
+    resumed = EnrichmentJournal(TABLE_NAME, CHUNK, str(tmp_path), resume=True)
+    assert len(resumed) == 1
+    assert resumed.get(CHUNK, SETTINGS) == ENRICHED
+
+    restarted = EnrichmentJournal(TABLE_NAME, CHUNK, str(tmp_path))
+    assert len(restarted) == 0
+    assert list(tmp_path.iterdir()) == []
+
+
+
+def test_chunks_of_other_settings_are_not_reused(tmp_path):
+    """A chunk enriched with another model, prompt, wire format or tier is a miss."""
+    journal = EnrichmentJournal(TABLE_NAME, CHUNK, str(tmp_path))
+    journal.record(CHUNK, ENRICHED, SETTINGS)
+
+    assert journal.get(CHUNK, SETTINGS) == ENRICHED
+    for key, value in (("model", "gemini-1.5-pro"), ("prompt", "def"), ("wire_format", "json"),
+                       ("character_length", 256)):
+        assert journal.get(CHUNK, dict(SETTINGS, **{key: value})) is None
+
+
+
+def test_truncated_entry_is_skipped(tmp_path):
+    """A run killed halfway through a write leaves a truncated line, which is skipped on resume."""
+    journal = EnrichmentJournal(TABLE_NAME, CHUNK, str(tmp_path))
+    journal.record(CHUNK, ENRICHED, SETTINGS)
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"chunk_key": "0123", "fields": [{"na')
+
+    resumed = EnrichmentJournal(TABLE_NAME, CHUNK, str(tmp_path), resume=True)
+    assert len(resumed) == 1
+
+
+
+def test_clear_removes_the_journal(tmp_path):
+    journal = EnrichmentJournal(TABLE_NAME, CHUNK, str(tmp_path))
+    journal.record(CHUNK, ENRICHED, SETTINGS)
+    journal.clear()
+    assert len(journal) == 0
+    assert list(tmp_path.iterdir()) == []
+
+
+
+def test_resumed_enrichment_skips_journaled_chunks(schema, tmp_path):
+    """A resumed run with the same settings sends no chunk again, and gets the same schema."""
+    llm = FakeChatModel()
+    journal = EnrichmentJournal(TABLE_NAME, schema, str(tmp_path))
+    first = FHIRResourceManager(llm, TABLE_NAME).generate_enriched_schema(schema, journal=journal)
+    calls = llm.calls
+    assert len(journal) > 0
+
+    resumed = EnrichmentJournal(TABLE_NAME, schema, str(tmp_path), resume=True)
+    second = FHIRResourceManager(llm, TABLE_NAME).generate_enriched_schema(schema, journal=resumed)
+    assert llm.calls == calls
+    assert second == first
+
+
+
+@pytest.mark.parametrize("model_name, manager_kwargs", [
+    ("other-model", {}),
+    ("fake-model", {"wire_format": "json"}),
+    ("fake-model", {"description_tiers": DescriptionTiers(default_tier="short")}),
+])
+def test_resume_with_other_settings_enriches_again(schema, tmp_path, model_name, manager_kwargs):
+    """A resumed run with another model, wire format or tier does not replay the journaled descriptions."""
+    journal = EnrichmentJournal(TABLE_NAME, schema, str(tmp_path))
+    FHIRResourceManager(FakeChatModel(), TABLE_NAME).generate_enriched_schema(schema, journal=journal)
+
+    llm = FakeChatModel(model_name=model_name)
+    resumed = EnrichmentJournal(TABLE_NAME, schema, str(tmp_path), resume=True)
+    FHIRResourceManager(llm, TABLE_NAME, **manager_kwargs).generate_enriched_schema(schema, journal=resumed)
+
+    assert llm.calls > 0
@@ -0,0 +1,102 @@
+import json
+import argparse
+
+import pytest
+
+import benchmark_enrichment
+from modules.description_tiers import DEFAULT_TIER
+from modules.fake_llm import FakeChatModel, FakeLLMError, FakeRateLimitError
+
+
+def compact_prompt(index):
+    return f"Describe the fields.\nfield_{index}_a STRING NULLABLE\nfield_{index}_b INTEGER REPEATED"
+
+
+def outcome(llm, prompt):
+    try:
+        return llm.invoke(prompt).content
+    except FakeLLMError as e:
+        return type(e).__name__
+
+
+
+def test_same_seed_gives_the_same_responses():
+    prompts = [compact_prompt(index) for index in range(50)]
+    first = [outcome(FakeChatModel(drop_rate=0.3, failure_rate=0.2, seed=7), prompt) for prompt in prompts]
+    second = [outcome(FakeChatModel(drop_rate=0.3, failure_rate=0.2, seed=7), prompt) for prompt in prompts]
+    other_seed = [outcome(FakeChatModel(drop_rate=0.3, failure_rate=0.2, seed=8), prompt) for prompt in prompts]
+
+    assert first == second
+    assert first != other_seed
+
+
+
+def test_compact_prompts_are_answered_per_path():
+    response = json.loads(FakeChatModel(description_length=40).invoke(compact_prompt(1)).content)
+
+    assert set(response) == {"field_1_a", "field_1_b"}
+    assert response["field_1_a"]["description"].startswith("The field_1_a element")
+    assert len(response["field_1_a"]["description"]) <= 40
+    assert response["field_1_b"]["HIPAA"] is False
+
+
+
+@pytest.mark.parametrize("rate_name, error", [("failure_rate", FakeLLMError),
+                                              ("rate_limit_rate", FakeRateLimitError)])
+def test_failure_rates_are_respected(rate_name, error):
+    """About the given fraction of distinct prompts raise, every call is counted."""
+    llm = FakeChatModel(**{rate_name: 0.25})
+    failures = 0
+    for index in range(400):
+        try:
+            llm.invoke(compact_prompt(index))
+        except error:
+            failures += 1
+
+    assert llm.calls == 400
+    assert 60 <= failures <= 140
+
+
+
+def test_retried_prompts_can_succeed():
+    """The outcome depends on the attempt, so a retry of a failed prompt is not doomed."""
+    failing = [compact_prompt(index) for index in range(20)
+               if outcome(FakeChatModel(failure_rate=0.5), compact_prompt(index)) == "FakeLLMError"]
+    llm = FakeChatModel(failure_rate=0.5)
+    results = [outcome(llm, failing[0]) for _ in range(20)]
+
+    assert results[0] == "FakeLLMError"
+    assert any(result != "FakeLLMError" for result in results)
+
+
+
+def benchmark_args(**overrides):
+    return argparse.Namespace(**{
+        "seed": 0, "latency": 0.0, "tokens_per_second": 0.0, "failure_rate": 0.0, "malformed_rate": 0.0,
+        "drop_rate": 0.1, "description_length": 200, "concurrency": 2, "wire_format": "compact",
+        "dedupe_shapes": False,
+        "description_tier": DEFAULT_TIER, **overrides})
+
+
+
+def test_benchmark_metrics_are_deterministic():
+    first = benchmark_enrichment.run_case(200, 3, benchmark_args())
+    second = benchmark_enrichment.run_case(200, 3, benchmark_args())
+
+    assert first["status"] == "ok"
+    for metric in benchmark_enrichment.DETERMINISTIC_METRICS:
+        assert first[metric] == second[metric]
+    assert benchmark_enrichment.compare_with_baselines([second], {first["case"]: first}, 0.0) == []
+
+
+
+def test_benchmark_gates_on_calls_and_tokens():
+    result = benchmark_enrichment.run_case(100, 1, benchmark_args())
+    baseline = dict(result, llm_calls=result["llm_calls"] - 1, fields_per_second=result["fields_per_second"] * 100)
+
+    regressions = benchmark_enrichment.compare_with_baselines([result], {result["case"]: baseline}, 0.0)
+    assert regressions == [f"100x1: {result['llm_calls']} llm_calls, baseline {baseline['llm_calls']}"]
+
+    # A baseline measured with another tokenizer is not comparable
+    other_tokenizer = dict(baseline, tokenizer="other")
+    assert benchmark_enrichment.compare_with_baselines([result], {result["case"]: other_tokenizer}, 0.0) == []
@@ -0,0 +1,117 @@
+import copy
+
+from modules.fake_llm import FakeChatModel
+from modules.FHIResourceManager import FHIRResourceManager
+from modules.schema_utils import diff_schemas, prune_schema, merge_descriptions, index_by_path
+
+
+def field(name, field_type="STRING", mode="NULLABLE", description=None, fields=None):
+    result = {"name": name, "type": field_type, "mode": mode}
+    if description is not None:
+        result["description"] = description
+    if fields is not None:
+        result["fields"] = fields
+    return result
+
+
+PREVIOUS_SCHEMA = [
+    field("id", description="Previous id."),
+    field("status", description="Previous status."),
+    field("period", "RECORD", description="Previous period.", fields=[
+        field("start", "TIMESTAMP", description="Previous start."),
+        field("end", "TIMESTAMP", description="Previous end."),
+    ]),
+    field("note", description=""),
+    field("removed", description="Previous removed."),
+]
+
+NEW_SCHEMA = [
+    field("id"),
+    field("status", mode="REQUIRED"),
+    field("period", "RECORD", fields=[
+        field("start", "TIMESTAMP"),
+        field("end", "TIMESTAMP"),
+        field("duration", "INTEGER"),
+    ]),
+    field("note"),
+]
+
+
+class RecordingChatModel(FakeChatModel):
+    """A fake chat model that keeps the prompts it was sent."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.prompts = []
+
+    def invoke(self, input, **kwargs):
+        self.prompts.append(input if isinstance(input, str) else "\n".join(str(m.content) for m in input))
+        return super().invoke(input, **kwargs)
+
+
+
+def test_diff_schemas():
+    """Fields are added, changed (another type or mode, or no description before) or unchanged."""
+    diff = diff_schemas(PREVIOUS_SCHEMA, NEW_SCHEMA)
+    assert diff == {
+        "added": {"period.duration"},
+        "changed": {"status", "note"},
+        "unchanged": {"id", "period", "period.start", "period.end"},
+    }
+
+
+
+def test_prune_schema_keeps_the_parent_records():
+    assert prune_schema(NEW_SCHEMA, {"period.duration", "note"}) == [
+        field("period", "RECORD", fields=[field("duration", "INTEGER")]),
+        field("note"),
+    ]
+
+
+
+def test_merge_descriptions_prefers_the_first_source():
+    """The structure is that of the new schema, the attributes come from the first source with a description."""
+    first = {"status": field("status", description="First status.")}
+    merged = merge_descriptions(NEW_SCHEMA, [first, index_by_path(PREVIOUS_SCHEMA)])
+
+    assert [f["name"] for f in merged] == ["id", "status", "period", "note"]
+    assert merged[1] == field("status", mode="REQUIRED", description="First status.")
+    assert merged[0]["description"] == "Previous id."
+    assert "description" not in merged[3]
+    assert "description" not in index_by_path(merged)["period.duration"]
+
+
+
+def test_incremental_enrichment_only_sends_the_delta():
+    """Only the added and changed fields are sent, the others keep their previous descriptions."""
+    llm = RecordingChatModel()
+    fhir_mgr = FHIRResourceManager(llm, "test.synthetic.fhir_encounters", dedupe_shapes=False)
+
+    enriched_schema = fhir_mgr.generate_incremental_enriched_schema(copy.deepcopy(NEW_SCHEMA), PREVIOUS_SCHEMA)
+    enriched_index = index_by_path(enriched_schema)
+
+    assert set(enriched_index) == set(index_by_path(NEW_SCHEMA))
+    assert [enriched_index[path]["description"] for path in ("id", "period", "period.start", "period.end")] == \
+           ["Previous id.", "Previous period.", "Previous start.", "Previous end."]
+    for path in ("status", "note", "period.duration"):
+        assert enriched_index[path]["description"].startswith(f"The {path} element")
+    assert enriched_index["status"]["mode"] == "REQUIRED"
+
+    sent = "\n".join(llm.prompts)
+    assert "period.duration INTEGER NULLABLE" in sent
+    assert "status STRING REQUIRED" in sent
+    assert "period.start TIMESTAMP" not in sent
+    assert "\nid STRING" not in sent
+
+
+
+def test_incremental_enrichment_falls_back_to_the_previous_description():
+    """A changed field the LLM does not describe keeps its previous description."""
+    llm = FakeChatModel(drop_rate=1.0)
+    fhir_mgr = FHIRResourceManager(llm, "test.synthetic.fhir_encounters", max_retries=0, dedupe_shapes=False)
+
+    enriched_schema = fhir_mgr.generate_incremental_enriched_schema(copy.deepcopy(NEW_SCHEMA), PREVIOUS_SCHEMA)
+    enriched_index = index_by_path(enriched_schema)
+
+    assert enriched_index["status"]["description"] == "Previous status."
+    assert fhir_mgr.unresolved_paths == {"note", "period.duration"}
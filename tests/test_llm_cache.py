@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from modules import llm_cache
+from modules.llm_cache import LLMResponseCache, describe_llm
+from modules.fake_llm import FakeChatModel
+from modules.FHIResourceManager import FHIRResourceManager
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable clock for the created and last accessed times of the cache entries."""
+    now = [1_000_000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    return now
+
+
+
+def test_cache_hit_and_miss(tmp_path):
+    """A response is served for the same model, temperature and prompt only."""
+    cache = LLMResponseCache(db_path=str(tmp_path / "cache.db"))
+    cache.put("gpt-4o", 0.0, "Describe the encounter table.", "An encounter.")
+
+    assert cache.get("gpt-4o", 0.0, "Describe the encounter table.") == "An encounter."
+    assert cache.get("gpt-4o", 0.0, "Describe the patient table.") is None
+    assert cache.get("gpt-4o-mini", 0.0, "Describe the encounter table.") is None
+    assert cache.get("gpt-4o", 0.7, "Describe the encounter table.") is None
+    assert cache.stats() == {"hits": 1, "misses": 3, "evictions": 0, "hit_rate": 0.25}
+
+
+
+def test_cache_persists_across_instances(tmp_path):
+    """A new process (a new cache on the same database) is served the earlier responses."""
+    LLMResponseCache(db_path=str(tmp_path / "cache.db")).put("gpt-4o", 0.0, "prompt", "response")
+    assert LLMResponseCache(db_path=str(tmp_path / "cache.db")).get("gpt-4o", 0.0, "prompt") == "response"
+
+
+
+def test_expired_entries_are_misses(tmp_path, clock):
+    """An entry older than max_age_days counts as a miss and is removed."""
+    cache = LLMResponseCache(db_path=str(tmp_path / "cache.db"), max_age_days=1)
+    cache.put("gpt-4o", 0.0, "prompt", "response")
+
+    clock[0] += 23 * 60 * 60
+    assert cache.get("gpt-4o", 0.0, "prompt") == "response"
+
+    clock[0] += 2 * 60 * 60
+    assert cache.get("gpt-4o", 0.0, "prompt") is None
+    assert cache.evictions == 1
+
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    """Beyond max_entries, the entries that were used the longest ago are evicted."""
+    cache = LLMResponseCache(db_path=str(tmp_path / "cache.db"), max_entries=2)
+    cache.put("gpt-4o", 0.0, "first", "1")
+    clock[0] += 1
+    cache.put("gpt-4o", 0.0, "second", "2")
+    clock[0] += 1
+    assert cache.get("gpt-4o", 0.0, "first") == "1"
+    clock[0] += 1
+    cache.put("gpt-4o", 0.0, "third", "3")
+
+    assert cache.get("gpt-4o", 0.0, "second") is None
+    assert cache.get("gpt-4o", 0.0, "first") == "1"
+    assert cache.get("gpt-4o", 0.0, "third") == "3"
+    assert cache.evictions == 1
+
+
+
+def test_describe_llm():
+    """The model name is read from model_name or model, the temperature defaults to 0."""
+    class GeminiLike:
+        model = "gemini-1.5-pro"
+        temperature = None
+
+    assert describe_llm(FakeChatModel(model_name="fake-model")) == ("fake-model", 0.0)
+    assert describe_llm(GeminiLike()) == ("gemini-1.5-pro", 0.0)
+
+
+
+def test_enrichment_is_served_from_the_cache(tmp_path):
+    """A second enrichment of the same schema does not call the LLM."""
+    with open("fhir files/encounters_table_schema.json", "r", encoding="utf-8") as f:
+        schema = json.load(f)
+    cache = LLMResponseCache(db_path=str(tmp_path / "cache.db"))
+
+    llm = FakeChatModel()
+    first = FHIRResourceManager(llm, "test.synthetic.fhir_encounters", cache=cache).generate_enriched_schema(schema)
+    calls = llm.calls
+    assert calls > 0
+
+    second = FHIRResourceManager(llm, "test.synthetic.fhir_encounters", cache=cache).generate_enriched_schema(schema)
+    assert llm.calls == calls
+    assert second == first
+    assert cache.hits == calls
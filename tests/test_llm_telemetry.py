@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from modules import FHIResourceManager as manager_module
+from modules.FHIResourceManager import FHIRResourceManager
+from modules.fake_llm import FakeChatModel
+from modules.llm_telemetry import LLMTelemetry
+
+
+@pytest.fixture
+def telemetry(monkeypatch):
+    """A fresh telemetry instead of the one shared by the process."""
+    telemetry = LLMTelemetry()
+    monkeypatch.setattr(manager_module, "get_telemetry", lambda: telemetry)
+    return telemetry
+
+
+
+def test_summary_aggregates_per_model():
+    telemetry = LLMTelemetry()
+    for latency in (1.0, 2.0, 3.0, 4.0):
+        telemetry.record_request("model-a", 100, 10, latency_seconds=latency, label=f"chunk {latency}",
+                                 cached_prompt_tokens=40)
+    telemetry.record_request("model-b", 50, 5, latency_seconds=None, source="batch")
+    telemetry.record_cache_hit("model-a")
+    telemetry.record_retry("model-a", "rate_limit")
+    telemetry.record_retry("model-a", "rate_limit")
+    telemetry.record_parse_failure("model-c")
+
+    summary = telemetry.summary()
+    model_a = summary["models"]["model-a"]
+
+    assert model_a["requests"] == 4
+    assert model_a["prompt_tokens"] == 400
+    assert model_a["cached_prompt_tokens"] == 160
+    assert model_a["uncached_prompt_tokens"] == 240
+    assert model_a["completion_tokens"] == 40
+    assert model_a["latency_p50_seconds"] == 3.0
+    assert model_a["latency_max_seconds"] == 4.0
+    assert model_a["latency_total_seconds"] == 10.0
+    assert model_a["cache_hits"] == 1
+    assert model_a["retries_rate_limit"] == 2
+
+    # Batch requests have no latency, models with only counters are listed as well
+    assert summary["models"]["model-b"]["latency_p95_seconds"] == 0.0
+    assert summary["models"]["model-c"]["requests"] == 0
+    assert summary["models"]["model-c"]["parse_failures"] == 1
+    assert [request["latency_seconds"] for request in summary["slowest_requests"]] == [4.0, 3.0, 2.0, 1.0]
+
+
+
+def test_write_summary_creates_the_directory(tmp_path):
+    telemetry = LLMTelemetry()
+    telemetry.record_request("model-a", 10, 1, latency_seconds=0.5)
+
+    path = telemetry.write_summary(str(tmp_path / "telemetry" / "run.json"))
+
+    with open(path) as f:
+        assert json.load(f)["models"]["model-a"]["requests"] == 1
+
+
+
+def test_enrichment_requests_are_recorded(telemetry):
+    """Every chunk request and every missing-fields retry of the manager ends up in the telemetry."""
+    with open("fhir files/encounters_table_schema.json") as f:
+        schema = json.load(f)
+
+    llm = FakeChatModel(model_name="fake-model", drop_rate=0.2)
+    fhir_mgr = FHIRResourceManager(llm, "test.synthetic.fhir_encounters", retry_base_delay=0)
+    fhir_mgr.generate_enriched_schema(schema)
+
+    stats = telemetry.summary()["models"]["fake-model"]
+    assert stats["requests"] == llm.calls
+    assert stats["prompt_tokens"] == fhir_mgr.input_tokens
+    assert stats["completion_tokens"] == fhir_mgr.output_tokens
+    assert stats["retries_missing_fields"] > 0
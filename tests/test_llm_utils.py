@@ -0,0 +1,69 @@
+import sys
+import json
+import subprocess
+
+import pytest
+from langchain_core.runnables import Runnable
+
+from modules import llm_utils
+from modules.fake_llm import FakeChatModel
+from modules.llm_cache import LLMResponseCache
+
+
+class RunnableFakeChatModel(FakeChatModel, Runnable):
+    """The fake model as a Runnable, so it can be used in prompt | llm chains."""
+
+
+@pytest.fixture
+def created_clients(monkeypatch):
+    """Replaces the provider clients with fake models, and records every client that is created."""
+    created = []
+
+    def create_client(model_name, temperature, max_tokens, max_retries=None):
+        created.append((model_name, temperature, max_tokens, max_retries))
+        return RunnableFakeChatModel(model_name=model_name)
+
+    monkeypatch.setattr(llm_utils, "_create_client", create_client)
+    monkeypatch.setattr(llm_utils, "_clients", {})
+    monkeypatch.setattr(llm_utils, "_chains", None)
+    return created
+
+
+
+def test_importing_does_not_load_a_provider():
+    """Without an API key, importing the module neither fails nor loads a provider package."""
+    code = ("import sys, json; import modules.llm_utils; "
+            "print(json.dumps([name for name in ('langchain_openai', 'langchain_google_genai') if name in sys.modules]))")
+    env = {"PATH": "", "PYTHONPATH": "."}
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True)
+    assert json.loads(result.stdout.strip().splitlines()[-1]) == []
+
+
+
+def test_clients_are_cached_per_model_and_parameters(created_clients):
+    first = llm_utils.get_llm("gpt-4o", max_tokens=100)
+
+    assert llm_utils.get_llm("gpt-4o", max_tokens=100) is first
+    assert llm_utils.get_llm("gpt-4o", max_tokens=200) is not first
+    assert llm_utils.get_llm("gemini-1.5-flash") is not first
+    assert created_clients == [("gpt-4o", 0.0, 100, None), ("gpt-4o", 0.0, 200, None),
+                               ("gemini-1.5-flash", 0.0, None, None)]
+
+
+
+def test_chains_are_built_on_first_use(created_clients, tmp_path):
+    assert created_clients == []
+
+    cache = LLMResponseCache(str(tmp_path / "cache.db"))
+    first = llm_utils.generate_table_description("fhir_encounters", cache=cache)
+    second = llm_utils.generate_table_description("fhir_encounters", cache=cache)
+
+    assert first == second
+    assert created_clients == [(llm_utils.DEFAULT_MODEL, 0.0, llm_utils.DEFAULT_MAX_TOKENS, None)]
+    assert llm_utils._get_chains()[0].calls == 1
+
+
+
+def test_max_tokens_per_provider():
+    assert llm_utils.max_tokens_kwargs("gpt-4o", 512) == {"max_tokens": 512}
+    assert llm_utils.max_tokens_kwargs("gemini-1.5-pro", 512) == {"generation_config": {"max_output_tokens": 512}}
@@ -0,0 +1,78 @@
+import json
+
+from modules.FHIResourceManager import FHIRResourceManager
+from modules.fake_llm import FakeChatModel
+from modules.model_cascade import CascadeTier, validate_enriched_field
+from modules.schema_utils import count_fields, index_by_path
+
+
+def load_schema():
+    with open("fhir files/encounters_table_schema.json") as f:
+        return json.load(f)
+
+
+def enriched_field(description, **flags):
+    return {"name": "status", "type": "STRING", "description": description,
+            **{"PHI/PII": False, "HIPAA": False, **flags}}
+
+
+
+def test_validation_problems():
+    assert validate_enriched_field(None, 100) == ["missing"]
+    assert validate_enriched_field(enriched_field("The current status of the encounter."), 100) == []
+    assert validate_enriched_field(enriched_field(""), 100) == ["no description"]
+    assert validate_enriched_field(enriched_field("status"), 100) == ["generic description"]
+    assert validate_enriched_field(enriched_field("This field contains the value."), 100) == ["generic description"]
+    assert validate_enriched_field(enriched_field("The current status of the encounter."), 20) == \
+        ["description longer than 20 characters"]
+    assert validate_enriched_field(enriched_field("The current status of the encounter.", HIPAA="no"), 100) == \
+        ["'HIPAA' is not a boolean"]
+
+
+
+def test_only_failed_fields_are_escalated():
+    """The cheap tier drops fields, only those are sent to the capable tier."""
+    schema = load_schema()
+    cheap = CascadeTier("cheap-model", FakeChatModel(model_name="cheap-model", drop_rate=0.3),
+                        input_cost_per_million=1.0, output_cost_per_million=2.0)
+    capable = CascadeTier("capable-model", FakeChatModel(model_name="capable-model"))
+
+    fhir_mgr = FHIRResourceManager(cheap.llm, "test.synthetic.fhir_encounters", max_retries=0,
+                                   cascade_tiers=[cheap, capable])
+    enriched = fhir_mgr.generate_enriched_schema(schema)
+
+    assert all(field.get("description") for field in index_by_path(enriched).values())
+    assert cheap.fields_sent == count_fields(schema)
+    assert 0 < cheap.fields_escalated < cheap.fields_sent
+    assert capable.fields_sent == cheap.fields_escalated
+    assert capable.fields_accepted == capable.fields_sent
+    assert capable.fields_escalated == 0
+    assert cheap.cost > 0
+
+
+
+def test_no_escalation_when_the_first_tier_passes():
+    cheap = CascadeTier("cheap-model", FakeChatModel(model_name="cheap-model"))
+    capable = CascadeTier("capable-model", FakeChatModel(model_name="capable-model"))
+
+    FHIRResourceManager(cheap.llm, "test.synthetic.fhir_encounters",
+                        cascade_tiers=[cheap, capable]).generate_enriched_schema(load_schema())
+
+    assert cheap.fields_escalated == 0
+    assert capable.llm.calls == 0
+
+
+
+def test_fields_failing_every_tier_keep_the_last_description():
+    """Descriptions that are too short fail validation everywhere, but are not thrown away."""
+    schema = load_schema()[:3]
+    tiers = [CascadeTier(f"short-model-{level}", FakeChatModel(model_name=f"short-model-{level}",
+                                                                 description_length=12))
+             for level in range(2)]
+
+    fhir_mgr = FHIRResourceManager(tiers[0].llm, "test.synthetic.fhir_encounters", cascade_tiers=tiers)
+    enriched = fhir_mgr.generate_enriched_schema(schema)
+
+    assert tiers[1].fields_sent == count_fields(schema)
+    assert tiers[1].fields_accepted == 0
+    assert all(field["description"] for field in index_by_path(enriched).values())
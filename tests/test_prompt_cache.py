@@ -0,0 +1,174 @@
+import json
+
+import httpx
+from langchain_core.messages import HumanMessage
+from langchain_core.prompts import PromptTemplate
+
+from modules.FHIResourceManager import FHIRResourceManager, read_prompt_template, prompt_names
+from modules.fake_llm import FakeChatModel
+from modules.prompt_cache import (ContextCache, cached_prompt_tokens, min_cache_tokens, static_prompt_prefix,
+                                  DEFAULT_MIN_CACHE_TOKENS)
+from modules.schema_chunker import count_tokens
+
+
+def enrichment_template():
+    return PromptTemplate(input_variables=["input_json_schema", "fhir_resource"],
+                          template=read_prompt_template(prompt_names.GENERATE_RESOURCE_SCHEMA_DESCRIPTIONS_COMPACT,
+                                                        "prompts"),
+                          partial_variables={"character_length": 1024})
+
+
+class RecordingChatModel(FakeChatModel):
+    """A fake model that records the keyword arguments of every request."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.invoke_kwargs = []
+
+    def invoke(self, input, config=None, **kwargs):
+        self.invoke_kwargs.append(kwargs)
+        return super().invoke(input, config, **kwargs)
+
+
+class GeminiCacheModel(FakeChatModel):
+    """A fake Gemini model that creates explicit cached contents."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.cached_contents = []
+
+    def create_cached_content(self, messages, ttl=None):
+        self.cached_contents.append((messages[0].content, ttl))
+        return f"cachedContents/{len(self.cached_contents)}"
+
+
+
+def test_per_chunk_content_comes_after_the_static_prefix():
+    """Every chunk prompt of every resource starts with the same static prefix."""
+    template = enrichment_template()
+    prefix = static_prompt_prefix(template, {})
+
+    first = template.format(fhir_resource="TestResource", input_json_schema="id STRING NULLABLE")
+    second = template.format(fhir_resource="Patient", input_json_schema="name RECORD REPEATED")
+
+    assert first.startswith(prefix) and second.startswith(prefix)
+    assert "TestResource" not in prefix and "id STRING" not in prefix
+    assert len(prefix) > len(first) - len(prefix)
+
+
+
+def test_openai_requests_get_a_prompt_cache_key_in_the_body():
+    llm = FakeChatModel(model_name="gpt-4o")
+    cache = ContextCache()
+    cache.register(llm, "Static instructions. ")
+
+    prompt, invoke_kwargs = cache.prepare(llm, "Static instructions. Fields of the chunk.")
+    assert prompt == "Static instructions. Fields of the chunk."
+    assert list(invoke_kwargs) == ["extra_body"]
+    assert len(invoke_kwargs["extra_body"]["prompt_cache_key"]) == 32
+
+    # The kwargs are a copy, and prompts with another prefix or model get none
+    invoke_kwargs["extra_body"]["max_tokens"] = 10
+    assert cache.prepare(llm, "Static instructions. Other fields.")[1] == \
+        {"extra_body": {"prompt_cache_key": invoke_kwargs["extra_body"]["prompt_cache_key"]}}
+    assert cache.prepare(llm, "Other instructions.") == ("Other instructions.", {})
+    assert cache.prepare(FakeChatModel(model_name="gpt-4o-mini"), "Static instructions. x") == \
+        ("Static instructions. x", {})
+
+
+
+def test_gemini_prefixes_are_cached_above_the_model_minimum():
+    prefix = "Static instructions of the enrichment prompt. " * 100
+    assert 1024 <= count_tokens(prefix, "gemini-2.5-flash") < 32768
+
+    flash = GeminiCacheModel(model_name="gemini-2.5-flash")
+    cache = ContextCache(ttl_seconds=600)
+    cache.register(flash, prefix)
+    cache.register(flash, prefix)
+
+    assert flash.cached_contents == [(prefix, 600)]
+    assert cache.prepare(flash, prefix + "Fields.") == ("Fields.", {"cached_content": "cachedContents/1"})
+
+    # The same prefix is below the gemini-1.5 minimum, those requests send the full prompt
+    pro = GeminiCacheModel(model_name="gemini-1.5-pro")
+    cache.register(pro, prefix)
+    assert pro.cached_contents == []
+    assert cache.prepare(pro, prefix + "Fields.") == (prefix + "Fields.", {})
+
+
+
+def test_configured_minimum_only_raises_the_model_minimum():
+    prefix = "Static instructions of the enrichment prompt. " * 100
+    flash = GeminiCacheModel(model_name="gemini-2.5-flash")
+
+    ContextCache(min_prefix_tokens=100000).register(flash, prefix)
+    assert flash.cached_contents == []
+
+    flash_1_5 = GeminiCacheModel(model_name="gemini-1.5-flash")
+    ContextCache(min_prefix_tokens=10).register(flash_1_5, prefix)
+    assert flash_1_5.cached_contents == []
+
+    assert min_cache_tokens("gemini-1.5-flash-002") == 32768
+    assert min_cache_tokens("gemini-2.5-pro") == 4096
+    assert min_cache_tokens("unknown-model") == DEFAULT_MIN_CACHE_TOKENS
+
+
+
+def test_cached_prompt_tokens_from_usage_metadata():
+    assert cached_prompt_tokens({"input_tokens": 2000, "input_token_details": {"cache_read": 1536}}) == 1536
+    assert cached_prompt_tokens({"input_tokens": 2000}) == 0
+    assert cached_prompt_tokens(None) == 0
+
+
+
+def test_manager_requests_carry_the_cache_key_and_report_cached_tokens():
+    with open("fhir files/encounters_table_schema.json") as f:
+        schema = json.load(f)
+
+    llm = RecordingChatModel(model_name="gpt-4o", prompt_cache_min_tokens=256)
+    fhir_mgr = FHIRResourceManager(llm, "test.synthetic.fhir_encounters", context_cache=ContextCache())
+    fhir_mgr.generate_enriched_schema(schema)
+
+    keys = {kwargs["extra_body"]["prompt_cache_key"] for kwargs in llm.invoke_kwargs}
+    assert len(keys) == 1
+    assert "prompt_cache_key" not in llm.invoke_kwargs[0]
+    assert 0 < fhir_mgr.cached_input_tokens < fhir_mgr.input_tokens
+
+
+
+def test_chat_openai_sends_the_key_in_the_request_body():
+    """The kwargs go through ChatOpenAI and the openai client as they would in production."""
+    from langchain_openai.chat_models import ChatOpenAI
+
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, json={
+            "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "ok"}}],
+            "usage": {"prompt_tokens": 2000, "completion_tokens": 1, "total_tokens": 2001,
+                      "prompt_tokens_details": {"cached_tokens": 1024}},
+        })
+
+    llm = ChatOpenAI(model="gpt-4o", api_key="test", max_retries=0,
+                     http_client=httpx.Client(transport=httpx.MockTransport(handler)))
+    client_kwargs = []
+    create = llm.client.create
+
+    class RecordingCompletions:
+        def create(self, **kwargs):
+            client_kwargs.append(kwargs)
+            return create(**kwargs)
+
+    llm.client = RecordingCompletions()
+
+    cache = ContextCache()
+    cache.register(llm, "Static instructions. ")
+    prompt, invoke_kwargs = cache.prepare(llm, "Static instructions. Fields.")
+    response = llm.invoke([HumanMessage(content=prompt)], **invoke_kwargs)
+
+    # The openai client only receives extra_body, not an argument it may not know
+    assert "prompt_cache_key" not in client_kwargs[0]
+    assert requests[0]["prompt_cache_key"] == invoke_kwargs["extra_body"]["prompt_cache_key"]
+    assert cached_prompt_tokens(response.usage_metadata) == 1024
@@ -0,0 +1,206 @@
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import Runnable
+
+from modules import rate_limiter as rate_limiter_module
+from modules import llm_utils
+from modules.fake_llm import FakeChatModel, FakeLLMError, FakeRateLimitError
+from modules.schema_chunker import count_tokens
+from modules.rate_limiter import (TokenBucket, RateLimiter, RateLimitedLLM, get_rate_limiter,
+                                  is_rate_limit_error, is_transient_error, retry_after_seconds)
+
+
+class FakeClock:
+    """A monotonic clock that only moves when the code under test sleeps, at least a microsecond."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += max(seconds, 1e-6)
+
+    @property
+    def elapsed(self):
+        return self.now - 1000.0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter_module.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(rate_limiter_module.time, "sleep", clock.sleep)
+    return clock
+
+
+
+class ScriptedChatModel:
+    """A chat model that raises the scripted errors first, then answers with the scripted usage."""
+
+    model_name = "scripted-model"
+    max_tokens = 100
+
+    def __init__(self, errors=(), total_tokens=None):
+        self.errors = list(errors)
+        self.total_tokens = total_tokens
+        self.calls = 0
+
+    def invoke(self, input, config=None, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        usage = {"input_tokens": 0, "output_tokens": self.total_tokens, "total_tokens": self.total_tokens} \
+            if self.total_tokens else None
+        return AIMessage(content="ok", usage_metadata=usage)
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+
+def test_bucket_paces_beyond_its_capacity(clock):
+    """A full bucket serves a burst, after which requests wait for the refill."""
+    bucket = TokenBucket(capacity=10, refill_rate=10)
+
+    bucket.acquire(10)
+    assert clock.sleeps == []
+
+    bucket.acquire(5)
+    assert clock.elapsed == pytest.approx(0.5)
+
+
+
+def test_rate_limiter_paces_requests_per_minute(clock):
+    """With 60 requests per minute, the requests beyond the first minute's burst are one second apart."""
+    limiter = RateLimiter(requests_per_minute=60)
+    for _ in range(63):
+        limiter.acquire(0)
+    assert clock.elapsed == pytest.approx(3.0)
+
+
+
+def test_settle_refunds_and_charges_the_actual_usage(clock):
+    """Unused reserved tokens are returned, usage beyond the reservation is charged."""
+    limiter = RateLimiter(tokens_per_minute=600)
+
+    limiter.acquire(600)
+    limiter.settle(600, 300)
+    limiter.acquire(300)
+    assert clock.sleeps == []
+
+    limiter.settle(300, 600)
+    limiter.acquire(60)
+    assert clock.elapsed == pytest.approx(36.0)
+
+
+
+def test_block_pauses_every_request(clock):
+    limiter = RateLimiter(requests_per_minute=600)
+    limiter.block(2.5)
+    limiter.acquire(0)
+    assert clock.elapsed >= 2.5
+
+
+
+def test_error_classification():
+    assert is_rate_limit_error(FakeRateLimitError("429 rate limit exceeded"))
+    assert retry_after_seconds(FakeRateLimitError("429")) == 0.05
+    assert is_transient_error(ServerError("unavailable"))
+    assert not is_rate_limit_error(ServerError("unavailable"))
+    assert not is_transient_error(FakeLLMError("bad request"))
+    assert retry_after_seconds(ValueError("no response")) is None
+
+
+
+def test_rate_limited_requests_wait_for_retry_after(clock):
+    """A 429 blocks the shared limiter for the Retry-After delay, then the request is retried."""
+    llm = ScriptedChatModel(errors=[FakeRateLimitError("429"), FakeRateLimitError("429")])
+    limiter = RateLimiter(requests_per_minute=600)
+    limited = RateLimitedLLM(llm, limiter)
+
+    assert limited.invoke("Describe the encounter table.").content == "ok"
+    assert llm.calls == 3
+    assert clock.sleeps[0] == pytest.approx(0.05)
+
+    # The pause emptied the bucket, after a pause a request waits until the bucket
+    # refilled one request, 0.1s at 10 requests per second
+    assert clock.elapsed == pytest.approx(2 * 0.1, abs=1e-3)
+
+
+
+def test_transient_errors_are_retried_and_others_raised(clock):
+    llm = ScriptedChatModel(errors=[ServerError("unavailable")])
+    assert RateLimitedLLM(llm, RateLimiter(requests_per_minute=600)).invoke("prompt").content == "ok"
+    assert llm.calls == 2
+
+    llm = ScriptedChatModel(errors=[FakeLLMError("bad request")])
+    with pytest.raises(FakeLLMError):
+        RateLimitedLLM(llm, RateLimiter(requests_per_minute=600)).invoke("prompt")
+    assert llm.calls == 1
+
+
+
+def test_retries_are_bounded(clock):
+    llm = ScriptedChatModel(errors=[FakeRateLimitError("429")] * 3)
+    with pytest.raises(FakeRateLimitError):
+        RateLimitedLLM(llm, RateLimiter(requests_per_minute=600), max_retries=2).invoke("prompt")
+    assert llm.calls == 3
+
+
+
+def test_usage_beyond_the_estimate_is_charged(clock):
+    """A response that used more tokens than reserved slows down the next requests."""
+    limited = RateLimitedLLM(ScriptedChatModel(total_tokens=600), RateLimiter(tokens_per_minute=600))
+    reserved = count_tokens("prompt", "scripted-model") + ScriptedChatModel.max_tokens
+
+    limited.invoke("prompt")
+    assert clock.sleeps == []
+
+    # The first request used the whole minute, the second one waits for its reservation
+    limited.invoke("prompt")
+    assert clock.elapsed == pytest.approx(reserved / 10.0, abs=1e-3)
+
+
+
+def test_wrapper_is_a_runnable_in_a_chain(clock):
+    """prompt | llm chains go through the limiter, and the model attributes are passed through."""
+    llm = FakeChatModel(model_name="fake-model")
+    limiter = RateLimiter(requests_per_minute=1)
+    limited = RateLimitedLLM(llm, limiter)
+    chain = PromptTemplate.from_template("Describe the {table_name} table.") | limited
+
+    assert isinstance(limited, Runnable)
+    assert limited.model_name == "fake-model"
+    assert chain.invoke({"table_name": "encounter"}).content
+    assert chain.invoke({"table_name": "patient"}).content
+    assert llm.calls == 2
+    assert clock.elapsed == pytest.approx(60.0)
+
+
+
+def test_get_rate_limiter_is_shared_per_model():
+    first = get_rate_limiter("test-shared-model", requests_per_minute=10)
+    assert get_rate_limiter("test-shared-model", requests_per_minute=10) is first
+    assert get_rate_limiter("test-shared-model", requests_per_minute=20) is first
+    assert get_rate_limiter("test-other-model", requests_per_minute=10) is not first
+
+
+
+def test_wrapped_clients_do_not_retry_on_their_own(monkeypatch):
+    """The client inside a RateLimitedLLM has its retries disabled, the limiter retries instead."""
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(llm_utils, "_clients", {})
+
+    unlimited = llm_utils.get_llm("gpt-4o")
+    limited = llm_utils.get_llm("gpt-4o", requests_per_minute=500)
+
+    assert isinstance(limited, RateLimitedLLM)
+    assert limited.wrapped_llm.root_client.max_retries == 0
+    assert unlimited.root_client.max_retries > 0
+    assert llm_utils.get_llm("gpt-4o", requests_per_minute=500) is limited
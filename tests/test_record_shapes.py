@@ -0,0 +1,88 @@
+from modules.FHIResourceManager import FHIRResourceManager
+from modules.fake_llm import FakeChatModel
+from modules.schema_utils import (dedupe_record_shapes, project_record_shapes, index_by_path,
+                                  retarget_description)
+
+
+def period(name, description=""):
+    return {"name": name, "type": "RECORD", "mode": "", "description": description, "fields": [
+        {"name": "start", "type": "TIMESTAMP", "mode": "", "description": ""},
+        {"name": "end", "type": "TIMESTAMP", "mode": "", "description": ""},
+    ]}
+
+
+SCHEMA = [
+    {"name": "id", "type": "STRING", "mode": "", "description": ""},
+    period("period"),
+    {"name": "participant", "type": "RECORD", "mode": "REPEATED", "description": "", "fields": [
+        period("period"),
+        period("absence_period"),
+    ]},
+]
+
+
+
+def test_repeated_shapes_are_sent_once():
+    deduped, projections = dedupe_record_shapes(SCHEMA)
+
+    assert projections == {"participant.period": "period", "participant.absence_period": "period"}
+    deduped_index = index_by_path(deduped)
+    assert "period.start" in deduped_index
+    assert "participant.period.start" not in deduped_index
+    assert "participant.absence_period" in deduped_index
+
+
+
+def test_projected_subfields_are_described_for_their_own_parent():
+    """The copied descriptions name the path and the RECORD they were copied to."""
+    deduped, projections = dedupe_record_shapes(SCHEMA)
+    index = index_by_path(deduped)
+    index["period.start"]["description"] = "The period.start element, when the period began."
+    index["period.end"]["description"] = "The end of the encounter period."
+
+    projected = index_by_path(project_record_shapes(deduped, projections))
+
+    assert set(projected) == set(index_by_path(SCHEMA))
+    assert projected["participant.period.start"]["description"] == \
+        "The participant.period.start element, when the period began."
+    assert projected["participant.absence_period.start"]["description"] == \
+        "The participant.absence_period.start element, when the absence period began."
+    assert projected["participant.absence_period.end"]["description"] == \
+        "The end of the encounter absence period."
+
+    # The first occurrence itself is left as it was
+    assert projected["period.start"]["description"] == "The period.start element, when the period began."
+
+
+
+def test_retarget_only_rewrites_whole_names():
+    assert retarget_description("See treatment_room.room_code and the treatment room.",
+                                "location.treatment_room", "location.reserved_room") == \
+        "See reserved_room.room_code and the reserved room."
+    assert retarget_description("The periodic value of location.period.start.",
+                                "location.period", "location.valid_period") == \
+        "The periodic value of location.valid_period.start."
+
+
+
+def test_manager_describes_every_occurrence_by_default():
+    """Without deduplication every RECORD is sent and described in its own context."""
+    llm = FakeChatModel(model_name="fake-model")
+    enriched = FHIRResourceManager(llm, "test.synthetic.fhir_encounters").generate_enriched_schema(SCHEMA)
+
+    index = index_by_path(enriched)
+    assert set(index) == set(index_by_path(SCHEMA))
+    assert "participant.absence_period.end" in index["participant.absence_period.end"]["description"]
+
+
+
+def test_manager_projects_deduplicated_shapes():
+    llm = FakeChatModel(model_name="fake-model")
+    fhir_mgr = FHIRResourceManager(llm, "test.synthetic.fhir_encounters", dedupe_shapes=True)
+    enriched = fhir_mgr.generate_enriched_schema(SCHEMA)
+
+    index = index_by_path(enriched)
+    assert set(index) == set(index_by_path(SCHEMA))
+    assert all(field.get("description") for field in index.values())
+    assert "participant.absence_period.end" in index["participant.absence_period.end"]["description"]
+    assert not fhir_mgr.unresolved_paths
@@ -0,0 +1,104 @@
+import json
+
+from modules.fake_llm import FakeChatModel
+from modules.FHIResourceManager import FHIRResourceManager
+from modules.schema_chunker import TokenBudget, get_model_token_limits, plan_schema_chunks, split_field
+from modules.schema_utils import count_fields, index_by_path, merge_split_records
+
+
+def scalar(name: str) -> dict:
+    return {"name": name, "type": "STRING", "mode": "NULLABLE"}
+
+
+def record(name: str, subfields: list) -> dict:
+    return {"name": name, "type": "RECORD", "mode": "NULLABLE", "fields": subfields}
+
+
+def small_budget(output_tokens_per_field=100) -> TokenBudget:
+    """A budget of 16 fields per chunk on the output side."""
+    return TokenBudget("gpt-4o", max_input_tokens=4000, max_output_tokens=2000,
+                       output_tokens_per_field=output_tokens_per_field)
+
+
+
+def test_model_token_limits_match_the_longest_prefix():
+    """The limits of a model are those of its longest known name prefix, or the conservative default."""
+    assert get_model_token_limits("gpt-4o-mini-2024-07-18")["max_output_tokens"] == 16384
+    assert get_model_token_limits("gpt-4-0613")["max_input_tokens"] == 8192
+    assert get_model_token_limits("gemini-1.5-flash-002")["max_input_tokens"] == 1048576
+    assert get_model_token_limits("some-local-model") == {"max_input_tokens": 8192, "max_output_tokens": 4096}
+
+
+
+def test_budget_limits_leave_room_for_the_prompt():
+    """The prompt tokens come off the input limit, and a safety margin off both limits."""
+    budget = TokenBudget("gpt-4o", max_input_tokens=10000, max_output_tokens=1000, prompt_tokens=500)
+    assert budget.input_limit == 7500
+    assert budget.output_limit == 800
+
+    budget.echo_schema = False
+    fields = [scalar("status")]
+    assert budget.estimate(fields)[1] == budget.output_tokens_per_field
+
+
+
+def test_chunks_fit_the_budget_and_keep_the_schema_order():
+    """Every chunk fits the budget, and the chunks hold all fields in schema order."""
+    schema = [scalar(f"field_{number}") for number in range(50)]
+    budget = small_budget()
+
+    chunks = plan_schema_chunks(schema, budget)
+
+    assert len(chunks) == 4
+    assert all(budget.fits(chunk) for chunk in chunks)
+    assert [field for chunk in chunks for field in chunk] == schema
+
+
+
+def test_small_fields_share_a_chunk():
+    """Cheap fields are packed together instead of a fixed number of fields per chunk."""
+    schema = [scalar(f"field_{number}") for number in range(50)]
+    assert len(plan_schema_chunks(schema, small_budget(output_tokens_per_field=10))) == 1
+
+
+
+def test_oversized_record_is_split_into_pieces():
+    """A RECORD over the budget is split into pieces with its name, which merge back into the RECORD."""
+    wide_record = record("hospitalization", [scalar(f"field_{number}") for number in range(40)]
+                         + [record("nested", [scalar(f"nested_{number}") for number in range(30)])])
+    schema = [scalar("id"), wide_record, scalar("status")]
+    budget = small_budget()
+
+    pieces = split_field(wide_record, budget)
+    assert len(pieces) > 1
+    assert all(piece["name"] == "hospitalization" and budget.fits([piece]) for piece in pieces)
+
+    chunks = plan_schema_chunks(schema, budget)
+    assert all(budget.fits(chunk) for chunk in chunks)
+    assert merge_split_records([field for chunk in chunks for field in chunk]) == schema
+
+
+
+def test_unsplittable_field_gets_its_own_chunk():
+    """A field that cannot be split any further is still sent, on its own."""
+    budget = small_budget(output_tokens_per_field=2000)
+    chunks = plan_schema_chunks([scalar("first"), scalar("second")], budget)
+    assert chunks == [[scalar("first")], [scalar("second")]]
+
+
+
+def test_enrichment_does_not_change_a_shared_budget():
+    """The prompt size and the tier are applied to a copy, so one budget can be shared by several tables."""
+    with open("fhir files/encounters_table_schema.json", "r", encoding="utf-8") as f:
+        schema = json.load(f)
+    budget = TokenBudget("gpt-4o", max_input_tokens=4000, max_output_tokens=4000)
+    before = dict(vars(budget))
+
+    llm = FakeChatModel()
+    enriched_schema = FHIRResourceManager(llm, "test.synthetic.fhir_encounters",
+                                          token_budget=budget).generate_enriched_schema(schema)
+
+    assert vars(budget) == before
+    assert llm.calls > 1
+    assert count_fields(enriched_schema) == count_fields(schema)
+    assert all(field.get("description") for field in index_by_path(enriched_schema).values())
@@ -0,0 +1,127 @@
+import json
+import argparse
+import threading
+
+import generate_description_for_schema as generator
+from modules.fake_llm import FakeChatModel
+
+
+class OverlapChatModel(FakeChatModel):
+    """A fake model whose first two requests only return once both are in flight."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.barrier = threading.Barrier(2, timeout=10)
+        self.waiting = 2
+
+    def invoke(self, input, config=None, **kwargs):
+        with self._lock:
+            wait, self.waiting = self.waiting > 0, self.waiting - 1
+        if wait:
+            self.barrier.wait()
+        return super().invoke(input, config, **kwargs)
+
+
+def batch_config(**batch):
+    return {
+        "bigquery": {"project_id": "test", "dataset_id": "synthetic", "table_id": "fhir_encounters",
+                     "location": "us", "mode": "create"},
+        "files": {"input_schema": "in.json", "output_schema": "out.json", "sql_output": "out.sql"},
+        "llm": {"model": "fake-model"},
+        **({"batch": batch} if batch else {}),
+    }
+
+
+
+def test_single_table_job_without_a_batch_block():
+    jobs = generator.build_table_jobs(batch_config())
+    assert jobs == [{"table_id": "fhir_encounters", "full_table_name": "test.synthetic.fhir_encounters",
+                     "input_schema": "in.json", "output_schema": "out.json", "sql_output": "out.sql"}]
+
+
+
+def test_batch_block_lists_and_globs_tables(tmp_path):
+    """Listed tables come first, then one table per schema file matching the glob."""
+    for name in ("fhir_patient", "fhir_condition"):
+        (tmp_path / f"{name}.json").write_text("[]")
+
+    jobs = generator.build_table_jobs(batch_config(
+        tables=[{"table_id": " fhir_encounters ", "input_schema": "a.json", "output_schema": "b.json",
+                 "sql_output": "c.sql"}],
+        input_glob=str(tmp_path / "fhir_*.json"),
+        output_dir=str(tmp_path / "out")))
+
+    assert [job["table_id"] for job in jobs] == ["fhir_encounters", "fhir_condition", "fhir_patient"]
+    assert jobs[0]["full_table_name"] == "test.synthetic.fhir_encounters"
+    assert jobs[2]["input_schema"] == str(tmp_path / "fhir_patient.json")
+    assert jobs[2]["output_schema"] == str(tmp_path / "out" / "fhir_patient_with_descriptions.json")
+    assert jobs[2]["sql_output"] == str(tmp_path / "out" / "fhir_patient_create_table.sql")
+
+
+
+def table_job(tmp_path, input_schema="fhir files/encounters_table_schema.json"):
+    return {
+        "table_id": "fhir_encounters",
+        "full_table_name": "test.synthetic.fhir_encounters",
+        "input_schema": input_schema,
+        "output_schema": str(tmp_path / "fhir_encounters_with_descriptions.json"),
+        "sql_output": str(tmp_path / "fhir_encounters_create_table.sql"),
+    }
+
+
+def fake_llm_settings():
+    llm_settings = generator.parse_llm_settings(batch_config())
+    llm_settings["model"] = "fake-model"
+    return llm_settings
+
+
+
+def test_process_table_writes_the_schema_and_the_sql(tmp_path):
+    """One table of a batch is described end to end against the fake LLM."""
+    llm_settings = fake_llm_settings()
+    job = table_job(tmp_path)
+    args = argparse.Namespace(resume=False, incremental=False)
+
+    timings = generator.process_table(job, FakeChatModel(), llm_settings, None, "create",
+                                      str(tmp_path / "checkpoints"), args)
+
+    assert timings["status"] == "ok"
+    assert timings["unresolved_fields"] == 0
+    assert {"description_seconds", "enrichment_seconds", "sql_seconds", "total_seconds"} <= set(timings)
+
+    enriched_schema = json.loads((tmp_path / "fhir_encounters_with_descriptions.json").read_text())
+    assert all(field.get("description") for field in enriched_schema)
+    sql = (tmp_path / "fhir_encounters_create_table.sql").read_text()
+    assert "test.synthetic.fhir_encounters" in sql
+
+    # The journal is removed once the enriched schema is saved
+    assert list((tmp_path / "checkpoints").iterdir()) == []
+
+
+
+def test_table_description_overlaps_the_enrichment(tmp_path):
+    """The table description request is in flight while the single chunk is enriched."""
+    schema_path = tmp_path / "schema.json"
+    schema_path.write_text(json.dumps([{"name": "id", "type": "STRING", "mode": "", "description": ""}]))
+    llm = OverlapChatModel()
+
+    timings = generator.process_table(table_job(tmp_path, str(schema_path)), llm, fake_llm_settings(), None,
+                                      "create", str(tmp_path / "checkpoints"),
+                                      argparse.Namespace(resume=False, incremental=False))
+
+    assert timings["status"] == "ok"
+    assert llm.calls == 2
+    assert not llm.barrier.broken
+
+
+
+def test_failed_enrichment_still_returns_the_timings(tmp_path):
+    llm = FakeChatModel(failure_rate=1.0)
+    llm_settings = dict(fake_llm_settings(), max_retries=0, retry_base_delay=0.0)
+
+    timings = generator.process_table(table_job(tmp_path), llm, llm_settings, None, "create",
+                                      str(tmp_path / "checkpoints"), argparse.Namespace(resume=False, incremental=False))
+
+    assert timings["status"] == "failed"
+    assert "total_seconds" in timings
+    assert not (tmp_path / "fhir_encounters_create_table.sql").exists()